@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
+"""Offline bundles: everything an installation needs in one archive.
+
+A bundle is created once, with network access, and copied to any number of
+hosts that then install from it at local disk speed:
+
+```
+setupr-bundle-v1.2.3.tar
+├── MANIFEST.json
+├── backup-restore-v1.2.3.sh
+├── backup-restore-v1.2.3.sig
+├── goss-infrastructure-RHEL.yaml
+├── …
+├── goss-linux-amd64
+├── worldr-aa-v1.2.3.sh
+├── worldr-aa-v1.2.3.sig
+└── xUnit-test-values.yaml
+```
+
+The scripts are verified with their PGP signature when the bundle is
+created, all at once. The manifest records the SHA-256 of every file, which
+is checked when the bundle is opened. The scripts are still verified with
+their PGP signature before being executed, as for any other download.
+
+An opened bundle is used as the only mirror: nothing is downloaded from the
+network (see `setupr.mirrors`).
+"""
+import hashlib
+import json
+import shutil
+import tarfile
+import tempfile
+from pathlib import Path
+
+import pendulum
+import requests
+import structlog
+
+from setupr import __version__
+from setupr.cache import ArtifactCache, default_cache_dir
+from setupr.downloader import WORLDR_URL_INSTALL, download
+from setupr.gbucket import InstallationData, InstallationDataError
+from setupr.gpg import get_gpg
+from setupr.mirrors import get_mirrors
+from setupr.pre_flight import (
+    GOSS_EXE,
+    GOSS_URL,
+    GOSS_VERSION,
+    SHA256SUM,
+    URL_BASE_CHECKS,
+)
+from setupr.utils import file_sha256
+
+rlog = structlog.get_logger("setupr.bundle")
+
+MANIFEST = "MANIFEST.json"
+OPTIONAL_SCRIPTS = ("worldr-debug", "backup-restore")
+OS_TYPES = ("RHEL", "Ubuntu")
+
+
+class BundleError(Exception):
+    """The bundle cannot be created or opened."""
+
+    pass
+
+
+def _required(version: str) -> dict[str, str | None]:
+    """Return the URLs an installation needs, with their known SHA-256."""
+    urls: dict[str, str | None] = {
+        f"{WORLDR_URL_INSTALL}/worldr-aa-{version}.sh": None,
+        f"{WORLDR_URL_INSTALL}/worldr-aa-{version}.sig": None,
+        f"{GOSS_URL}/{GOSS_VERSION}/{GOSS_EXE}": SHA256SUM[GOSS_EXE],
+    }
+    for what in ("security", "infrastructure"):
+        for os_type in OS_TYPES:
+            name = f"goss-{what}-{os_type}.yaml"
+            urls[f"{URL_BASE_CHECKS}/{name}"] = SHA256SUM[name]
+    return urls
+
+
+def _add_values(staging: Path, service_account_json: Path | None) -> None:
+    """Add the installation data to the bundle, if we can get it."""
+    try:
+        data = InstallationData(service_account_json=service_account_json)
+    except InstallationDataError as ex:
+        rlog.warning("Bundle without installation data", error=ex)
+        return
+    data.blob_name = (staging / data.blob_value).as_posix()
+    if not data.get():
+        rlog.warning("Bundle without installation data")
+
+
+def _verify_scripts(staging: Path) -> None:
+    """Verify the signatures of all the scripts in the bundle."""
+    gpg = get_gpg()
+    if not gpg.worldr_key_exists() and not gpg.import_worldr_key():
+        raise BundleError("Cannot import the Worldr PGP key")
+    results = gpg.validate_worldr_signatures(
+        [
+            (script.as_posix(), script.with_suffix(".sig").as_posix())
+            for script in sorted(staging.glob("*.sh"))
+        ]
+    )
+    invalid = [Path(name).name for name, valid in results.items() if not valid]
+    if invalid:
+        raise BundleError(f"Invalid signature for {', '.join(invalid)}")
+
+
+def create(
+    version: str,
+    service_account_json: Path | None = None,
+    destination: Path | None = None,
+) -> Path:
+    """Create the bundle for `version` and return its path.
+
+    The debug and backup scripts are included if they exist at the same
+    version. The installation data is included if there is a service
+    account.
+    """
+    destination = destination or Path.cwd() / f"setupr-bundle-{version}.tar"
+    cache = ArtifactCache()
+    mirrors = get_mirrors()
+    required = _required(version)
+    with tempfile.TemporaryDirectory(prefix="setupr_bundle_") as tmp:
+        staging = Path(tmp)
+        try:
+            download(
+                required,
+                staging.as_posix(),
+                expected_hashes={
+                    url: sha for url, sha in required.items() if sha
+                },
+                cache=cache,
+                mirrors=mirrors,
+            )
+        except requests.exceptions.RequestException as ex:
+            raise BundleError(f"Cannot download {version}: {ex}") from ex
+        for script in OPTIONAL_SCRIPTS:
+            try:
+                download(
+                    (
+                        f"{WORLDR_URL_INSTALL}/{script}-{version}.sh",
+                        f"{WORLDR_URL_INSTALL}/{script}-{version}.sig",
+                    ),
+                    staging.as_posix(),
+                    cache=cache,
+                    mirrors=mirrors,
+                )
+            except requests.exceptions.RequestException as ex:
+                rlog.warning("Bundle without script", script=script, error=ex)
+        _verify_scripts(staging)
+        _add_values(staging, service_account_json)
+        shutil.rmtree(staging / "archives", ignore_errors=True)
+        files = sorted(p for p in staging.iterdir() if p.is_file())
+        manifest = {
+            "version": version,
+            "setupr": __version__,
+            "created": pendulum.now().to_iso8601_string(),
+            "files": {path.name: file_sha256(path) for path in files},
+        }
+        (staging / MANIFEST).write_text(json.dumps(manifest, indent=2))
+        partial = destination.with_name(f"{destination.name}.part")
+        with tarfile.open(partial, "w") as tar:
+            tar.add(staging / MANIFEST, arcname=MANIFEST)
+            for path in files:
+                tar.add(path, arcname=path.name)
+        partial.replace(destination)
+    rlog.info("Bundle created", path=destination, files=len(files))
+    return destination
+
+
+def open_bundle(bundle: Path) -> Path:
+    """Extract the bundle, check it, and return the directory it is in.
+
+    The bundle is extracted once, in the setupr cache, so that opening it
+    again only checks the files.
+    """
+    try:
+        with tarfile.open(bundle) as tar:
+            raw = tar.extractfile(MANIFEST).read()  # type: ignore
+            manifest = json.loads(raw)
+            files = dict(manifest["files"])
+            digest = hashlib.sha256(raw).hexdigest()
+            root = default_cache_dir() / "bundles" / digest
+            for name, sha256 in files.items():
+                path = root / name
+                if Path(name).name != name or name == MANIFEST:
+                    raise BundleError(f"Invalid file name {name}")
+                if path.is_file() and file_sha256(path) == sha256:
+                    continue
+                member = tar.getmember(name)
+                if not member.isfile():
+                    raise BundleError(f"{name} is not a file")
+                root.mkdir(parents=True, exist_ok=True)
+                with tar.extractfile(member) as src:  # type: ignore
+                    with open(path, "wb") as dst:
+                        shutil.copyfileobj(src, dst)
+                if file_sha256(path) != sha256:
+                    path.unlink()
+                    raise BundleError(f"{name} does not match its manifest")
+    except (OSError, KeyError, ValueError, tarfile.TarError) as ex:
+        raise BundleError(f"Cannot open bundle {bundle}: {ex}") from ex
+    rlog.info("Bundle opened", path=root, version=manifest.get("version"))
+    return root
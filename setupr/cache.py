@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
+"""Local, content addressed, cache of downloaded artifacts.
+
+The blobs are stored under their SHA-256 in `objects/` and an index maps
+each URL to its blob and to the validators (ETag and Last-Modified) the
+server sent with it. When the cache grows past its size cap, the least
+recently used blobs are evicted.
+
+```
+~/.cache/setupr/
+├── index.json
+└── objects/
+    └── 827e354b48f93bce933f5efcd1f00dc82569c42a179cf2d384b040d8a80bfbfb
+```
+"""
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from typing import Any, Iterator
+
+import structlog
+
+from setupr.utils import HASH_BLOCK_SIZE, temporary_name, write_json
+
+rlog = structlog.get_logger("setupr.cache")
+
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024  # Bytes.
+LOCK = "index.lock"
+
+
+def default_cache_dir() -> Path:
+    """Return the setupr cache directory, honouring `XDG_CACHE_HOME`."""
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "setupr"
+
+
+class ArtifactCache:
+    """A content addressed cache with LRU eviction.
+
+    The size cap is `max_size` bytes, or the `SETUPR_CACHE_MAX_SIZE`
+    environment variable if it is not given. Nothing is created on disk
+    until something is stored.
+
+    The index is only read and written under a lock, shared by all the
+    caches of this process, and under a file lock, shared with the other
+    processes using the same directory: `--serve-cache`, for example.
+    """
+
+    _lock = Lock()
+
+    def __init__(
+        self, root: Path | None = None, max_size: int | None = None
+    ) -> None:
+        """Initialise."""
+        self.root = root or default_cache_dir()
+        if max_size is None:
+            max_size = int(
+                os.environ.get("SETUPR_CACHE_MAX_SIZE", DEFAULT_MAX_SIZE)
+            )
+        self.max_size = max_size
+        self._objects = self.root / "objects"
+        self._index = self.root / "index.json"
+
+    @contextmanager
+    def _locked(self, create: bool = False) -> Iterator[None]:
+        """Hold the index, see `ArtifactCache`.
+
+        Without `create`, there is nothing to lock if there is no cache.
+        """
+        with self._lock:
+            if not create and not self.root.is_dir():
+                yield
+                return
+            self.root.mkdir(parents=True, exist_ok=True)
+            with open(self.root / LOCK, "a") as fd:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _load(self) -> dict[str, Any]:
+        """Load the index, an empty one if it is missing or corrupted."""
+        try:
+            with open(self._index) as fd:
+                index = dict(json.load(fd))
+        except (OSError, ValueError, TypeError):
+            index = {}
+        index.setdefault("urls", {})
+        index.setdefault("blobs", {})
+        return index
+
+    def _dump(self, index: dict[str, Any]) -> None:
+        """Write the index atomically."""
+        write_json(self._index, index)
+
+    def path(self, sha256: str) -> Path:
+        """Return where the blob for `sha256` lives."""
+        return self._objects / sha256
+
+    def lookup(self, url: str) -> dict[str, Any] | None:
+        """Return the cache entry of `url` if its blob is still there."""
+        with self._locked():
+            entry = self._load()["urls"].get(url)
+        if entry is None or not self.path(entry["sha256"]).is_file():
+            return None
+        return dict(entry)
+
+    def urls(self) -> list[str]:
+        """Return the URLs the cache has an entry for."""
+        with self._locked():
+            return list(self._load()["urls"])
+
+    def conditional_headers(self, url: str) -> dict[str, str]:
+        """Return the headers to revalidate the cached copy of `url`."""
+        entry = self.lookup(url)
+        if entry is None:
+            return {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def copy_to(self, sha256: str, destination: Path) -> bool:
+        """Copy the blob `sha256` to `destination`, if we have it.
+
+        It is a copy rather than a link since the destination might be
+        modified (made executable, for example). The copy is hashed: a blob
+        that no longer matches its SHA-256 is evicted, and not copied.
+        """
+        blob = self.path(sha256)
+        if not blob.is_file():
+            return False
+        tmp = temporary_name(destination)
+        digest = hashlib.sha256()
+        with open(blob, "rb") as src, open(tmp, "wb") as dst:
+            for block in iter(lambda: src.read(HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+                dst.write(block)
+        if digest.hexdigest() != sha256:
+            tmp.unlink()
+            rlog.error(
+                "Corrupted blob", sha256=sha256, found=digest.hexdigest()
+            )
+            self.discard(sha256)
+            return False
+        os.replace(tmp, destination)
+        with self._locked():
+            index = self._load()
+            if sha256 in index["blobs"]:
+                index["blobs"][sha256]["used"] = time.time()
+                self._dump(index)
+        rlog.info("Served from cache", sha256=sha256, path=destination)
+        return True
+
+    def discard(self, sha256: str) -> None:
+        """Remove the blob `sha256`, and the URLs that point to it."""
+        with self._locked():
+            self.path(sha256).unlink(missing_ok=True)
+            index = self._load()
+            if index["blobs"].pop(sha256, None) is None:
+                return
+            index["urls"] = {
+                url: entry
+                for url, entry in index["urls"].items()
+                if entry["sha256"] != sha256
+            }
+            self._dump(index)
+
+    def store(
+        self,
+        url: str,
+        source: Path,
+        sha256: str,
+        etag: str | None = None,
+        last_modified: str | None = None,
+    ) -> None:
+        """Store `source`, downloaded from `url`, in the cache.
+
+        Failing to cache is not an error: we already have the file.
+        """
+        blob = self.path(sha256)
+        try:
+            self._objects.mkdir(parents=True, exist_ok=True)
+            if not blob.is_file():
+                tmp = temporary_name(blob)
+                shutil.copyfile(source, tmp)
+                os.replace(tmp, blob)
+        except OSError as ex:
+            rlog.warning("Could not cache", url=url, error=ex)
+            return
+        with self._locked(create=True):
+            index = self._load()
+            index["urls"][url] = {
+                "sha256": sha256,
+                "etag": etag,
+                "last_modified": last_modified,
+            }
+            index["blobs"][sha256] = {
+                "size": blob.stat().st_size,
+                "used": time.time(),
+            }
+            self._evict(index)
+            self._dump(index)
+        rlog.debug("Cached", url=url, sha256=sha256)
+
+    def _evict(self, index: dict[str, Any]) -> None:
+        """Evict the least recently used blobs until we fit in the cap."""
+        blobs = index["blobs"]
+        total = sum(blob["size"] for blob in blobs.values())
+        for sha256 in sorted(blobs, key=lambda sha: blobs[sha]["used"]):
+            if total <= self.max_size:
+                break
+            total -= blobs.pop(sha256)["size"]
+            self.path(sha256).unlink(missing_ok=True)
+            rlog.info("Evicted from cache", sha256=sha256)
+        index["urls"] = {
+            url: entry
+            for url, entry in index["urls"].items()
+            if entry["sha256"] in blobs
+        }
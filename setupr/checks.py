@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
+"""Results of the pre-flight checks.
+
+goss is run with `--format json`, which reports every test of every
+resource with its outcome and duration, see `SuiteResult.from_goss`.
+Durations are in nanoseconds, like goss's.
+"""
+import json
+import os
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Iterable, Mapping
+
+GOSS_SKIPPED = 2  # The `result` of a skipped test, 0 is success, 1 failure.
+
+
+@dataclass(frozen=True)
+class CheckResult:
+    """One test of one resource, e.g. that a file exists."""
+
+    resource_type: str
+    resource_id: str
+    property: str
+    successful: bool
+    skipped: bool = False
+    duration: int = 0
+    message: str = ""
+
+    @classmethod
+    def from_goss(cls, data: Mapping[str, Any]) -> "CheckResult":
+        """Parse an entry of the `results` of goss's JSON output."""
+        return cls(
+            resource_type=str(data.get("resource-type", "")),
+            resource_id=str(data.get("resource-id", "")),
+            property=str(data.get("property", "")),
+            successful=bool(data.get("successful", False)),
+            skipped=data.get("result") == GOSS_SKIPPED,
+            duration=int(data.get("duration") or 0),
+            message=str(data.get("summary-line") or data.get("err") or ""),
+        )
+
+
+@dataclass(frozen=True)
+class SuiteResult:
+    """A suite of checks, from one or more goss processes.
+
+    `retcode` is negative if goss was killed, see `cancelled`. `error` is
+    what goss said when it could not run the checks at all.
+    """
+
+    what: str
+    retcode: int
+    checks: tuple[CheckResult, ...] = ()
+    duration: int = 0
+    error: str = ""
+
+    @property
+    def cancelled(self) -> bool:
+        """Return True if goss was killed before it was done."""
+        return self.retcode < 0
+
+    @property
+    def passed(self) -> bool:
+        """Return True if all the checks passed, or were skipped."""
+        return self.retcode == 0 and not self.failures
+
+    @property
+    def failures(self) -> list[CheckResult]:
+        """Return the checks that failed."""
+        return [
+            check
+            for check in self.checks
+            if not check.successful and not check.skipped
+        ]
+
+    def slowest(self, count: int = 5) -> list[CheckResult]:
+        """Return the count slowest checks, slowest first."""
+        return sorted(self.checks, key=lambda c: c.duration, reverse=True)[
+            :count
+        ]
+
+    @classmethod
+    def from_goss(
+        cls,
+        what: str,
+        retcode: int,
+        stdout: bytes,
+        stderr: bytes = b"",
+        duration: int = 0,
+    ) -> "SuiteResult":
+        """Parse the JSON output of a goss process."""
+        try:
+            results = json.loads(stdout)["results"] or []
+            checks = tuple(CheckResult.from_goss(entry) for entry in results)
+        except (ValueError, KeyError, TypeError):
+            checks = ()
+        error = stderr.decode("utf-8", errors="replace").strip()
+        if not checks and retcode > 0 and not error:
+            error = stdout.decode("utf-8", errors="replace").strip()
+        return cls(what, retcode, checks, duration, error)
+
+    @classmethod
+    def merge(
+        cls, what: str, parts: Iterable["SuiteResult"], duration: int = 0
+    ) -> "SuiteResult":
+        """Merge the results of goss processes that ran concurrently.
+
+        The return code is the first that is not 0: a cancellation first.
+        """
+        parts = list(parts)
+        retcodes = [part.retcode for part in parts]
+        retcode = min(retcodes, default=0)
+        if retcode >= 0:
+            retcode = next((code for code in retcodes if code != 0), 0)
+        return cls(
+            what,
+            retcode,
+            tuple(check for part in parts for check in part.checks),
+            duration,
+            "\n".join(part.error for part in parts if part.error),
+        )
+
+    def dump(self, path: Path) -> None:
+        """Write the results to path, as compact JSON."""
+        with os.fdopen(
+            os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC), "w"
+        ) as fd:
+            json.dump(asdict(self), fd, separators=(",", ":"))
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> "SuiteResult":
+        """Return the results from their `dataclasses.asdict` form."""
+        return cls(
+            **{
+                **data,
+                "checks": tuple(
+                    CheckResult(**check) for check in data.get("checks", ())
+                ),
+            }
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "SuiteResult":
+        """Read results written by `dump`."""
+        return cls.from_dict(json.loads(path.read_text()))
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 # Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
 """Command wrapping other functionalty with useful user output."""
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+
 import structlog
 
-from setupr.gpg import GPG
+from setupr.gpg import get_gpg
 from setupr.pre_flight import PreFlight
 from setupr.print import wprint
 
@@ -15,7 +18,7 @@ def pgp_key() -> bool:
 
     We cannot continue without it.
     """
-    _gpg = GPG()
+    _gpg = get_gpg()
     if not _gpg.worldr_key_exists():
         msg = "Worldr PGP key not found, attempted to import it"
         rlog.warning(msg)
@@ -31,27 +34,50 @@ def pgp_key() -> bool:
     return True
 
 
-def pre_flight() -> bool:
+def pre_flight(full: bool = False, cancel: Event | None = None) -> bool:
     """Pre flight check.
 
     The security ones are advisory only so we can continue if they fail.
     On the other hand, the infrastructure ones are mandatory and we
     cannot continue if they fail.
+
+    Both suites run concurrently, each in its own goss process. If the
+    infrastructure ones fail, the security ones are cancelled: we are not
+    continuing anyway.
+
+    With `full`, every check runs, rather than those whose inputs changed
+    since they last passed. Setting `cancel` stops both suites, and it is
+    set when the infrastructure ones fail.
     """
-    _pre_flight = PreFlight()
-    if _pre_flight.security() != 0:
-        msg = "Pre flight security checks failed. This is advisory only"
-        rlog.warning(msg)
-        wprint(msg, level="warning")
-    else:
-        wprint(
-            "Security pre flight checks passed, all is well.", level="success"
-        )
-    if _pre_flight.infrastructure() != 0:
-        msg = "Pre fight infrastructure checks failed. This is mandatory."
-        rlog.error(msg)
-        wprint(msg, level="failure")
-        return False
+    _pre_flight = PreFlight(full)
+    cancel = cancel or Event()
+    with ThreadPoolExecutor(
+        max_workers=1, thread_name_prefix="setupr-goss"
+    ) as pool:
+        security = pool.submit(_pre_flight.security, cancel)
+        try:
+            infrastructure = _pre_flight.infrastructure(cancel)
+        except BaseException:
+            cancel.set()
+            raise
+        if infrastructure.cancelled:
+            rlog.warning("Pre flight checks cancelled.")
+            return False
+        if not infrastructure.passed:
+            cancel.set()
+            msg = "Pre fight infrastructure checks failed. This is mandatory."
+            rlog.error(msg)
+            wprint(msg, level="failure")
+            return False
+        if not security.result().passed:
+            msg = "Pre flight security checks failed. This is advisory only"
+            rlog.warning(msg)
+            wprint(msg, level="warning")
+        else:
+            wprint(
+                "Security pre flight checks passed, all is well.",
+                level="success",
+            )
     wprint(
         "Infrastructure pre flight checks passed, all is well.",
         level="success",
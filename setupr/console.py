@@ -1,29 +1,30 @@
 # -*- coding: utf-8 -*-
 # Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
-"""Console entry point."""
+"""Console entry point.
+
+Only what is needed to parse the command line is imported here, so that
+`--version` and `--help` are instant. Everything else (rich, structlog,
+requests, google.cloud, gnupg, plumbum…) is imported by the code paths that
+need it.
+"""
 import logging
 import logging.config
+import signal
 import sys
 from pathlib import Path
-from typing import Any, Mapping
+from typing import TYPE_CHECKING, Any, Callable, Mapping
 
 import click
-import semver  # type: ignore
-import structlog
 from click_help_colors import HelpColorsCommand  # type: ignore
-from rich.console import Console
-from rich.prompt import Confirm
-from rich.traceback import install
 
 from setupr import __version__
-from setupr.commands import pgp_key, pre_flight
-from setupr.downloader import Downloader
-from setupr.gbucket import InstallationData, InstallationDataError
-from setupr.print import COLOUR_INFO, wprint
-from setupr.utils import VersionCheck, check_if_latest_version
 
-# Rich.
-install(show_locals=True)
+if TYPE_CHECKING:  # pragma: no cover
+    from concurrent.futures import Future
+    from threading import Event
+
+    from setupr.downloader import Downloader
+    from setupr.utils import VersionCheck
 
 EXIT_CODE_SUCCESS = 0
 EXIT_CODE_OPERATION_FAILED = 1
@@ -32,19 +33,20 @@ EXIT_CODE_SERVICE_ACCOUNT_FAILED = 3
 EXIT_CODE_YAML_DATA_FAILED = 4
 
 
-pre_chain = [
-    # Add the log level and a timestamp to the event_dict if the log entry
-    # is not from structlog.
-    structlog.stdlib.add_log_level,
-    # Add extra attributes of LogRecord objects to the event dictionary
-    # so that values passed in the extra parameter of log methods pass
-    # through to log output.
-    structlog.stdlib.ExtraAdder(),
-]
-
-
 def configure_logging(log_level: str, verbose: bool) -> None:
     """Configure all the logging."""
+    import structlog
+
+    pre_chain = [
+        # Add the log level and a timestamp to the event_dict if the log
+        # entry is not from structlog.
+        structlog.stdlib.add_log_level,
+        # Add extra attributes of LogRecord objects to the event dictionary
+        # so that values passed in the extra parameter of log methods pass
+        # through to log output.
+        structlog.stdlib.ExtraAdder(),
+    ]
+
     # Logging levels
     # https://www.structlog.org/en/stable/_modules/structlog/_log_levels.html?highlight=log%20level  # noqa: E501
     _lvl = {
@@ -228,10 +230,14 @@ def validate_semver(
     """
     if value is None:
         return None
+    import semver  # type: ignore
+
     try:
         ver = semver.VersionInfo.parse(value)
         return ver
     except ValueError as ex:
+        import structlog
+
         # We do want to wrap `ex` in a new exception
         # so that click can handle it properly.
         rlog = structlog.get_logger("validate_semver")
@@ -248,7 +254,7 @@ def validate_semver(
     "-i",
     "--install",
     cls=MutuallyExclusiveOption,
-    mutually_exclusive=["debug", "backup"],
+    mutually_exclusive=["debug", "backup", "bundle_create"],
     default=None,
     nargs=1,
     type=str,
@@ -263,7 +269,7 @@ def validate_semver(
     "-d",
     "--debug",
     cls=MutuallyExclusiveOption,
-    mutually_exclusive=["install", "backup"],
+    mutually_exclusive=["install", "backup", "bundle_create"],
     default=None,
     nargs=1,
     type=str,
@@ -279,7 +285,7 @@ def validate_semver(
     "--backup",
     default=None,
     cls=MutuallyExclusiveOption,
-    mutually_exclusive=["debug", "install"],
+    mutually_exclusive=["debug", "install", "bundle_create"],
     nargs=1,
     type=str,
     metavar="<semver>",
@@ -289,6 +295,42 @@ def validate_semver(
         "download the backup & restore script with signature to verify it."
     ),
 )
+@click.option(
+    "--bundle-create",
+    cls=MutuallyExclusiveOption,
+    mutually_exclusive=["install", "debug", "backup", "from_bundle"],
+    default=None,
+    nargs=1,
+    type=str,
+    metavar="<semver>",
+    callback=validate_semver,
+    help=(
+        "Download everything needed to install <semver> into one archive, "
+        "to be used with --from-bundle on hosts without network access."
+    ),
+)
+@click.option(
+    "--serve-cache",
+    cls=MutuallyExclusiveOption,
+    mutually_exclusive=["install", "debug", "backup", "bundle_create"],
+    default=None,
+    type=str,
+    metavar="<[host:]port>",
+    help=(
+        "Serve the local download cache over HTTP, e.g. on 8765, for the "
+        "other hosts to use as a mirror. Files "
+        "that are not cached yet are fetched once, when first requested."
+    ),
+)
+@click.option(
+    "--from-bundle",
+    cls=MutuallyExclusiveOption,
+    mutually_exclusive=["bundle_create"],
+    default=None,
+    type=click.Path(exists=True, dir_okay=False),
+    metavar="<bundle.tar>",
+    help="Take all the files from a bundle rather than from the network.",
+)
 @click.option(
     "-s",
     "--service-account",
@@ -300,6 +342,26 @@ def validate_semver(
         "if not provided, the program will guess…"
     ),
 )
+@click.option(
+    "-m",
+    "--mirror",
+    "mirrors",
+    multiple=True,
+    metavar="<url>",
+    help=(
+        "A mirror of the files to download, such as file:///srv/worldr or "
+        "an intranet HTTP server. Can be repeated, and added to by the "
+        "SETUPR_MIRRORS environment variable. The fastest is used."
+    ),
+)
+@click.option(
+    "--full",
+    is_flag=True,
+    help=(
+        "Run all the pre-flight checks, rather than only those that failed "
+        "or whose inputs changed since they last passed."
+    ),
+)
 @click.option(
     "-l",
     "--log-level",
@@ -320,7 +382,12 @@ def main(
     install: click.Option,
     debug: click.Option,
     backup: click.Option,
+    bundle_create: click.Option,
+    serve_cache: str,
+    from_bundle: str,
     service_account: str,
+    mirrors: tuple[str, ...],
+    full: bool,
     log_level: str,
     version: bool,
     verbose: bool,
@@ -336,6 +403,21 @@ def main(
         click.echo(__version__)
         sys.exit(EXIT_CODE_SUCCESS)
 
+    # The heavy imports, now that we know we need them.
+    import structlog
+    from rich.console import Console
+    from rich.traceback import install as install_traceback
+
+    from setupr.downloader import handle_sigint
+    from setupr.mirrors import configure
+    from setupr.print import COLOUR_INFO, wprint
+
+    # Rich.
+    install_traceback(show_locals=True)
+
+    # Let the downloads stop cleanly on Ctrl-C.
+    signal.signal(signal.SIGINT, handle_sigint)
+
     # Configure logging.
     configure_logging(log_level, verbose)
     logger = structlog.get_logger("setupr")
@@ -348,19 +430,30 @@ def main(
     console = Console()
     console.rule(f"[{COLOUR_INFO}]WORLDR setupr script")
 
-    # Check latest version.
-    _version_check()
+    # Configure where to download from.
+    bundle = _open_bundle(logger, from_bundle)
+    check = None
+    if bundle is None:
+        configure(mirrors)
+        check = _start_version_check()  # Reported when it matters.
+    else:
+        configure([bundle.as_uri()], offline=True)
 
     # Run commands.
-    if install is not None:
-        _install(logger, service_account)
+    if bundle_create is not None:
+        _bundle_create(logger, bundle_create, service_account)
+    elif serve_cache is not None:
+        _serve_cache(logger, serve_cache)
+    elif install is not None:
+        _install(logger, install, service_account, bundle, check, full)
     elif debug is not None:
-        _debug(logger, debug)
+        _debug(logger, debug, check)
     elif backup is not None:
-        _backup(logger, backup)
+        _backup(logger, backup, check)
     else:
         wprint(
-            "You [i]must[/i] specify -i, -b, or -d and a semver version",
+            "You [i]must[/i] specify -i, -b, -d, or --bundle-create and a "
+            "semver version, or --serve-cache",
             level="warning",
         )
         logger.error("You must specify an option.")
@@ -372,9 +465,32 @@ def main(
     sys.exit(EXIT_CODE_SUCCESS)
 
 
-def _version_check() -> None:
-    """Check if we are running the latest verion from GitHub."""
-    check = check_if_latest_version()
+def _start_version_check() -> "Future[VersionCheck]":
+    """Start checking for the latest version from GitHub, in background."""
+    from setupr.utils import start_version_check
+
+    return start_version_check()
+
+
+def _version_check(future: "Future[VersionCheck] | None") -> None:
+    """Report if we are running the latest verion from GitHub.
+
+    This is called just before it matters, that is before running a script.
+    If the check has not finished by then, we do not wait for it.
+    """
+    import structlog
+    from rich.prompt import Confirm
+
+    from setupr.print import wprint
+    from setupr.utils import VersionCheck
+
+    if future is None or not future.done():
+        structlog.get_logger("setupr").debug("Version check not finished.")
+        return
+    if future.exception() is not None:
+        check = VersionCheck.UNKNOWN
+    else:
+        check = future.result()
     if check == VersionCheck.LATEST:
         wprint(f"This is the latest version {__version__}.", level="info")
     elif check == VersionCheck.LAGGING:
@@ -395,36 +511,141 @@ def _version_check() -> None:
         wprint("This is bug, please report!", level="error")
 
 
-def _install(logger: Any, service_account: str) -> None:
+def _service_account_path(service_account: str | None) -> Path | None:
+    """Convert the service account option to a Path.
+
+    We cannot set it as default to "" since that will cause an error at the
+    click level: it will complain that this file does not exists. However,
+    we should be able to not specify the option, so it could be None.
+    However, then Path will raise because you cannot instanciate it with
+    None. Urgh.
+    """
+    return None if service_account is None else Path(str(service_account))
+
+
+def _open_bundle(logger: Any, from_bundle: str | None) -> Path | None:
+    """Open the bundle, if any, and return where its files are."""
+    if from_bundle is None:
+        return None
+    from setupr.bundle import BundleError, open_bundle
+    from setupr.print import wprint
+
+    try:
+        bundle = open_bundle(Path(from_bundle))
+    except BundleError as ex:
+        logger.error("Error", ex=ex)
+        wprint(f"{ex}.", level="failure")
+        sys.exit(EXIT_CODE_OPERATION_FAILED)
+    wprint(f"Using bundle [i]{from_bundle}[/i], offline.", level="info")
+    return bundle
+
+
+def _bundle_create(
+    logger: Any, bundle_create: click.Option, service_account: str
+) -> None:
+    """Run the bundle create command."""
+    from setupr.bundle import BundleError, create
+    from setupr.print import wprint
+
+    wprint(
+        f"Creating a bundle for version [b]{bundle_create}[/b]", level="info"
+    )
+    try:
+        path = create(
+            f"v{bundle_create}", _service_account_path(service_account)
+        )
+    except BundleError as ex:
+        logger.error("Failure to create bundle.", ex=ex)
+        wprint(f"{ex}.", level="failure")
+        sys.exit(EXIT_CODE_OPERATION_FAILED)
+    wprint(f"Bundle created: [i]{path}[/i]", level="success")
+    logger.info("Success", bundle=path)
+
+
+def _serve_cache(logger: Any, serve_cache: str) -> None:
+    """Run the serve cache command, until interrupted."""
+    from setupr.print import wprint
+    from setupr.serve import parse_address, serve
+
+    try:
+        address = parse_address(serve_cache)
+    except ValueError:
+        wprint(f"Invalid address {serve_cache}.", level="failure")
+        sys.exit(EXIT_CODE_OPERATION_FAILED)
+    wprint(
+        f"Serving the cache on port [b]{address[1]}[/b], Ctrl-C to stop.",
+        level="info",
+    )
+    try:
+        serve(address)
+    except OSError as ex:
+        logger.error("Failure to serve the cache.", ex=ex)
+        wprint(f"Cannot serve the cache: {ex}.", level="failure")
+        sys.exit(EXIT_CODE_OPERATION_FAILED)
+    logger.info("Success", command="serve-cache")
+
+
+def _get_script(
+    dlr: "Downloader",
+    what: str,
+    version: str,
+    cancel: "Event | None" = None,
+    **steps: Callable[[], Any],
+) -> dict[str, bool | None]:
+    """Get the Worldr key and the script of what, and verify the script.
+
+    The key import, the download and the other steps all run concurrently.
+    Only the verification of the signature waits, for the key and the script.
+    If a step fails, `cancel` is set for the others to stop early.
+    Return whether each step succeeded, None if it did not run.
+    """
+    from functools import partial
+
+    from setupr.commands import pgp_key
+    from setupr.scheduler import Scheduler
+
+    scheduler = Scheduler(cancel=cancel)
+    scheduler.add("key", pgp_key)
+    scheduler.add("download", partial(dlr.download, what, version))
+    scheduler.add(
+        "verify",
+        partial(dlr.verify, what, version),
+        after=("key", "download"),
+    )
+    for name, func in steps.items():
+        scheduler.add(name, func)
+    return scheduler.run()
+
+
+def _install(
+    logger: Any,
+    install: click.Option,
+    service_account: str,
+    bundle: Path | None = None,
+    check: "Future[VersionCheck] | None" = None,
+    full: bool = False,
+) -> None:
     """Run the install command.
 
     https://www.structlog.org/en/stable/typing.html#type-hints
 
     This explains why we are using Any for the logger.
     """
+    from functools import partial
+    from threading import Event
+
+    from setupr.commands import pre_flight
+    from setupr.downloader import Downloader
+    from setupr.gbucket import InstallationData, InstallationDataError
+    from setupr.print import wprint
+
     dlr = Downloader()
     data = None
     try:
-        path = None
-        # We need to covert that option to a Path. We cannot set it as
-        # default to "" since that will cause an error at the click level:
-        # it will complain that this file does not exists. However, we
-        # should be able to not specify the option, so it could be None.
-        # However, then Path will raise because you cannot instanciate it
-        # with None. Urgh.
-        if service_account is None:
-            path = None
-        else:
-            path = Path(str(service_account))
-        data = InstallationData(service_account_json=path)
-        if data.fetch():
-            wprint("Got YAML installation data.", level="info")
-        else:
-            wprint(
-                "YAML installation data was not found. We cannot proceed.",
-                level="failure",
-            )
-            sys.exit(EXIT_CODE_YAML_DATA_FAILED)
+        data = InstallationData(
+            service_account_json=_service_account_path(service_account),
+            bundle=bundle,
+        )
     except InstallationDataError as ex:
         logger.error("Error", ex=ex)
         wprint(f"{ex}.", level="failure")
@@ -439,14 +660,43 @@ def _install(logger: Any, service_account: str) -> None:
         f"Downloading [i]installation[/i] script at version [b]{install}[/b]",  # noqa: E501
         level="info",
     )
-    if (
-        not pgp_key()
-        or not pre_flight()
-        or not dlr.get("install", f"v{install}")
-    ):
+    fetch = data.fetch
+    errors: list[InstallationDataError] = []
+
+    def _values() -> bool:
+        """Fetch the installation data, keeping what went wrong."""
+        try:
+            return fetch()
+        except InstallationDataError as ex:
+            errors.append(ex)
+            return False
+
+    cancel = Event()
+    done = _get_script(
+        dlr,
+        "install",
+        f"v{install}",
+        cancel,
+        values=_values,
+        pre_flight=partial(pre_flight, full, cancel),
+    )
+    if errors:
+        logger.error("Error", ex=errors[0])
+        wprint(f"{errors[0]}.", level="failure")
+        sys.exit(EXIT_CODE_SERVICE_ACCOUNT_FAILED)
+    if done["values"] is False:
+        wprint(
+            "YAML installation data was not found. We cannot proceed.",
+            level="failure",
+        )
+        sys.exit(EXIT_CODE_YAML_DATA_FAILED)
+    if done["values"]:
+        wprint("Got YAML installation data.", level="info")
+    if not all(done.values()):
         logger.error("Failure to get install script.", version=install)
         wprint("Failure to get install script.", level="failure")
         sys.exit(EXIT_CODE_OPERATION_FAILED)
+    _version_check(check)
     if not dlr.execute_script(
         "worldr-aa",
         f"v{install}",
@@ -459,35 +709,51 @@ def _install(logger: Any, service_account: str) -> None:
     logger.info("Success", script="install")
 
 
-def _debug(logger: Any, debug: click.Option) -> None:
+def _debug(
+    logger: Any,
+    debug: click.Option,
+    check: "Future[VersionCheck] | None" = None,
+) -> None:
     """Run the debug command."""
+    from setupr.downloader import Downloader
+    from setupr.print import wprint
+
     dlr = Downloader()
     wprint(
         f"Downloading [i]debugging[/i] script at version [b]{debug}[/b]",
         level="info",
     )
-    if not pgp_key() or not dlr.get("debug", f"v{debug}"):
+    if not all(_get_script(dlr, "debug", f"v{debug}").values()):
         logger.error("Failure to get debug script.", version=debug)
         wprint("Failure to get debug script.", level="failure")
         sys.exit(EXIT_CODE_OPERATION_FAILED)
+    _version_check(check)
     if not dlr.execute_script("worldr-debug", f"v{debug}", "", []):
-        logger.error("Failure to execute debug script.", version=install)
+        logger.error("Failure to execute debug script.", version=debug)
         wprint("Debug script failed.", level="failure")
         sys.exit(EXIT_CODE_SCRIPT_FAILED)
     logger.info("Success", script="debug")
 
 
-def _backup(logger: Any, backup: click.Option) -> None:
+def _backup(
+    logger: Any,
+    backup: click.Option,
+    check: "Future[VersionCheck] | None" = None,
+) -> None:
     """Run the backup command."""
+    from setupr.downloader import Downloader
+    from setupr.print import wprint
+
     dlr = Downloader()
     wprint(
         f"Downloading [i]backup & restore[/i] script at version [b]{backup}[/b]",  # noqa: E501
         level="info",
     )
-    if not pgp_key() or not dlr.get("backup", f"v{backup}"):
+    if not all(_get_script(dlr, "backup", f"v{backup}").values()):
         logger.error("Failure to get backup script.", version=backup)
         wprint("Failure to get backup script.", level="failure")
         sys.exit(EXIT_CODE_OPERATION_FAILED)
+    _version_check(check)
     logger.info("Success", script="backup-restore")
 
 
@@ -1,34 +1,43 @@
 # -*- coding: utf-8 -*-
 # Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
 """Requests to get thing from URL and verify their PGP signatures."""
+import errno
+import hashlib
+import json
 import logging
 import os
-import signal
+import random
 import stat
-from concurrent.futures import ThreadPoolExecutor
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from functools import partial
 from pathlib import Path
 from threading import Event
 from types import FrameType
-from typing import Iterable
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Iterable,
+    Mapping,
+    NoReturn,
+    Sequence,
+    TypeVar,
+)
 
-import pendulum
 import requests
 import structlog
+import urllib3
 from plumbum import local  # type: ignore
 from rich.console import Console
-from rich.progress import (
-    BarColumn,
-    DownloadColumn,
-    Progress,
-    TaskID,
-    TextColumn,
-    TimeRemainingColumn,
-    TransferSpeedColumn,
-)
+from rich.progress import Progress, TaskID
 from rich.prompt import Confirm
-from sha256sum import sha256sum
 
-from setupr.gpg import GPG
+from setupr.cache import ArtifactCache
+from setupr.gpg import get_gpg
+from setupr.mirrors import Mirrors, get_mirrors
 from setupr.print import (
     COLOUR_FAIL,
     COLOUR_GREY,
@@ -37,32 +46,92 @@ from setupr.print import (
     COLOUR_WARN,
     wprint,
 )
-
-progress = Progress(
-    TextColumn("[bold blue]{task.fields[filename]}", justify="right"),
-    BarColumn(bar_width=None),
-    "[progress.percentage]{task.percentage:>3.1f}%",
-    "•",
-    DownloadColumn(),
-    "•",
-    TransferSpeedColumn(),
-    "•",
-    TimeRemainingColumn(),
-)
+from setupr.progress import get_progress
+from setupr.session import MAX_WORKERS, get_session
+from setupr.utils import file_sha256
 
 rlog = structlog.get_logger("setupr.downloader")
 
-CHUNK_SIZE = 8 * 1024
+CHUNK_SIZE = 64 * 1024  # Smallest transfer buffer.
+MAX_CHUNK_SIZE = 4 * 1024 * 1024  # Largest transfer buffer.
+FILL_TIME = 0.25  # Seconds, see `_stream`.
+PART_SUFFIX = ".part"  # Incomplete download.
+STATE_SUFFIX = ".part.json"  # What we need to resume the download.
+# No content encoding: byte ranges, offsets and digests are all counted on
+# the bytes of the resource itself.
+IDENTITY = {"Accept-Encoding": "identity"}
+SEGMENT_THRESHOLD = 8 * 1024 * 1024  # Smaller files use a single stream.
+RETRY_STATUSES = frozenset((416, 429, 500, 502, 503, 504))
 WORLDR_URL_INSTALL = "https://storage.googleapis.com/worldr-install"
+SCRIPTS = {  # The script of each command.
+    "install": "worldr-aa",
+    "debug": "worldr-debug",
+    "backup": "backup-restore",
+}
 
 done_event = Event()
 
 
+T = TypeVar("T")
+
+
+class DigestMismatchError(requests.exceptions.RequestException):
+    """The downloaded content does not have the expected SHA-256."""
+
+    pass
+
+
+class TransientHTTPError(requests.exceptions.HTTPError):
+    """The server failed in a way that is worth retrying."""
+
+    def __init__(
+        self, *args: Any, retry_after: float | None = None, **kwargs: Any
+    ) -> None:
+        """Initialise, with the delay the server asked for, if any."""
+        super().__init__(*args, **kwargs)
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """How transient download failures are retried.
+
+    The delay before each retry is drawn at random between zero and an
+    exponentially growing cap (full jitter), unless the server asked for a
+    specific delay with `Retry-After`. No retry is attempted once `budget`
+    seconds would be exceeded.
+    """
+
+    attempts: int = 5
+    backoff: float = 0.5  # Seconds, cap of the first delay.
+    max_backoff: float = 30.0  # Seconds.
+    budget: float = 300.0  # Seconds, for all the attempts.
+
+    def delay(self, attempt: int, retry_after: float | None = None) -> float:
+        """Return how long to wait after the failed attempt (from 0)."""
+        if retry_after is not None:
+            return max(0.0, retry_after)
+        cap = min(self.max_backoff, self.backoff * 2**attempt)
+        return random.uniform(0, cap)  # nosec B311 not for cryptography.
+
+
+RETRY = RetryPolicy()
+RETRYABLE = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    TransientHTTPError,
+)
+
+
 def handle_sigint(
     signum: int, frame: FrameType | None
 ) -> None:  # pragma: no cover
     """Handle SIGINT signal.
 
+    It is installed by the console, so that importing this module has no
+    side effect.
+
     There is little point in unit testing this function. A functional
     test would take a lot of setup for very gain.
     """
@@ -70,63 +139,712 @@ def handle_sigint(
     done_event.set()
 
 
-signal.signal(signal.SIGINT, handle_sigint)
+def _retry_after(value: str | None) -> float | None:
+    """Parse a `Retry-After` header: seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return None
+
+
+def _raise_for_status(
+    path: str | None, response: requests.Response
+) -> NoReturn:
+    """Raise the error matching the status of a failed request.
+
+    On 416, the partial download of `path`, if given, is discarded so that
+    the retry starts over. Either way, the error carries the response.
+    """
+    rlog.warning("URL cannot be downloaded", code=response.status_code)
+    if path is not None and response.status_code == 416:
+        # The range of our partial download is not satisfiable.
+        _discard_partial(path)
+    if response.status_code in RETRY_STATUSES:
+        raise TransientHTTPError(
+            f"{response.status_code} for {response.url}",
+            retry_after=_retry_after(response.headers.get("retry-after")),
+            response=response,
+        )
+    raise requests.exceptions.HTTPError(
+        f"{response.status_code} for {response.url}", response=response
+    )
+
+
+def _with_retries(
+    policy: RetryPolicy, url: str, attempt: Callable[[], T]
+) -> T:
+    """Call attempt until it succeeds, retrying the transient failures."""
+    started = time.monotonic()
+    for count in range(policy.attempts):
+        try:
+            return attempt()
+        except RETRYABLE as ex:
+            delay = policy.delay(count, getattr(ex, "retry_after", None))
+            if (
+                count + 1 >= policy.attempts
+                or time.monotonic() - started + delay > policy.budget
+            ):
+                rlog.error("Giving up", url=url, attempts=count + 1)
+                raise
+            rlog.warning("Retrying", url=url, delay=delay, error=ex)
+            if done_event.wait(delay):
+                raise  # SIGINT received while waiting.
+    raise ValueError(f"Invalid retry policy: {policy}")
+
+
+def _failover(
+    policy: RetryPolicy,
+    url: str,
+    sources: Sequence[str],
+    attempt: Callable[[str], T],
+) -> T:
+    """Call attempt with each source in turn until one succeeds.
+
+    Each source gets its transient failures retried first. The partial
+    download is kept when failing over, so the next source resumes it.
+    """
+    for source in sources[:-1]:
+        try:
+            return _with_retries(policy, source, partial(attempt, source))
+        except requests.exceptions.RequestException as ex:
+            if done_event.is_set():
+                raise
+            rlog.warning("Failing over", url=url, source=source, error=ex)
+    return _with_retries(policy, sources[-1], partial(attempt, sources[-1]))
+
+
+def _load_partial(path: str, url: str) -> dict[str, Any]:
+    """Return what is needed to resume downloading `url` to `path`.
+
+    The state is empty if there is nothing (usable) to resume from.
+    """
+    try:
+        with open(f"{path}{STATE_SUFFIX}") as fd:
+            state = dict(json.load(fd))
+        size = Path(f"{path}{PART_SUFFIX}").stat().st_size
+    except (OSError, ValueError, TypeError):
+        return {}
+    if (
+        state.get("url") != url
+        or not (state.get("etag") or state.get("last_modified"))
+        or not 0 < int(state.get("offset", 0)) <= size
+    ):
+        return {}
+    return state
+
+
+def _save_partial(path: str, state: dict[str, Any]) -> None:
+    """Record how far we got so the download can be resumed.
+
+    Without a validator we could not tell if the resource changed since,
+    so there is no point in recording anything.
+    """
+    if state["offset"] and (state.get("etag") or state.get("last_modified")):
+        with open(f"{path}{STATE_SUFFIX}", "w") as fd:
+            json.dump(state, fd)
+        rlog.info("Partial download kept", path=path, offset=state["offset"])
+
+
+def _discard_partial(path: str) -> None:
+    """Remove the partial download and its state."""
+    Path(f"{path}{PART_SUFFIX}").unlink(missing_ok=True)
+    Path(f"{path}{STATE_SUFFIX}").unlink(missing_ok=True)
+
+
+def _request(
+    url: str,
+    state: dict[str, Any],
+    headers: dict[str, str],
+    validate: bool = True,
+) -> requests.Response:
+    """Request the url, or only the bytes we are missing.
+
+    With `validate`, `If-Range` makes the server send the whole resource if
+    it changed since the partial download was made. Without, the caller
+    checks the digest of the whole file instead.
+    """
+    if state:
+        headers["Range"] = f"bytes={state['offset']}-"
+        if validate:
+            headers["If-Range"] = state.get("etag") or state["last_modified"]
+        rlog.info("Resuming", url=url, offset=state["offset"])
+    response = get_session().get(
+        url, stream=True, headers={**headers, **IDENTITY}
+    )
+    if response.status_code == 206 and not response.headers.get(
+        "content-range", ""
+    ).startswith(f"bytes {state.get('offset')}-"):
+        # This is not the range we asked for, start afresh.
+        response.close()
+        response = get_session().get(url, stream=True, headers=IDENTITY)
+    return response
+
+
+def _revalidate(
+    url: str,
+    state: dict[str, Any],
+    expected_hash: str | None,
+    cache: ArtifactCache | None,
+) -> dict[str, str]:
+    """Return the headers to revalidate our cached copy of the url.
+
+    There is no need when we know which content we want: it would have been
+    served from the cache already if we had it.
+    """
+    if cache is None or state or expected_hash is not None:
+        return {}
+    return cache.conditional_headers(url)
+
+
+def _serve_from_cache(
+    task_id: TaskID,
+    path: str,
+    progress: Progress,
+    sha256: str | None,
+    cache: ArtifactCache | None,
+) -> bool:
+    """Copy the blob `sha256` from the cache to path, if we have it."""
+    if (
+        cache is None
+        or sha256 is None
+        or not cache.copy_to(sha256, Path(path))
+    ):
+        return False
+    size = Path(path).stat().st_size
+    progress.update(task_id, total=size, completed=size)
+    progress.start_task(task_id)
+    return True
+
+
+def _preallocate(fd: int, offset: int, length: int) -> None:
+    """Reserve the disk blocks for length bytes from offset.
+
+    This limits fragmentation and fails early if the disk is full. It is
+    only an optimisation, so it is skipped where it is not supported.
+    """
+    if length <= 0 or not hasattr(os, "posix_fallocate"):
+        return
+    try:
+        os.posix_fallocate(fd, offset, length)
+    except OSError as ex:
+        if ex.errno == errno.ENOSPC:
+            raise
+        rlog.debug("Cannot preallocate", error=ex)
+
+
+def _adapt(size: int, elapsed: float) -> int:
+    """Return the next buffer size given how long the last one took.
+
+    Fast transfers get larger buffers, thus fewer writes and updates, and
+    slow ones smaller buffers, so that progress is still reported.
+    """
+    if elapsed < FILL_TIME:
+        return min(size * 2, MAX_CHUNK_SIZE)
+    if elapsed > 4 * FILL_TIME:
+        return max(size // 2, CHUNK_SIZE)
+    return size
+
+
+def _stream(
+    response: requests.Response,
+    sink: Callable[[memoryview], None],
+    cancel: Event | None,
+) -> bool:
+    """Stream the body of the response into sink.
+
+    The body is read into one reusable buffer, so there is no allocation
+    per chunk, and sink is only called once the buffer is full: one write,
+    one hash update, and one progress update per buffer. Whatever was read
+    is always handed to sink, even on error or interruption, so that the
+    caller knows how far it got.
+
+    The body is not decoded, see `IDENTITY`: `readinto` never returns more
+    than the buffer holds, and offsets match the byte ranges.
+
+    Returns False if SIGINT was received or cancel is set.
+    """
+    response.raw.decode_content = False
+    view = memoryview(bytearray(CHUNK_SIZE))
+    filled = 0
+    started = time.monotonic()
+    try:
+        while count := response.raw.readinto(view[filled:]):
+            filled += count
+            if filled == len(view):
+                sink(view)
+                filled = 0
+                size = _adapt(len(view), time.monotonic() - started)
+                if size != len(view):
+                    view = memoryview(bytearray(size))
+                started = time.monotonic()
+            if done_event.is_set() or (cancel is not None and cancel.is_set()):
+                return False
+    except urllib3.exceptions.HTTPError as ex:
+        raise requests.exceptions.ConnectionError(ex) from ex
+    finally:
+        if filled:
+            sink(view[:filled])
+    return True
+
+
+def _hash_prefix(dest_file: BinaryIO, offset: int) -> "hashlib._Hash":
+    """Hash the first `offset` bytes of a partial download.
+
+    The rest of the file is dropped and the position is left at `offset`,
+    ready for the missing bytes.
+    """
+    digest = hashlib.sha256()
+    dest_file.seek(0)
+    while dest_file.tell() < offset:
+        digest.update(
+            dest_file.read(min(CHUNK_SIZE, offset - dest_file.tell()))
+        )
+    dest_file.truncate(offset)
+    return digest
+
+
+def copy_url(
+    task_id: TaskID,
+    url: str,
+    path: str,
+    progress: Progress,
+    cancel: Event | None = None,
+    expected_hash: str | None = None,
+    cache: ArtifactCache | None = None,
+    retry: RetryPolicy = RETRY,
+    sources: Sequence[str] = (),
+) -> str:
+    """Copy data from a url to a local file and return its SHA-256.
+
+    Transient failures (connection errors, timeouts, 5xx and 429 responses)
+    are retried according to `retry`. Each retry resumes from the last byte
+    received, see below.
+
+    The data is fetched from `sources`, mirrors of the url, in order: when
+    one fails, the next one resumes the transfer. The url itself is the
+    only source by default, and is what the cache and partial downloads are
+    keyed on.
+
+    With a `cache`, no request is made if the expected content is already
+    cached. Otherwise, the cached copy of the url is revalidated with a
+    conditional request and the newly downloaded content is cached.
+
+    The data goes to `path` with a `.part` suffix, which is renamed once
+    complete. If the transfer does not complete, a `.part.json` file
+    records the validators and the offset so the next call only asks for
+    the missing bytes.
+
+    The digest is computed while streaming so the file is never read back,
+    except for the bytes of a partial download we resume from. If it does
+    not match `expected_hash`, the file is removed and `DigestMismatchError`
+    is raised.
+
+    The transfer stops early if SIGINT was received or if `cancel` is set,
+    which `download` does when a sibling transfer failed. An empty digest
+    is returned in that case since the file is incomplete.
+    """
+    return _failover(
+        retry,
+        url,
+        list(sources) or [url],
+        partial(
+            _copy_url_once,
+            task_id,
+            url,
+            path,
+            progress,
+            cancel,
+            expected_hash,
+            cache,
+        ),
+    )
+
 
+def _copy_url_once(
+    task_id: TaskID,
+    url: str,
+    path: str,
+    progress: Progress,
+    cancel: Event | None,
+    expected_hash: str | None,
+    cache: ArtifactCache | None,
+    source: str,
+) -> str:
+    """Copy data from a url, or a mirror, to a local file: one attempt.
 
-def copy_url(task_id: TaskID, url: str, path: str, progress: Progress) -> None:
-    """Copy data from a url to a local file."""
-    rlog.info("Requesting", url=url)
-    response = requests.get(url, stream=True)
+    A partial download made from another source is resumed without
+    validation when the expected digest is known, since it is checked.
+    """
+    if _serve_from_cache(task_id, path, progress, expected_hash, cache):
+        return str(expected_hash)
+    rlog.info("Requesting", url=url, source=source)
+    state = _load_partial(path, url)
+    same_source = state.get("source", url) == source
+    response = _request(
+        source,
+        state,
+        _revalidate(url, state, expected_hash, cache),
+        same_source or expected_hash is None,
+    )
+    if response.status_code == 304:
+        entry = cache.lookup(url) if cache is not None else None
+        if entry and _serve_from_cache(
+            task_id, path, progress, entry["sha256"], cache
+        ):
+            return str(entry["sha256"])
+        response = _request(source, state, {})  # It was evicted meanwhile.
 
-    if response.status_code != 200:
-        rlog.warning("URL cannot be downloaded", code=response.status_code)
-        raise requests.exceptions.RequestException()
+    if response.status_code == 206:
+        offset = int(state["offset"])
+    elif response.status_code != 200:
+        _raise_for_status(path, response)
+    else:
+        offset = 0
+    if response.status_code == 200 or not same_source:
+        state = {
+            "url": url,
+            "source": source,
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+        }
 
+    length = response.headers.get("content-length")
     progress.update(
-        task_id, total=int(str(response.headers.get("content-length")))
+        task_id,
+        total=offset + int(length) if length is not None else None,
+        completed=offset,
     )
-    with os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT), "wb") as dest_file:
+    part = f"{path}{PART_SUFFIX}"
+    with os.fdopen(os.open(part, os.O_RDWR | os.O_CREAT), "r+b") as dest_file:
+        digest = _hash_prefix(dest_file, offset)
+        if length is not None and not response.headers.get("content-encoding"):
+            _preallocate(dest_file.fileno(), offset, int(length))
         progress.start_task(task_id)
-        for data in response.iter_content(chunk_size=4096):
+
+        def _write(data: memoryview) -> None:
+            nonlocal offset
             dest_file.write(data)
+            digest.update(data)
+            offset += len(data)
             progress.update(task_id, advance=len(data))
-            if done_event.is_set():
-                return
+
+        complete = False
+        try:
+            complete = _stream(response, _write, cancel)
+        finally:
+            dest_file.truncate(offset)  # In case we preallocated too much.
+            if not complete:
+                dest_file.flush()
+                _save_partial(path, {**state, "offset": offset})
+        if not complete:
+            return ""
+    if expected_hash is not None and digest.hexdigest() != expected_hash:
+        _discard_partial(path)
+        rlog.error("Wrong hash", url=url, sha256=digest.hexdigest())
+        raise DigestMismatchError(f"{url} does not match {expected_hash}")
+    os.replace(part, path)
+    Path(f"{path}{STATE_SUFFIX}").unlink(missing_ok=True)
     rlog.info("Downloaded", path=path)
+    if cache is not None:
+        cache.store(
+            url,
+            Path(path),
+            digest.hexdigest(),
+            state.get("etag"),
+            state.get("last_modified"),
+        )
+    return digest.hexdigest()
 
 
-def download(urls: Iterable[str], dest_dir: str) -> None:
-    """Download multiple files to the given directory."""
-    progress = Progress(
-        TextColumn("[bold blue]{task.fields[filename]}", justify="right"),
-        BarColumn(bar_width=None),
-        "[progress.percentage]{task.percentage:>3.1f}%",
-        "•",
-        DownloadColumn(),
-        "•",
-        TransferSpeedColumn(),
-        "•",
-        TimeRemainingColumn(),
-    )
-    with progress, ThreadPoolExecutor(max_workers=4) as pool:
-        for url in urls:
-            filename = url.split("/")[-1]
-            dest_path = take_backup(Path(dest_dir) / Path(filename))
-            task_id = progress.add_task(
-                "download", filename=filename, start=False
+def _probe(url: str) -> requests.Response | None:
+    """Probe the url to see if it can be downloaded in segments.
+
+    The response is returned if the server supports byte ranges and the
+    file is large enough for it to be worth it.
+    """
+    response = get_session().head(url, allow_redirects=True, headers=IDENTITY)
+    length = int(response.headers.get("content-length", 0))
+    if (
+        response.status_code != 200
+        or response.headers.get("accept-ranges") != "bytes"
+        or length < SEGMENT_THRESHOLD
+    ):
+        rlog.debug("Not segmented", url=url, code=response.status_code)
+        return None
+    return response
+
+
+class _SegmentedCopy:
+    """A file downloaded as byte ranges over several connections.
+
+    Each range is written at its offset in a preallocated `.part` file.
+    Since the ranges complete out of order, the digest is computed once
+    they are all written. A segment retries its transient failures from its
+    last byte, but there is no resume across runs: a failed segmented
+    download starts over.
+    """
+
+    def __init__(
+        self,
+        probe: requests.Response,
+        path: str,
+        retry: RetryPolicy,
+        fallbacks: Sequence[str] = (),
+    ) -> None:
+        """Initialise and preallocate the `.part` file.
+
+        The segments are fetched from the probed URL, and from `fallbacks`
+        if it fails.
+        """
+        self.url = probe.url  # Redirections are followed once only.
+        self.path = path
+        self._retry = retry
+        self._sources = [self.url, *fallbacks]
+        self.length = int(probe.headers["content-length"])
+        self.etag = probe.headers.get("etag")
+        self.last_modified = probe.headers.get("last-modified")
+        self._part = f"{path}{PART_SUFFIX}"
+        self._fd = os.open(self._part, os.O_RDWR | os.O_CREAT | os.O_TRUNC)
+        _preallocate(self._fd, 0, self.length)
+        os.ftruncate(self._fd, self.length)
+
+    def submit(
+        self,
+        pool: ThreadPoolExecutor,
+        task_id: TaskID,
+        progress: Progress,
+        cancel: Event,
+        count: int,
+    ) -> list[Future[None]]:
+        """Submit one copy per segment to the pool."""
+        size = -(-self.length // count)  # Ceiling division.
+        progress.update(task_id, total=self.length)
+        progress.start_task(task_id)
+        return [
+            pool.submit(
+                self._copy_range,
+                task_id,
+                start,
+                min(start + size, self.length) - 1,
+                progress,
+                cancel,
             )
-            future = pool.submit(
-                copy_url, task_id, url, dest_path.as_posix(), progress
+            for start in range(0, self.length, size)
+        ]
+
+    def _copy_range(
+        self,
+        task_id: TaskID,
+        start: int,
+        end: int,
+        progress: Progress,
+        cancel: Event,
+    ) -> None:
+        """Copy the bytes from start to end, inclusive.
+
+        Transient failures are retried, or failed over to the next source,
+        from the last byte received.
+        """
+        offset = start
+
+        def _write(data: memoryview) -> None:
+            nonlocal offset
+            os.pwrite(self._fd, data, offset)
+            offset += len(data)
+            progress.update(task_id, advance=len(data))
+
+        def _attempt(source: str) -> None:
+            response = get_session().get(
+                source,
+                stream=True,
+                headers={"Range": f"bytes={offset}-{end}", **IDENTITY},
             )
-            future.result()
+            if response.status_code != 206:
+                _raise_for_status(None, response)
+            if not _stream(response, _write, cancel):
+                return
+            if offset != end + 1:
+                raise requests.exceptions.ConnectionError(
+                    f"Range {start}-{end} of {self.url} is short: {offset}"
+                )
+
+        _failover(self._retry, self.url, self._sources, _attempt)
+
+    def finish(
+        self, url: str, expected_hash: str | None, cache: ArtifactCache | None
+    ) -> str:
+        """Check the digest of the complete file and move it in place."""
+        os.close(self._fd)
+        if done_event.is_set():
+            return ""
+        digest = file_sha256(Path(self._part))
+        if expected_hash is not None and digest != expected_hash:
+            _discard_partial(self.path)
+            rlog.error("Wrong hash", url=url, sha256=digest)
+            raise DigestMismatchError(f"{url} does not match {expected_hash}")
+        os.replace(self._part, self.path)
+        rlog.info("Downloaded", path=self.path, segmented=True)
+        if cache is not None:
+            cache.store(
+                url, Path(self.path), digest, self.etag, self.last_modified
+            )
+        return digest
+
+    def abort(self) -> None:
+        """Release the file, the caller is about to raise."""
+        try:
+            os.close(self._fd)
+        except OSError:  # Already closed.
+            pass
+        _discard_partial(self.path)
+
+
+def _is_current(path: Path, expected_hash: str | None) -> bool:
+    """Return True if path already has the expected hash."""
+    if expected_hash is None or not path.is_file():
+        return False
+    if file_sha256(path) != expected_hash:
+        return False
+    rlog.info("Already downloaded", path=path)
+    return True
+
+
+def _should_segment(
+    url: str, expected_hash: str | None, cache: ArtifactCache | None
+) -> requests.Response | None:
+    """Return the probe if the url should be downloaded in segments.
+
+    No point if the cache already has the content.
+    """
+    if (
+        cache is not None
+        and expected_hash is not None
+        and cache.path(expected_hash).is_file()
+    ):
+        return None
+    return _probe(url)
+
+
+def download(
+    urls: Iterable[str],
+    dest_dir: str,
+    max_workers: int = MAX_WORKERS,
+    expected_hashes: Mapping[str, str] | None = None,
+    cache: ArtifactCache | None = None,
+    check_existing: bool = True,
+    segmented: bool = False,
+    retry: RetryPolicy = RETRY,
+    mirrors: Mirrors | None = None,
+) -> dict[str, str]:
+    """Download multiple files to the given directory.
+
+    Every transfer is submitted to the pool before any is waited upon, so
+    they all overlap. The first failure is re-raised: the transfers that
+    have not started yet are cancelled and those in flight are told to stop.
+
+    Returns the SHA-256 of each file keyed by its URL. The files with an
+    entry in `expected_hashes` are checked as they are downloaded. See
+    `copy_url` for how the `cache` is used.
+
+    With `check_existing`, a file that is already in `dest_dir` with its
+    expected hash is neither downloaded nor backed up.
+
+    With `segmented`, large files are probed with HEAD and, if the server
+    supports it, fetched as byte ranges over `max_workers` connections.
+    The segments are submitted to the same pool as the other transfers.
+
+    Each transfer, or segment, retries its transient failures with `retry`.
+
+    With `mirrors`, all the sources of all the urls are probed first and
+    each file is fetched from its fastest source, failing over to the next
+    ones.
+    """
+    urls = list(urls)
+    sources = mirrors.rank(urls) if mirrors else {}
+    expected_hashes = expected_hashes or {}
+    current: dict[str, str] = {}
+    progress = get_progress()
+    get_session(max_workers)  # One pooled connection per worker.
+    cancel = Event()
+    futures: dict[str, Future[str]] = {}
+    copies: dict[str, _SegmentedCopy] = {}
+    pending: list[Future[Any]] = []
+    tasks: list[TaskID] = []
+    try:
+        with progress, ThreadPoolExecutor(max_workers=max_workers) as pool:
+            try:
+                for url in urls:
+                    dest_path = Path(dest_dir) / Path(url.split("/")[-1])
+                    expected_hash = expected_hashes.get(url)
+                    url_sources = sources.get(url, [url])
+                    if check_existing and _is_current(
+                        dest_path, expected_hash
+                    ):
+                        current[url] = str(expected_hash)
+                        continue
+                    take_backup(dest_path)
+                    task_id = progress.add_task(
+                        "download", filename=dest_path.name, start=False
+                    )
+                    tasks.append(task_id)
+                    probe = (
+                        _should_segment(url_sources[0], expected_hash, cache)
+                        if segmented
+                        else None
+                    )
+                    if probe is None:
+                        futures[url] = pool.submit(
+                            copy_url,
+                            task_id,
+                            url,
+                            dest_path.as_posix(),
+                            progress,
+                            cancel,
+                            expected_hash,
+                            cache,
+                            retry,
+                            url_sources,
+                        )
+                        pending.append(futures[url])
+                    else:
+                        copies[url] = _SegmentedCopy(
+                            probe, dest_path.as_posix(), retry, url_sources[1:]
+                        )
+                        pending += copies[url].submit(
+                            pool, task_id, progress, cancel, max_workers
+                        )
+                for future in as_completed(pending):
+                    future.result()
+            except BaseException:
+                cancel.set()
+                for future in pending:
+                    future.cancel()
+                pool.shutdown(wait=True)
+                for copy in copies.values():
+                    copy.abort()
+                raise
+    finally:
+        for task_id in tasks:
+            progress.remove_task(task_id)
+    for url, copy in copies.items():
+        current[url] = copy.finish(url, expected_hashes.get(url), cache)
+    return current | {url: future.result() for url, future in futures.items()}
 
 
 def take_backup(filename: Path) -> Path:
     """Move the file to a backup one with the date."""
+    import pendulum
+
     _archive = filename.parent / "archives"
     if not _archive.is_dir():
         rlog.warning("Creating bacckup directory", dir=_archive)
-        _archive.mkdir()
+        _archive.mkdir(exist_ok=True)  # Maybe by another thread, meanwhile.
     if filename.is_file():
         new_name = f"{_archive}/{filename.stem}_{pendulum.now().to_iso8601_string()}{filename.suffix}"  # noqa
         filename.rename(new_name)
@@ -136,13 +854,29 @@ def take_backup(filename: Path) -> Path:
 class Downloader:
     """A class wrapping the download and verify process."""
 
-    def __init__(self) -> None:
-        """Initialize the class."""
-        self._gpg = GPG()
+    def __init__(
+        self,
+        max_workers: int = MAX_WORKERS,
+        cache: ArtifactCache | None = None,
+        retry: RetryPolicy = RETRY,
+        mirrors: Mirrors | None = None,
+    ) -> None:
+        """Initialize the class.
+
+        `max_workers` is the number of files downloaded concurrently.
+        `cache` defaults to the user's setupr cache directory.
+        `retry` is how transient network failures are retried.
+        `mirrors` defaults to the mirrors configured for this run.
+        """
+        self._gpg = get_gpg()
+        self._max_workers = max_workers
+        self._cache = cache or ArtifactCache()
+        self._retry = retry
+        self._mirrors = mirrors if mirrors is not None else get_mirrors()
         rlog.debug("Downloader Initialized")
 
-    def _get_files(self, what: str, version: str) -> bool:
-        """Download and verify some files."""
+    def _download_files(self, what: str, version: str) -> bool:
+        """Download a script and its signature, without verifying them."""
         try:
             script = f"{what}-{version}.sh"
             signature = f"{what}-{version}.sig"
@@ -152,12 +886,13 @@ class Downloader:
                     f"{WORLDR_URL_INSTALL}/{signature}",
                 ),
                 Path.cwd().as_posix(),
+                self._max_workers,
+                cache=self._cache,
+                retry=self._retry,
+                mirrors=self._mirrors,
             )
             (Path.cwd() / script).chmod(stat.S_IRWXU)
-            return self._gpg.validate_worldr_signature(
-                (Path.cwd() / script).as_posix(),
-                (Path.cwd() / signature).as_posix(),
-            )
+            return True
         except requests.exceptions.RequestException as ex:
             if logging.root.level <= logging.DEBUG:  # pragma: no cover
                 rlog.exception(ex)
@@ -169,26 +904,83 @@ class Downloader:
             rlog.error("Could not write script", script=what, error=ex)
             return False
 
+    def _verify_files(self, what: str, version: str) -> bool:
+        """Verify the signature of a downloaded script."""
+        try:
+            return self._gpg.validate_worldr_signature(
+                (Path.cwd() / f"{what}-{version}.sh").as_posix(),
+                (Path.cwd() / f"{what}-{version}.sig").as_posix(),
+            )
+        except OSError as ex:
+            rlog.error("Could not read script", script=what, error=ex)
+            return False
+
+    def _get_files(self, what: str, version: str) -> bool:
+        """Download and verify some files."""
+        return self._download_files(what, version) and self._verify_files(
+            what, version
+        )
+
+    def _script(self, what: str) -> str | None:
+        """Return the name of the script for the command what."""
+        if what not in SCRIPTS:
+            rlog.warning("Option not supported", option=what)
+            return None
+        return SCRIPTS[what]
+
+    def download(self, what: str, version: str) -> bool:
+        """Download the script of a command and its signature.
+
+        The signature is checked by `verify`, which needs the Worldr key.
+        """
+        script = self._script(what)
+        if script is None:
+            return False
+        rlog.info("Downloading script", script=script)
+        return self._download_files(script, version)
+
+    def verify(self, what: str, version: str) -> bool:
+        """Verify the script of a command downloaded by `download`."""
+        script = self._script(what)
+        return script is not None and self._verify_files(script, version)
+
     def get(self, what: str, version: str) -> bool:
         """Download a file and its signature to verify it."""
-        if what in ["install"]:
-            rlog.info("Downloading installation script")
-            return self._get_files("worldr-aa", version)
-        if what in ["debug"]:
-            rlog.info("Downloading debug script")
-            return self._get_files("worldr-debug", version)
-        if what in ["backup"]:
-            rlog.info("Downloading backup script")
-            return self._get_files("backup-restore", version)
-        rlog.warning("Option not supported", option=what)
-        return False
+        script = self._script(what)
+        if script is None:
+            return False
+        rlog.info("Downloading script", script=script)
+        return self._get_files(script, version)
 
     def fetch(
-        self, source: str, destination: Path, expected_hash: str
+        self,
+        source: str,
+        destination: Path,
+        expected_hash: str,
+        check_existing: bool = True,
+        segmented: bool = False,
     ) -> bool:
-        """Fetch a package from the Internet and verifies it."""
+        """Fetch a package from the Internet and verifies it.
+
+        With `check_existing`, nothing is fetched if `destination` already
+        has the expected hash. With `segmented`, a large package is fetched
+        over several connections.
+        """
         try:
-            download((source,), destination.parent.as_posix())
+            digests = download(
+                (source,),
+                destination.parent.as_posix(),
+                self._max_workers,
+                {source: expected_hash},
+                self._cache,
+                check_existing,
+                segmented,
+                self._retry,
+                self._mirrors,
+            )
+        except DigestMismatchError:
+            rlog.error("Wrong hash", file=destination)
+            return False
         except requests.exceptions.RequestException as ex:
             if logging.root.level <= logging.DEBUG:  # pragma: no cover
                 rlog.exception(ex)
@@ -199,8 +991,8 @@ class Downloader:
                 rlog.exception(ex)
             rlog.error("Could not write script", script=source, error=ex)
             return False
-        if expected_hash != sha256sum(destination.as_posix()):
-            rlog.error("Wrong hash", file=destination)
+        if digests.get(source) != expected_hash:
+            rlog.error("Incomplete download", file=destination)
             return False
         return True
 
@@ -226,7 +1018,7 @@ class Downloader:
             rlog.info("User aborted")
             return True  # Nothing happened, therefore it is not an error.
 
-        # Verify the script's signature again.
+        # Verify the script's signature again: a hash, if it has not changed.
         if not self._gpg.validate_worldr_signature(
             (Path.cwd() / script).as_posix(),
             (Path.cwd() / signature).as_posix(),
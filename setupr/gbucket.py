@@ -10,11 +10,10 @@ blob = bucket.blob("test-values.yaml")
 blob.download_to_filename("test-values.yaml")
 ```
 """
+import shutil
 from pathlib import Path
 
 import structlog
-from google.cloud import storage  # type: ignore
-from google.cloud.exceptions import NotFound
 
 from setupr.utils import join_with_oxford_commas
 
@@ -30,8 +29,17 @@ class InstallationDataError(AttributeError):
 class InstallationData:
     """Get installation data from Google Cloud Storage bucket."""
 
-    def __init__(self, service_account_json: Path | None = None) -> None:
-        """Initialize."""
+    def __init__(
+        self,
+        service_account_json: Path | None = None,
+        bundle: Path | None = None,
+    ) -> None:
+        """Initialize.
+
+        With an opened `bundle` (see `setupr.bundle`), the installation
+        data is taken from it when it has them.
+        """
+        self._bundle = bundle
         self.service_account_json = service_account_json
         if not self.service_account_json:
             sa_files = sorted(Path(".").glob("*.sa.json"))
@@ -64,6 +72,17 @@ class InstallationData:
         there is not point in enforcing it. If that is desired, use the `fetch`
         method.
         """
+        if (
+            self._bundle is not None
+            and (self._bundle / self.blob_value).is_file()
+        ):
+            shutil.copyfile(self._bundle / self.blob_value, self.blob_name)
+            rlog.info(f"Copied {self.blob_name} from bundle {self._bundle}")
+            return True
+        # This is slow to import, and only needed here.
+        from google.cloud import storage  # type: ignore
+        from google.cloud.exceptions import NotFound
+
         storage_client = storage.Client.from_service_account_json(
             self.service_account_json
         )
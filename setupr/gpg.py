@@ -1,13 +1,36 @@
 # -*- coding: utf-8 -*-
 # Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
-"""All the things to do with GPG."""
+"""All the things to do with GPG.
+
+Starting gpg is slow, so it is only started when needed. Whether the
+Worldr key is in the keyring is remembered in a stamp, keyed on the
+keyring's size and modification time: as long as the keyring is unchanged,
+the key is known to be there without asking gpg.
+
+One GPG context is shared by the whole run, see `get_gpg`. It remembers the
+signatures it found good by the SHA-256 of the file and of the signature:
+checking the same file again only hashes it, which still catches tampering.
+Many signatures are checked at once by `GPG.validate_worldr_signatures`.
+"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path, PurePath
+from threading import Lock
+from typing import Any, Iterable
 
 import gnupg  # type: ignore
 import structlog
 
+from setupr.cache import default_cache_dir
+from setupr.utils import file_sha256, write_json
+
 rlog = structlog.get_logger("setupr.gpg")
 
+KEYRINGS = ("pubring.kbx", "pubring.gpg")  # GnuPG 2.1+, then older ones.
+STAMP = "worldr-key.json"
+VERIFY_WORKERS = 4  # gpg processes verifying signatures concurrently.
+
 
 class GPG:
     """All the things to do with GPG."""
@@ -16,15 +39,67 @@ class GPG:
     _fingerprint = "935D282626A16D1A0430487D65A277F7800F774C"
 
     def __init__(self) -> None:
-        """Initialize."""
-        self._gpg = gnupg.GPG()
+        """Initialize, without starting gpg."""
+        self._gnupg: Any = None  # gnupg.GPG, which has no type hints.
+        self._lock = Lock()
+        self._verified: set[tuple[str, str, str]] = set()
+
+    @property
+    def _gpg(self) -> Any:
+        """Return the gpg wrapper, starting gpg the first time."""
+        with self._lock:
+            if self._gnupg is None:
+                self._gnupg = gnupg.GPG()
+            return self._gnupg
+
+    def _keyring_stamp(self) -> dict[str, Any] | None:
+        """Return what identifies the current state of the keyring."""
+        home = Path(os.environ.get("GNUPGHOME") or Path.home() / ".gnupg")
+        for name in KEYRINGS:
+            try:
+                info = (home / name).stat()
+            except OSError:
+                continue
+            return {
+                "fingerprint": self._fingerprint,
+                "keyring": (home / name).as_posix(),
+                "size": info.st_size,
+                "mtime_ns": info.st_mtime_ns,
+            }
+        return None
+
+    def _save_stamp(self) -> None:
+        """Remember that the key is in the keyring, as it is now."""
+        stamp = self._keyring_stamp()
+        if stamp is None:
+            return
+        path = default_cache_dir() / STAMP
+        try:
+            write_json(path, stamp)
+        except OSError as ex:
+            rlog.warning("Could not save stamp", path=path, error=ex)
 
     def worldr_key_exists(self) -> bool:
-        """Check if the worldr key exists in the local key ring."""
-        return any(
+        """Check if the worldr key exists in the local key ring.
+
+        gpg is only asked about that key, if the keyring changed since it
+        was last found.
+        """
+        stamp = self._keyring_stamp()
+        try:
+            saved = json.loads((default_cache_dir() / STAMP).read_text())
+        except (OSError, ValueError):
+            saved = None
+        if stamp is not None and saved == stamp:
+            rlog.debug("Worldr key found, keyring unchanged.")
+            return True
+        found = any(
             self._fingerprint == key["fingerprint"]
-            for key in self._gpg.list_keys()
+            for key in self._gpg.list_keys(keys=[self._fingerprint])
         )
+        if found:
+            self._save_stamp()
+        return found
 
     def import_worldr_key(self) -> bool:
         """Import the included Worldr PGP key."""
@@ -46,16 +121,73 @@ class GPG:
                 import_result.fingerprints[0], "TRUST_ULTIMATE"
             )
             rlog.info("Key is set to trust ultimate.")
+            self._save_stamp()
             return True
         rlog.error("Could not import PGP key")
         return False
 
     def validate_worldr_signature(self, filename: str, signature: str) -> bool:
-        """Validate a worldr signature."""
+        """Validate a worldr signature.
+
+        A signature already found valid, and made by the Worldr key, for
+        the same file is not checked again by gpg.
+        """
+        key = (
+            file_sha256(Path(filename)),
+            file_sha256(Path(signature)),
+            self._fingerprint,
+        )
+        with self._lock:
+            if key in self._verified:
+                rlog.debug("Signature of file already verified", file=filename)
+                return True
         with open(signature, "rb") as stream:
             verified = self._gpg.verify_file(stream, filename)
             if verified.status == "signature bad":
                 rlog.error("Signature of is bad.", file=filename)
                 return False
             rlog.info("Signature of file is good", file=filename)
+            if verified.valid and verified.pubkey_fingerprint == key[2]:
+                with self._lock:
+                    self._verified.add(key)  # Signed by the Worldr key.
             return True
+
+    def validate_worldr_signatures(
+        self, pairs: Iterable[tuple[str, str]]
+    ) -> dict[str, bool]:
+        """Validate worldr signatures, as (file, signature) pairs.
+
+        gpg verifies one detached signature per process, so they are
+        verified by up to `VERIFY_WORKERS` processes concurrently. Return
+        whether each file is valid, by file: a file that cannot be read is
+        not.
+        """
+        pairs = list(pairs)
+        if not pairs:
+            return {}
+
+        def _validate(pair: tuple[str, str]) -> bool:
+            try:
+                return self.validate_worldr_signature(*pair)
+            except OSError as ex:
+                rlog.error("Could not read file", file=pair[0], error=ex)
+                return False
+
+        with ThreadPoolExecutor(
+            max_workers=min(VERIFY_WORKERS, len(pairs))
+        ) as pool:
+            results = list(pool.map(_validate, pairs))
+        return {pair[0]: result for pair, result in zip(pairs, results)}
+
+
+_context: GPG | None = None
+_context_lock = Lock()
+
+
+def get_gpg() -> GPG:
+    """Return the GPG context of this run."""
+    global _context
+    with _context_lock:
+        if _context is None:
+            _context = GPG()
+        return _context
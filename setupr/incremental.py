@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
+"""Incremental pre-flight checks.
+
+Each goss resource that passed is recorded with a fingerprint of what its
+outcome depends on: its definition in the goss file, and the state of the
+host it looks at. The next run only checks the resources whose fingerprint
+changed, that failed, or that cannot be fingerprinted at all.
+
+Only the resources that read from the file system can be fingerprinted.
+`file` uses the file's inode and mtime, `package` the package database's,
+`user` and `group` the account databases'. Everything else, such as
+`command`, `service`, `port` or `http`, is checked every time.
+"""
+import hashlib
+import json
+import os
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Iterable, Mapping
+
+import structlog
+
+from setupr.checks import CheckResult, SuiteResult
+from setupr.utils import write_json
+
+rlog = structlog.get_logger("setupr.incremental")
+
+PACKAGE_DATABASES = (
+    "/var/lib/rpm",
+    "/var/lib/rpm/rpmdb.sqlite",
+    "/var/lib/rpm/Packages",
+    "/var/lib/dpkg/status",
+)
+ACCOUNT_DATABASES = ("/etc/passwd", "/etc/group", "/etc/shadow")
+INPUTS = {
+    "package": PACKAGE_DATABASES,
+    "user": ACCOUNT_DATABASES,
+    "group": ACCOUNT_DATABASES,
+}
+
+
+def _kind(name: str) -> str:
+    """Normalise a resource type: `kernel-param` in YAML, `KernelParam` out."""
+    return name.replace("-", "").replace("_", "").lower()
+
+
+def _stat(path: str) -> list[int] | None:
+    """Return what changes when path changes, None if it does not exist."""
+    try:
+        info = os.stat(path)
+        link = os.lstat(path)
+    except OSError:
+        return None
+    return [
+        info.st_ino,
+        info.st_mtime_ns,
+        info.st_ctime_ns,
+        info.st_size,
+        link.st_ino,
+        link.st_mtime_ns,
+    ]
+
+
+def fingerprint(kind: str, name: str, spec: Any, salt: str = "") -> str | None:
+    """Return the fingerprint of a resource, None if it has none."""
+    if _kind(kind) == "file":
+        paths: Iterable[str] = (str(name),)
+    elif _kind(kind) in INPUTS:
+        paths = INPUTS[_kind(kind)]
+    else:
+        return None
+    inputs = [salt, kind, name, spec, [_stat(path) for path in paths]]
+    return hashlib.sha256(
+        json.dumps(inputs, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+class IncrementalChecks:
+    """The resources of a goss file that passed, and under what conditions.
+
+    `plan` says what to check, `update` records what was checked.
+    """
+
+    def __init__(self, path: Path, salt: str = "") -> None:
+        """Initialise from the state saved in path, if any.
+
+        `salt` is part of every fingerprint, e.g. the goss version.
+        """
+        self._path = path
+        self._salt = salt
+        self._state: dict[str, Any] = {}
+        self._planned: dict[str, str | None] = {}
+        try:
+            self._state = dict(json.loads(path.read_text())["checks"])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass  # Check everything.
+
+    def plan(
+        self, data: Mapping[str, Mapping[str, Any]]
+    ) -> tuple[dict[str, dict[str, Any]], list[CheckResult]]:
+        """Split the resources in data into those to check, and the others.
+
+        Return the resources to check, in the same form as data, and the
+        recorded results of the others.
+        """
+        todo: dict[str, dict[str, Any]] = {}
+        reused: list[CheckResult] = []
+        self._planned = {}
+        kept: dict[str, Any] = {}
+        for kind, entries in data.items():
+            for name, spec in entries.items():
+                key = f"{_kind(kind)}:{name}"
+                current = fingerprint(kind, name, spec, self._salt)
+                recorded = self._state.get(key, {})
+                if current and recorded.get("fingerprint") == current:
+                    kept[key] = recorded
+                    reused.extend(
+                        CheckResult(**check) for check in recorded["results"]
+                    )
+                else:
+                    todo.setdefault(kind, {})[name] = spec
+                    self._planned[key] = current
+        self._state = kept  # Forget the resources that are gone.
+        return todo, reused
+
+    def update(self, result: SuiteResult) -> None:
+        """Record the results of the planned resources, and save them.
+
+        A resource is recorded only if all its checks passed.
+        """
+        checks: dict[str, list[CheckResult]] = {}
+        for check in result.checks:
+            key = f"{_kind(check.resource_type)}:{check.resource_id}"
+            checks.setdefault(key, []).append(check)
+        for key, current in self._planned.items():
+            if (
+                current is not None
+                and key in checks
+                and all(c.successful or c.skipped for c in checks[key])
+            ):
+                self._state[key] = {
+                    "fingerprint": current,
+                    "results": [asdict(check) for check in checks[key]],
+                }
+        try:
+            write_json(
+                self._path, {"checks": self._state}, separators=(",", ":")
+            )
+        except OSError as ex:
+            rlog.warning("Could not save checks", path=self._path, error=ex)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
+"""Mirrors of the artifacts setupr downloads.
+
+A mirror is a base URL, `https://`, `http://`, or `file://`, under which
+the artifacts are found by their file name, whatever their origin:
+
+```
+file:///srv/worldr/
+├── goss-linux-amd64
+├── goss-security-Ubuntu.yaml
+└── worldr-aa-v1.2.3.sh
+```
+
+The mirrors are listed, in order of preference, in the `SETUPR_MIRRORS`
+environment variable (separated by commas or spaces) and with the
+`--mirror` option. Before downloading, every mirror is probed for every
+artifact with a small HEAD request, concurrently, and so is the origin.
+The healthy mirrors are preferred to the origin, even when it answers
+faster: a site cache (see `setupr.serve`) only fetches an artifact once it
+is asked for it. They are ranked by latency, the order of preference
+breaking ties. The origin is always tried, last, unless the mirrors are
+`offline`: then the origin is never contacted.
+"""
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Iterable
+
+import requests
+import structlog
+
+from setupr.session import get_session
+
+rlog = structlog.get_logger("setupr.mirrors")
+
+MIRRORS_ENV = "SETUPR_MIRRORS"
+PROBE_TIMEOUT = 2.0  # Seconds, a mirror slower than that is of no use.
+PROBE_WORKERS = 8
+
+_lock = Lock()
+_mirrors: "Mirrors | None" = None
+
+
+class Mirrors:
+    """An ordered list of mirrors and the latency of their artifacts."""
+
+    def __init__(
+        self,
+        bases: Iterable[str] = (),
+        timeout: float = PROBE_TIMEOUT,
+        offline: bool = False,
+    ) -> None:
+        """Initialise."""
+        self.bases: list[str] = []
+        for base in bases:
+            base = base.rstrip("/")
+            if base and base not in self.bases:
+                self.bases.append(base)
+        self._timeout = timeout
+        self.offline = offline
+        self._latency: dict[str, float | None] = {}
+        self._lock = Lock()
+
+    def __bool__(self) -> bool:
+        """Return True if there is any mirror."""
+        return bool(self.bases)
+
+    def candidates(self, url: str) -> list[str]:
+        """Return where url might be downloaded from, origin last."""
+        name = url.split("/")[-1]
+        sources = [f"{base}/{name}" for base in self.bases]
+        return sources if self.offline else sources + [url]
+
+    def _probe(self, source: str) -> float | None:
+        """Return how long HEAD source took, None if it is unhealthy."""
+        started = time.monotonic()
+        try:
+            response = get_session().head(
+                source, allow_redirects=True, timeout=self._timeout
+            )
+        except requests.exceptions.RequestException as ex:
+            rlog.debug("Mirror unreachable", source=source, error=ex)
+            return None
+        if response.status_code != 200:
+            rlog.debug(
+                "Mirror unhealthy", source=source, code=response.status_code
+            )
+            return None
+        return time.monotonic() - started
+
+    def rank(self, urls: Iterable[str]) -> dict[str, list[str]]:
+        """Return the sources of each url, fastest mirror first, origin last.
+
+        The probes are made once per process, concurrently.
+        """
+        candidates = {url: self.candidates(url) for url in urls}
+        if not self:
+            return candidates
+        with self._lock:
+            todo = {
+                source
+                for sources in candidates.values()
+                for source in sources
+                if source not in self._latency
+            }
+            if todo:
+                with ThreadPoolExecutor(
+                    max_workers=min(PROBE_WORKERS, len(todo))
+                ) as pool:
+                    self._latency |= dict(
+                        zip(todo, pool.map(self._probe, todo))
+                    )
+            latency = dict(self._latency)
+        ranked = {}
+        for url, sources in candidates.items():
+            # The sort is stable: the order of preference breaks ties.
+            ranked[url] = sorted(
+                (source for source in sources if latency[source] is not None),
+                key=lambda source: (source == url, latency[source] or 0.0),
+            )
+            if self.offline:
+                ranked[url] = ranked[url] or sources  # Fail with an error.
+            elif url not in ranked[url]:
+                ranked[url].append(url)  # Unhealthy, but the last resort.
+            rlog.debug("Mirrors ranked", url=url, sources=ranked[url])
+        return ranked
+
+
+def configure(bases: Iterable[str] = (), offline: bool = False) -> "Mirrors":
+    """Set the mirrors of this run: `bases` then those from the environment."""
+    global _mirrors
+    env = re.split(r"[,\s]+", os.environ.get(MIRRORS_ENV, ""))
+    with _lock:
+        _mirrors = Mirrors([*bases, *env], offline=offline)
+        return _mirrors
+
+
+def get_mirrors() -> Mirrors:
+    """Return the mirrors of this run."""
+    with _lock:
+        mirrors = _mirrors
+    return mirrors if mirrors is not None else configure()
@@ -8,24 +8,35 @@ for more information.
 """
 import os
 import pathlib
-import stat
+import subprocess  # nosec B404
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock
 from typing import Any
 
 import distro
 import structlog
-from plumbum import (  # type: ignore
-    CommandNotFound,
-    ProcessExecutionError,
-    local,
-)
+from plumbum import CommandNotFound, local  # type: ignore
+from ruamel.yaml import YAML, YAMLError
 
+from setupr.cache import default_cache_dir
+from setupr.checks import CheckResult, SuiteResult
 from setupr.downloader import Downloader, take_backup
+from setupr.incremental import IncrementalChecks
+from setupr.tools import ToolStore
+from setupr.verdicts import Verdicts, host_fingerprint
 
 rlog = structlog.get_logger("setupr.pre_flight")
 
 GOSS_EXE = "goss-linux-amd64"
 GOSS_URL = "https://github.com/goss-org/goss/releases/download"
 GOSS_VERSION = "v0.3.16"
+POLL_INTERVAL = 0.1  # Seconds between checks for cancellation.
+GOSS_MAX_CONCURRENT = 50  # Tests run concurrently per suite, as goss does.
+MAX_CONCURRENT_ENV = "SETUPR_GOSS_MAX_CONCURRENT"
+MAX_SHARDS = 8  # Most goss processes per suite.
+SLOW_RESOURCES = ("command", "http", "addr", "dns")  # Spread first.
 URL_BASE_CHECKS = "https://storage.googleapis.com/worldr-install"
 SHA256SUM = {
     "goss-linux-amd64": "827e354b48f93bce933f5efcd1f00dc82569c42a179cf2d384b040d8a80bfbfb",  # noqa: E501
@@ -38,13 +49,120 @@ SHA256SUM = {
 }
 
 
+def shard_count() -> int:
+    """Return how many goss processes to run per suite: one per CPU."""
+    return max(1, min(MAX_SHARDS, os.cpu_count() or 1))
+
+
+def max_concurrent(shards: int) -> int:
+    """Return how many tests each of the shards of a suite runs at once.
+
+    The suite runs `SETUPR_GOSS_MAX_CONCURRENT` tests at once, 50 by
+    default, split between its goss processes.
+    """
+    try:
+        total = int(os.environ.get(MAX_CONCURRENT_ENV, GOSS_MAX_CONCURRENT))
+    except ValueError:
+        rlog.warning(
+            "Invalid concurrency, using the default", env=MAX_CONCURRENT_ENV
+        )
+        total = GOSS_MAX_CONCURRENT
+    return max(1, total // max(1, shards))
+
+
+def load_checks(check: pathlib.Path) -> dict[str, dict[str, Any]] | None:
+    """Return the resources of the goss file check, by type then name.
+
+    None if it cannot be split in resources: it uses templates, includes
+    other goss files, or it is not valid, which goss will report.
+    """
+    try:
+        text = check.read_text()
+    except OSError:
+        return None
+    if "{{" in text:
+        return None
+    try:
+        data = YAML(typ="safe").load(text)
+    except YAMLError:
+        return None
+    if (
+        not isinstance(data, dict)
+        or "gossfile" in data
+        or not all(isinstance(entries, dict) for entries in data.values())
+    ):
+        return None
+    return data
+
+
+def dump_checks(data: dict[str, dict[str, Any]], path: pathlib.Path) -> None:
+    """Write resources, as returned by `load_checks`, to a goss file."""
+    with open(path, "w") as fd:
+        YAML(typ="safe").dump(data, fd)
+
+
+def shard(
+    check: pathlib.Path, directory: pathlib.Path, count: int
+) -> list[pathlib.Path]:
+    """Split the goss file check into at most count files in directory.
+
+    The resources are dealt out in turn, the slow ones first, so that every
+    shard gets its share of them. A file that cannot be split, see
+    `load_checks`, is returned as is.
+    """
+    data = load_checks(check) if count > 1 else None
+    if data is None:
+        return [check]
+    resources = sorted(
+        (
+            (kind, name, spec)
+            for kind, entries in data.items()
+            for name, spec in entries.items()
+        ),
+        key=lambda resource: resource[0] not in SLOW_RESOURCES,
+    )
+    count = min(count, len(resources))
+    if count < 2:
+        return [check]
+    shards: list[dict[str, dict[str, Any]]] = [{} for _ in range(count)]
+    for index, (kind, name, spec) in enumerate(resources):
+        shards[index % count].setdefault(kind, {})[name] = spec
+    paths = []
+    for index, content in enumerate(shards):
+        path = directory / f"{check.stem}-{index}.yaml"
+        dump_checks(content, path)
+        paths.append(path)
+    return paths
+
+
+def _communicate(
+    proc: subprocess.Popen[bytes], cancel: Event | None
+) -> tuple[bytes, bytes] | None:
+    """Wait for proc and return its output, None if it was cancelled."""
+    while True:
+        try:
+            return proc.communicate(timeout=POLL_INTERVAL)
+        except subprocess.TimeoutExpired:
+            if cancel is not None and cancel.is_set():
+                proc.kill()
+                proc.communicate()
+                return None
+
+
 class PreFlight:
     """Wrapper to all pre-flight calls."""
 
     OS_TYPE = "Unknown"
 
-    def __init__(self) -> None:
-        """Initialise."""
+    def __init__(self, full: bool = False) -> None:
+        """Initialise.
+
+        With `full`, every check runs, see `setupr.incremental`.
+        """
+        self._full = full
+        self._verdicts = Verdicts(
+            default_cache_dir() / "preflight" / "verdicts.json"
+        )
         if "rhel" in distro.id():
             # RedHat Enterprise Linux.
             self.OS_TYPE = "RHEL"
@@ -52,6 +170,8 @@ class PreFlight:
             # Ubuntu Linux.
             self.OS_TYPE = "Ubuntu"
         self._goss = None
+        self._goss_lock = Lock()  # The suites may need goss concurrently.
+        self._tools = ToolStore()
         self._downloader = Downloader()
         self._bin = pathlib.Path.home() / "bin"
         if not self._bin.is_dir():
@@ -65,37 +185,52 @@ class PreFlight:
     def goss(self) -> Any:
         """Return the goss binary.
 
-        There are three cases:
-            1. `goss` is found and correct, just return it.
-            1. `goss` is in the PATH, add it has the correct version.
-            1. `goss` is not in the PATH or is wrong version: fetch the
-                correct one.
+        It is taken from the tool store, see `setupr.tools`, and fetched
+        into it if it is not there yet. `~/bin/goss` links to it, unless it
+        is a binary of its own.
         """
+        with self._goss_lock:
+            return self._find_goss()
+
+    def _find_goss(self) -> Any:
+        """Return the goss binary, see `goss`."""
         if self._goss is not None:
             # We assume we have the correct version!
             return self._goss
-        try:
-            # This assumes that `goss` is on the PATH.
-            self._goss = local["goss"]
-            if GOSS_VERSION not in self._goss("--version"):  # type: ignore
-                rlog.warning(
-                    "goss version mismatch",
-                    version=GOSS_VERSION,
-                )
-                raise CommandNotFound("goss", local.env.path)
-        except CommandNotFound as ex:
-            rlog.warning("goss not found", error=ex)
-            dst = self._bin / "goss-linux-amd64"
-            self._downloader.fetch(
+        sha256 = SHA256SUM[GOSS_EXE]
+        path = self._tools.lookup("goss", GOSS_VERSION, sha256)
+        if path is None:
+            rlog.warning("goss not found", version=GOSS_VERSION)
+            path = self._tools.path("goss", GOSS_VERSION)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if not self._downloader.fetch(
                 f"{GOSS_URL}/{GOSS_VERSION}/{GOSS_EXE}",
-                dst,
-                SHA256SUM["goss-linux-amd64"],
-            )
-            dst.chmod(stat.S_IRWXU)  # Read, write, and execute by owner.
-            (self._bin / "goss").symlink_to(dst)
-            self._goss = local[dst.as_posix()]
+                path.parent / GOSS_EXE,
+                sha256,
+                segmented=True,
+            ):
+                raise CommandNotFound("goss", [path.parent])
+            (path.parent / GOSS_EXE).replace(path)
+            self._tools.add("goss", GOSS_VERSION, sha256)
+        self._link(path)
+        self._goss = local[path.as_posix()]
         return self._goss
 
+    def _link(self, path: pathlib.Path) -> None:
+        """Point `~/bin/goss` to path, unless it is not a link."""
+        link = self._bin / "goss"
+        if link.exists() and not link.is_symlink():
+            return
+        try:
+            if link.is_symlink() and link.readlink() == path:
+                return
+            tmp = self._bin / f".goss.{os.getpid()}"
+            tmp.unlink(missing_ok=True)
+            tmp.symlink_to(path)
+            tmp.replace(link)
+        except OSError as ex:
+            rlog.warning("Cannot link goss", link=link, error=ex)
+
     def _fetch_file(self, what: str) -> pathlib.Path:
         """Fetch a file, if needed."""
         name = f"goss-{what}-{self.OS_TYPE}.yaml"
@@ -107,43 +242,127 @@ class PreFlight:
         )
         return check
 
-    def security(self) -> int:
+    def security(self, cancel: Event | None = None) -> SuiteResult:
         """Run the security checks."""
-        return self._run("security")
+        return self._run("security", cancel)
 
-    def infrastructure(self) -> int:
+    def infrastructure(self, cancel: Event | None = None) -> SuiteResult:
         """Run the infrastructure checks."""
-        return self._run("infrastructure")
+        return self._run("infrastructure", cancel)
+
+    def _run(self, what: str, cancel: Event | None = None) -> SuiteResult:
+        """Run goss.
 
-    def _run(self, what: str) -> int:
-        """Run goss."""
+        Unless `full`, a verdict for this host is reused if there is one,
+        see `setupr.verdicts`. Otherwise, only the checks whose inputs
+        changed since they last passed run, see `setupr.incremental`. They
+        are split into shards, see `shard`, validated by as many goss
+        processes in parallel, which share `max_concurrent`. Their results
+        are merged with those that are reused, and written to
+        `goss-<what>.json` in the current directory.
+
+        If `cancel` is set while goss runs, it is killed: the return code is
+        then negative.
+        """
+        key = host_fingerprint(
+            SHA256SUM[f"goss-{what}-{self.OS_TYPE}.yaml"], GOSS_VERSION
+        )
+        verdict = None if self._full else self._verdicts.get(what, key)
+        if verdict is not None:
+            rlog.info("Reusing pre flight verdict", checks=what.title())
+            return verdict
         check = self._fetch_file(what)
-        try:
-            retcode, _, _ = self.goss.run(
-                (
-                    "-g",
-                    check.as_posix(),
-                    "validate",
-                    "--format",
-                    "documentation",
-                    "--no-color",
+        start = time.monotonic_ns()
+        data = None if self._full else load_checks(check)
+        incremental = None
+        reused: list[CheckResult] = []
+        with tempfile.TemporaryDirectory(prefix="setupr_goss_") as tmp:
+            if data is not None:
+                incremental = IncrementalChecks(
+                    default_cache_dir()
+                    / "preflight"
+                    / f"{what}-{self.OS_TYPE}.json",
+                    GOSS_VERSION,
+                )
+                data, reused = incremental.plan(data)
+                rlog.info(
+                    "Incremental checks",
+                    checks=what.title(),
+                    reused=len(reused),
+                    running=sum(len(entries) for entries in data.values()),
                 )
+                check = pathlib.Path(tmp) / check.name
+                dump_checks(data, check)
+            shards = (
+                []
+                if data == {}
+                else shard(check, pathlib.Path(tmp), shard_count())
             )
-            rlog.info("Checks passed.", checks=what.title())
-            return int(retcode)
-        except ProcessExecutionError as ex:
+            concurrent = str(max_concurrent(len(shards)))
             rlog.debug(
-                "Pre flight checks failed output",
-                checks=what.title(),
-                error=ex,
-            )
-            rlog.warning(
-                "Pre flight checks failed",
+                "Running goss",
                 checks=what.title(),
-                retcode=ex.retcode,
+                shards=len(shards),
+                max_concurrent=concurrent,
             )
-            log = take_backup(pathlib.Path.cwd() / f"goss-{what}.log")
-            with os.fdopen(os.open(log, os.O_RDWR | os.O_CREAT), "w") as f:
-                f.write(ex.stdout)
-                f.write(ex.stderr)
-            return int(ex.retcode)
+            procs = [
+                self.goss.popen(
+                    (
+                        "-g",
+                        path.as_posix(),
+                        "validate",
+                        "--max-concurrent",
+                        concurrent,
+                        "--format",
+                        "json",
+                        "--no-color",
+                    )
+                )
+                for path in shards
+            ]
+            with ThreadPoolExecutor(max_workers=len(procs) or 1) as pool:
+                outputs = list(
+                    pool.map(lambda proc: _communicate(proc, cancel), procs)
+                )
+        ran = SuiteResult.merge(
+            what,
+            (
+                SuiteResult.from_goss(what, int(proc.returncode), *output)
+                if output is not None
+                else SuiteResult(what, int(proc.returncode))
+                for proc, output in zip(procs, outputs)
+            ),
+        )
+        result = SuiteResult.merge(
+            what,
+            (ran, SuiteResult(what, 0, tuple(reused))),
+            time.monotonic_ns() - start,
+        )
+        if result.cancelled:
+            rlog.warning("Pre flight checks cancelled", checks=what.title())
+            return result
+        if incremental is not None:
+            incremental.update(ran)
+        self._verdicts.put(what, key, result)
+        rlog.debug(
+            "Slowest checks",
+            checks=what.title(),
+            slowest=[
+                (c.resource_type, c.resource_id, c.property, c.duration)
+                for c in result.slowest()
+            ],
+        )
+        result.dump(take_backup(pathlib.Path.cwd() / f"goss-{what}.json"))
+        if result.passed:
+            rlog.info("Checks passed.", checks=what.title())
+            return result
+        for failure in result.failures:
+            rlog.warning("Check failed", message=failure.message)
+        rlog.warning(
+            "Pre flight checks failed",
+            checks=what.title(),
+            retcode=result.retcode,
+            failed=len(result.failures),
+            error=result.error,
+        )
+        return result
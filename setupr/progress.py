@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
+"""One progress display shared by all the transfers of a run."""
+import time
+from threading import Lock
+from typing import Any
+
+from rich.console import Console
+from rich.progress import (
+    BarColumn,
+    DownloadColumn,
+    Progress,
+    TaskID,
+    TextColumn,
+    TimeRemainingColumn,
+    TransferSpeedColumn,
+)
+
+REFRESH_PER_SECOND = 4
+
+_lock = Lock()
+_progress: "TransferProgress | None" = None
+
+
+class TransferProgress(Progress):
+    """A rich progress display for concurrent transfers.
+
+    The display is refreshed at a fixed rate. The worker threads only add
+    the bytes they transferred to a counter, which is pushed to the display
+    at most at that rate, rather than taking rich's lock for every chunk.
+
+    When the console is not a terminal, it is silent: nothing is rendered
+    and updates return straight away.
+
+    It can be entered by nested and concurrent callers: the display starts
+    with the first one and stops with the last one. Each caller removes the
+    tasks it added when it is done, so that they are not drawn again.
+    """
+
+    def __init__(
+        self,
+        console: Console | None = None,
+        refresh_per_second: float = REFRESH_PER_SECOND,
+    ) -> None:
+        """Initialise."""
+        console = console or Console()
+        super().__init__(
+            TextColumn("[bold blue]{task.fields[filename]}", justify="right"),
+            BarColumn(bar_width=None),
+            "[progress.percentage]{task.percentage:>3.1f}%",
+            "•",
+            DownloadColumn(),
+            "•",
+            TransferSpeedColumn(),
+            "•",
+            TimeRemainingColumn(),
+            console=console,
+            refresh_per_second=refresh_per_second,
+            disable=not console.is_terminal,
+        )
+        self._interval = 1 / refresh_per_second
+        self._counter_lock = Lock()
+        self._pending: dict[TaskID, int] = {}
+        self._flushed = 0.0
+        self._users = 0
+
+    def start(self) -> None:
+        """Start the display, unless it already is."""
+        with self._counter_lock:
+            self._users += 1
+            if self._users > 1:
+                return
+        super().start()
+
+    def stop(self) -> None:
+        """Stop the display, once its last user is done."""
+        self.flush()
+        with self._counter_lock:
+            self._users -= 1
+            if self._users > 0:
+                return
+        if not self.disable:
+            super().stop()
+
+    def update(
+        self,
+        task_id: TaskID,
+        *,
+        advance: float | None = None,
+        **kwargs: Any,
+    ) -> None:
+        """Update a task, batching the plain advances."""
+        if self.disable:
+            return
+        if kwargs or advance is None:
+            self.flush()
+            super().update(task_id, advance=advance, **kwargs)
+            return
+        with self._counter_lock:
+            self._pending[task_id] = self._pending.get(task_id, 0) + int(
+                advance
+            )
+            if time.monotonic() - self._flushed < self._interval:
+                return
+        self.flush()
+
+    def remove_task(self, task_id: TaskID) -> None:
+        """Remove a task, and its pending advance."""
+        with self._counter_lock:
+            self._pending.pop(task_id, None)
+        super().remove_task(task_id)
+
+    def flush(self) -> None:
+        """Push the pending advances to the display."""
+        with self._counter_lock:
+            pending, self._pending = self._pending, {}
+            self._flushed = time.monotonic()
+        for task_id, advance in pending.items():
+            super().update(task_id, advance=advance)
+
+
+def get_progress() -> TransferProgress:
+    """Return the progress display of this run."""
+    global _progress
+    with _lock:
+        if _progress is None:
+            _progress = TransferProgress()
+        return _progress
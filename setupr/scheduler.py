@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
+"""Run the steps of a workflow as a dependency graph.
+
+Each step starts as soon as the steps it comes after have succeeded, on a
+small thread pool. A workflow therefore takes as long as its longest path
+through the graph, rather than the sum of its steps.
+
+A step succeeds if it returns a true value. When a step fails, or raises,
+`Scheduler.cancel` is set: the steps that have not started are skipped, and
+the running ones may watch the event to stop early.
+"""
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+from dataclasses import dataclass
+from threading import Event
+from typing import Any, Callable, Iterable
+
+import structlog
+
+rlog = structlog.get_logger("setupr.scheduler")
+
+MAX_WORKERS = 6  # More than the widest graph we run.
+
+
+class SchedulerError(ValueError):
+    """The graph is not valid."""
+
+
+@dataclass(frozen=True)
+class Step:
+    """A step of a workflow, and the steps it must come after."""
+
+    name: str
+    func: Callable[[], Any]
+    after: tuple[str, ...] = ()
+
+
+class Scheduler:
+    """Run steps concurrently, each once its prerequisites succeeded."""
+
+    def __init__(
+        self, max_workers: int = MAX_WORKERS, cancel: Event | None = None
+    ) -> None:
+        """Initialise an empty graph.
+
+        `cancel` is the event to set on failure, a new one by default: pass
+        it to the steps that can stop early.
+        """
+        self._steps: dict[str, Step] = {}
+        self._max_workers = max_workers
+        self.cancel = cancel or Event()
+
+    def add(
+        self, name: str, func: Callable[[], Any], after: Iterable[str] = ()
+    ) -> None:
+        """Add the step name, to run func after the steps in after."""
+        if name in self._steps:
+            raise SchedulerError(f"Step {name} added twice")
+        self._steps[name] = Step(name, func, tuple(after))
+
+    def _order(self) -> list[str]:
+        """Return the steps in a topological order.
+
+        Raise SchedulerError for unknown prerequisites, and for cycles.
+        """
+        for step in self._steps.values():
+            unknown = set(step.after) - set(self._steps)
+            if unknown:
+                raise SchedulerError(
+                    f"Step {step.name} comes after unknown {sorted(unknown)}"
+                )
+        order: list[str] = []
+        pending = dict(self._steps)
+        while pending:
+            ready = [
+                name
+                for name, step in pending.items()
+                if all(dep in order for dep in step.after)
+            ]
+            if not ready:
+                raise SchedulerError(f"Cycle between {sorted(pending)}")
+            order.extend(ready)
+            for name in ready:
+                del pending[name]
+        return order
+
+    def _run_step(self, step: Step) -> Any:
+        """Run a step, and log how long it took."""
+        start = time.monotonic()
+        rlog.debug("Step started", step=step.name)
+        try:
+            return step.func()
+        finally:
+            rlog.debug(
+                "Step finished",
+                step=step.name,
+                seconds=round(time.monotonic() - start, 3),
+            )
+
+    def run(self) -> dict[str, bool | None]:
+        """Run all the steps, and return whether each succeeded.
+
+        A step that did not run is None: a step it comes after failed, or
+        the workflow was cancelled.
+        """
+        order = self._order()
+        results: dict[str, bool | None] = {}
+        running: dict[Future[Any], str] = {}
+        with ThreadPoolExecutor(
+            max_workers=self._max_workers, thread_name_prefix="setupr-step"
+        ) as pool:
+            while True:
+                for name in order:
+                    if name in results or name in running.values():
+                        continue
+                    step = self._steps[name]
+                    if self.cancel.is_set() or any(
+                        results.get(dep, True) is not True
+                        for dep in step.after
+                    ):
+                        rlog.debug("Step skipped", step=name)
+                        results[name] = None
+                    elif all(dep in results for dep in step.after):
+                        running[pool.submit(self._run_step, step)] = name
+                if not running:
+                    return results
+                done, _ = wait_futures(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = bool(future.result())
+                    except Exception as ex:
+                        rlog.error("Step raised", step=name, error=ex)
+                        results[name] = False
+                    if not results[name]:
+                        rlog.warning("Step failed", step=name)
+                        self.cancel.set()
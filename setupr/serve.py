@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
+"""Serve the local artifact cache to the other hosts of a site.
+
+One host runs `setupr --serve-cache 8765` and the others list it as their
+preferred mirror, `setupr --mirror http://host:8765 …`. The artifacts are
+served by file name, like any other mirror (see `setupr.mirrors`).
+
+An artifact that is not cached yet is fetched from upstream on the first
+request for it. Concurrent requests for the same artifact are coalesced:
+the first one fetches it, the others wait for it and are then served from
+the cache. The clients still check the SHA-256 and the PGP signatures, so
+this server does not need to be trusted.
+"""
+import os
+import re
+import signal
+import tempfile
+from email.utils import formatdate
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Lock
+from typing import Any, BinaryIO
+
+import requests
+import structlog
+
+from setupr.cache import ArtifactCache
+from setupr.downloader import RETRY_STATUSES, WORLDR_URL_INSTALL, download
+from setupr.pre_flight import GOSS_EXE, GOSS_URL, GOSS_VERSION, SHA256SUM
+
+rlog = structlog.get_logger("setupr.serve")
+
+DEFAULT_PORT = 8765
+NAME = re.compile(r"[A-Za-z0-9][A-Za-z0-9._-]*")
+
+
+class CacheServer(ThreadingHTTPServer):
+    """An HTTP server for the artifact cache, one thread per request."""
+
+    daemon_threads = True
+
+    def __init__(
+        self, address: tuple[str, int], cache: ArtifactCache | None = None
+    ) -> None:
+        """Initialise and bind to address."""
+        super().__init__(address, _Handler)
+        self.cache = cache or ArtifactCache()
+        self._lock = Lock()
+        self._fetching: dict[str, Lock] = {}
+
+    def upstream(self, name: str) -> str:
+        """Return the upstream URL of the artifact name.
+
+        The cache knows where what it has came from. Otherwise, everything
+        but goss is in the Worldr bucket.
+        """
+        for url in self.cache.urls():
+            if url.split("/")[-1] == name:
+                return url
+        if name == GOSS_EXE:
+            return f"{GOSS_URL}/{GOSS_VERSION}/{GOSS_EXE}"
+        return f"{WORLDR_URL_INSTALL}/{name}"
+
+    def cached(self, url: str) -> tuple[Path, str] | None:
+        """Return the blob of url and its SHA-256, if it is cached."""
+        entry = self.cache.lookup(url)
+        if entry is None:
+            return None
+        return self.cache.path(entry["sha256"]), str(entry["sha256"])
+
+    def ensure(self, name: str) -> tuple[Path, str]:
+        """Return the blob of the artifact name and its SHA-256.
+
+        It is fetched from upstream if needed, once however many requests
+        are waiting for it.
+        """
+        url = self.upstream(name)
+        with self._lock:
+            fetching = self._fetching.setdefault(name, Lock())
+        try:
+            with fetching:
+                return self._fetch(name, url)
+        finally:
+            with self._lock:
+                if self._fetching.get(name) is fetching:
+                    del self._fetching[name]
+
+    def _fetch(self, name: str, url: str) -> tuple[Path, str]:
+        """Return the blob of url, fetching it if it is not cached."""
+        cached = self.cached(url)
+        if cached is not None:
+            return cached
+        rlog.info("Fetching from upstream", url=url)
+        expected = {url: SHA256SUM[name]} if name in SHA256SUM else {}
+        with tempfile.TemporaryDirectory(prefix="setupr_serve_") as tmp:
+            download(
+                (url,),
+                tmp,
+                expected_hashes=expected,
+                cache=self.cache,
+                check_existing=False,
+            )
+        cached = self.cached(url)
+        if cached is None:
+            raise OSError(f"{url} could not be cached")
+        return cached
+
+
+def _range(header: str | None, size: int) -> tuple[int, int] | None:
+    """Return the first and last bytes asked for, None for everything.
+
+    Raise ValueError if the range cannot be satisfied.
+    """
+    match = re.fullmatch(r"bytes=(\d+)-(\d*)", header or "")
+    if match is None:
+        return None
+    start = int(match[1])
+    end = min(int(match[2]), size - 1) if match[2] else size - 1
+    if start > end:
+        raise ValueError(f"Range {header} not satisfiable for {size} bytes")
+    return start, end
+
+
+def _status(error: Exception) -> int:
+    """Return the status to answer when upstream failed with error."""
+    response = getattr(error, "response", None)
+    if response is None or response.status_code in RETRY_STATUSES:
+        return HTTPStatus.BAD_GATEWAY
+    return int(response.status_code)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Serve the artifacts, with HEAD and single byte ranges."""
+
+    server: CacheServer
+    protocol_version = "HTTP/1.1"  # Keep-alive.
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        """Log the requests with everything else, rather than to stderr."""
+        rlog.debug(
+            "Request", client=self.client_address[0], line=format % args
+        )
+
+    def _name(self) -> str | None:
+        """Return the artifact requested, None if it is not valid."""
+        name = self.path.split("?")[0].lstrip("/")
+        if NAME.fullmatch(name) is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return None
+        return name
+
+    def do_HEAD(self) -> None:  # noqa: N802
+        """Describe an artifact without fetching it from upstream.
+
+        One that is not cached yet is said to be there, without a length:
+        asking upstream would make this mirror slower than upstream itself.
+        The GET fetches it, or fails so that the client moves on.
+        """
+        name = self._name()
+        if name is None:
+            return
+        cached = self.server.cached(self.server.upstream(name))
+        if cached is not None:
+            self._send(cached, None)
+            return
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self) -> None:  # noqa: N802
+        """Serve an artifact, fetching it from upstream if needed.
+
+        When upstream fails, the client is told whether it is worth retrying:
+        a status that is not transient, such as 404, is passed through and
+        every other failure is a 502.
+        """
+        name = self._name()
+        if name is None:
+            return
+        try:
+            cached = self.server.ensure(name)
+        except (OSError, requests.exceptions.RequestException) as ex:
+            rlog.error("Cannot serve", name=name, error=ex)
+            self.send_error(_status(ex))
+            return
+        with open(cached[0], "rb") as fd:  # Safe from eviction once opened.
+            self._send(cached, fd)
+
+    def _send(self, cached: tuple[Path, str], fd: BinaryIO | None) -> None:
+        """Send the headers, and the body if there is a file."""
+        path, sha256 = cached
+        info = os.fstat(fd.fileno()) if fd is not None else path.stat()
+        etag = f'"{sha256}"'
+        try:
+            wanted = None
+            if self.headers.get("If-Range", etag) == etag:
+                wanted = _range(self.headers.get("Range"), info.st_size)
+        except ValueError:
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header("Content-Range", f"bytes */{info.st_size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        start, end = wanted or (0, info.st_size - 1)
+        if wanted is None:
+            self.send_response(HTTPStatus.OK)
+        else:
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{end}/{info.st_size}"
+            )
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.send_header(
+            "Last-Modified", formatdate(info.st_mtime, usegmt=True)
+        )
+        self.send_header("Content-Type", "application/octet-stream")
+        self.end_headers()
+        if fd is not None and end >= start:
+            self.wfile.flush()
+            # Straight from the page cache to the socket.
+            self.connection.sendfile(fd, start, end - start + 1)
+
+
+def parse_address(value: str) -> tuple[str, int]:
+    """Parse `[host:]port`, all the interfaces by default."""
+    host, _, port = value.rpartition(":")
+    return host, int(port)
+
+
+def serve(
+    address: tuple[str, int] = ("", DEFAULT_PORT),
+    cache: ArtifactCache | None = None,
+) -> None:
+    """Serve the cache until interrupted.
+
+    SIGINT stops the server, rather than only the downloads in flight.
+    """
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    with CacheServer(address, cache) as server:
+        rlog.info("Serving cache", address=server.server_address)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            rlog.info("Stopped serving cache")
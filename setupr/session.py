@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
+"""The process wide HTTP session.
+
+Every network call made by setupr goes through the same `requests.Session`
+so that connections to storage.googleapis.com, api.github.com, and
+github.com are kept alive and reused instead of paying for DNS, TCP, and
+TLS on each request.
+
+It also serves `file://` URLs, so that a local directory can be used as a
+mirror of the artifacts.
+"""
+import io
+import re
+from email.utils import formatdate
+from pathlib import Path
+from threading import Lock
+from typing import Any, BinaryIO
+from urllib.parse import unquote, urlparse
+
+import requests
+import structlog
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+rlog = structlog.get_logger("setupr.session")
+
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 30.0
+MAX_WORKERS = 4  # Concurrent downloads, thus pooled connections per host.
+POOL_CONNECTIONS = 8  # Number of hosts we keep a pool for.
+
+_lock = Lock()
+_session: "Session | None" = None
+_pool_maxsize = 0
+
+
+class Session(requests.Session):
+    """A session with explicit connect and read timeouts.
+
+    `requests` has no default timeout, so a stalled server would otherwise
+    hang setupr forever.
+    """
+
+    def request(  # type: ignore[override]
+        self, method: str, url: str, **kwargs: Any
+    ) -> requests.Response:
+        """Send a request, with the default timeouts unless overridden."""
+        kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+        return super().request(method, url, **kwargs)
+
+
+class _FileBody:
+    """The body of a local file, or of a range of it, for `_stream`."""
+
+    def __init__(self, fd: BinaryIO, length: int) -> None:
+        """Initialise, `length` bytes are readable from the current offset."""
+        self._fd = fd
+        self._left = length
+        self.decode_content = False
+
+    def readinto(self, buffer: memoryview) -> int:
+        """Read into buffer, return the number of bytes read."""
+        count = self._fd.readinto(buffer[: self._left])  # type: ignore
+        self._left -= count
+        return int(count)
+
+    def read(self, amt: int | None = None, **_: Any) -> bytes:
+        """Read up to amt bytes, everything if amt is None."""
+        size = self._left if amt is None else min(amt, self._left)
+        data = self._fd.read(size)
+        self._left -= len(data)
+        return data
+
+    def close(self) -> None:
+        """Close the file."""
+        self._fd.close()
+
+
+class FileAdapter(BaseAdapter):
+    """A transport adapter for `file://` URLs.
+
+    It honours `HEAD`, `Range`, and `If-Range`, with `Last-Modified` as the
+    validator, which is all the downloader needs.
+    """
+
+    def send(  # type: ignore[override]
+        self, request: requests.PreparedRequest, **_: Any
+    ) -> requests.Response:
+        """Serve the file the request is for."""
+        response = requests.Response()
+        response.url = str(request.url)
+        response.request = request
+        response.headers = CaseInsensitiveDict()
+        response.raw = _FileBody(io.BytesIO(), 0)
+        path = Path(unquote(urlparse(response.url).path))
+        if not path.is_file():
+            response.status_code = 404
+            return response
+        info = path.stat()
+        size = info.st_size
+        modified = formatdate(info.st_mtime, usegmt=True)
+        response.status_code = 200
+        response.headers["accept-ranges"] = "bytes"
+        response.headers["last-modified"] = modified
+        start, end = 0, size - 1
+        match = re.fullmatch(
+            r"bytes=(\d+)-(\d*)", request.headers.get("Range", "")
+        )
+        if match and request.headers.get("If-Range", modified) == modified:
+            start = int(match[1])
+            end = min(int(match[2]), end) if match[2] else end
+            if start > end:
+                response.status_code = 416
+                response.headers["content-range"] = f"bytes */{size}"
+                return response
+            response.status_code = 206
+            response.headers["content-range"] = f"bytes {start}-{end}/{size}"
+        response.headers["content-length"] = str(end - start + 1)
+        if request.method != "HEAD":
+            try:
+                fd = open(path, "rb")  # noqa: SIM115 closed by the response.
+            except OSError:
+                response.status_code = 403
+                return response
+            fd.seek(start)
+            response.raw = _FileBody(fd, end - start + 1)
+        return response
+
+    def close(self) -> None:
+        """Nothing to release."""
+        pass
+
+
+def _mount(session: Session, pool_maxsize: int) -> None:
+    """Mount keep-alive adapters with a pool of `pool_maxsize`."""
+    global _pool_maxsize
+    adapter = HTTPAdapter(
+        pool_connections=POOL_CONNECTIONS, pool_maxsize=pool_maxsize
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    _pool_maxsize = pool_maxsize
+    rlog.debug("HTTP pool mounted", pool_maxsize=pool_maxsize)
+
+
+def get_session(pool_maxsize: int = MAX_WORKERS) -> Session:
+    """Return the process wide session.
+
+    The pool is grown if `pool_maxsize` is larger than the current one so
+    that each download worker gets its own connection.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            _session = Session()
+            _session.mount("file://", FileAdapter())
+        if pool_maxsize > _pool_maxsize:
+            _mount(_session, pool_maxsize)
+        return _session
+
+
+def close_session() -> None:
+    """Close the process wide session and its pooled connections."""
+    global _session, _pool_maxsize
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _pool_maxsize = 0
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
+"""A store of the tools setupr runs, such as goss, side by side by version.
+
+The tools live in `~/.cache/setupr/tools/<name>/<version>/<name>`. The
+manifest, `~/.cache/setupr/tools/manifest.json`, records the SHA-256 of
+each one when it is installed, with its size and modification time.
+
+Finding a tool is a lookup in the manifest and a `stat`: a binary whose
+size and modification time are still those recorded is trusted to still
+be the one that was checked. There is no need to run it to ask for its
+version.
+"""
+import json
+import stat
+from pathlib import Path
+from threading import Lock
+from typing import Any
+
+import structlog
+
+from setupr.cache import default_cache_dir
+from setupr.utils import write_json
+
+rlog = structlog.get_logger("setupr.tools")
+
+MANIFEST = "manifest.json"
+
+
+class ToolStore:
+    """Versioned tools, with a manifest of their SHA-256."""
+
+    _lock = Lock()  # Shared by all the stores, they share the manifest.
+
+    def __init__(self, root: Path | None = None) -> None:
+        """Initialise, in the user's setupr cache directory by default."""
+        self.root = root or default_cache_dir() / "tools"
+
+    def path(self, name: str, version: str) -> Path:
+        """Return where the version of the tool name is, or would be."""
+        return self.root / name / version / name
+
+    def _manifest(self) -> dict[str, Any]:
+        """Return the manifest."""
+        try:
+            return dict(json.loads((self.root / MANIFEST).read_text()))
+        except (OSError, ValueError, TypeError):
+            return {}
+
+    def lookup(
+        self, name: str, version: str, sha256: str | None = None
+    ) -> Path | None:
+        """Return the version of the tool name, None if it is not installed.
+
+        With `sha256`, the tool must have been installed with that digest.
+        """
+        with self._lock:
+            entry = self._manifest().get(name, {}).get(version)
+        if not isinstance(entry, dict) or (
+            sha256 is not None and entry.get("sha256") != sha256
+        ):
+            return None
+        path = self.path(name, version)
+        try:
+            info = path.stat()
+        except OSError:
+            return None
+        if (
+            info.st_size != entry.get("size")
+            or info.st_mtime_ns != entry.get("mtime_ns")
+            or not info.st_mode & stat.S_IXUSR
+        ):
+            rlog.warning("Tool changed since installed", tool=name, path=path)
+            return None
+        return path
+
+    def add(self, name: str, version: str, sha256: str) -> Path:
+        """Record the version of the tool name, already at `path`.
+
+        The caller checked its SHA-256. It is made executable.
+        """
+        path = self.path(name, version)
+        path.chmod(stat.S_IRWXU)  # Read, write, and execute by owner.
+        info = path.stat()
+        with self._lock:
+            manifest = self._manifest()
+            manifest.setdefault(name, {})[version] = {
+                "sha256": sha256,
+                "size": info.st_size,
+                "mtime_ns": info.st_mtime_ns,
+            }
+            write_json(
+                self.root / MANIFEST, manifest, indent=2, sort_keys=True
+            )
+        rlog.info("Tool installed", tool=name, version=version, path=path)
+        return path
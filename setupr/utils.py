@@ -2,13 +2,20 @@
 # Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
 """Utilities."""
 import enum
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from threading import Thread, get_ident
 from typing import Any, Sequence
 
-import requests
-
 from setupr import __version__
 
 GITHUB_URL = "https://api.github.com/repos/worldr/setupr/releases/latest"
+HASH_BLOCK_SIZE = 1024 * 1024
+VERSION_CHECK_TTL = 24 * 60 * 60  # Seconds.
 
 
 class VersionCheck(enum.Enum):
@@ -19,6 +26,26 @@ class VersionCheck(enum.Enum):
     UNKNOWN = enum.auto()
 
 
+def temporary_name(path: Path) -> Path:
+    """Return a temporary name, unique to this thread, next to `path`."""
+    return path.with_name(f".{path.name}.{os.getpid()}.{get_ident()}")
+
+
+def write_json(path: Path, data: Any, **kwargs: Any) -> None:
+    """Write data to path as JSON, atomically.
+
+    The directory is created if needed. `kwargs` are passed to `json.dumps`.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = temporary_name(path)
+    try:
+        tmp.write_text(json.dumps(data, **kwargs))
+        tmp.replace(path)
+    except OSError:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
 def join_with_oxford_commas(obj_list: Sequence[Any]) -> str:
     """Oxford commas for lists.
 
@@ -37,12 +64,83 @@ def join_with_oxford_commas(obj_list: Sequence[Any]) -> str:
     )
 
 
+def file_sha256(path: Path) -> str:
+    """Return the SHA-256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fd:
+        for block in iter(lambda: fd.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _version_check_file() -> Path:
+    """Return where the result of the last version check is kept."""
+    from setupr.cache import default_cache_dir
+
+    return default_cache_dir() / "version-check.json"
+
+
+def _latest_version() -> str | None:
+    """Return the tag of the latest release, None if it is unknown.
+
+    GitHub is asked at most once every `VERSION_CHECK_TTL` and then only
+    with the ETag of the previous answer: a 304 does not count against the
+    rate limit.
+    """
+    import requests
+
+    from setupr.session import get_session
+
+    path = _version_check_file()
+    try:
+        cached = dict(json.loads(path.read_text()))
+    except (OSError, ValueError, TypeError):
+        cached = {}
+    if time.time() - float(cached.get("checked", 0)) < VERSION_CHECK_TTL:
+        return cached.get("latest")
+    headers = {"If-None-Match": cached["etag"]} if cached.get("etag") else {}
+    try:
+        response = get_session().get(GITHUB_URL, headers=headers)
+    except requests.exceptions.RequestException:
+        return None
+    if response.status_code == 200:
+        cached = {
+            "latest": response.json()["tag_name"],
+            "etag": response.headers.get("etag"),
+        }
+    elif response.status_code != 304 or "latest" not in cached:
+        return None
+    cached["checked"] = time.time()
+    try:
+        write_json(path, cached)
+    except OSError:
+        pass  # We will ask again next time.
+    return cached.get("latest")
+
+
 def check_if_latest_version() -> VersionCheck:
     """Check if there is a new version published on GitHub."""
-    response = requests.get(GITHUB_URL)
-    if response.status_code == 200:
-        latest_version = response.json()["tag_name"]
-        if latest_version == f"v{__version__}":
-            return VersionCheck.LATEST
-        return VersionCheck.LAGGING
-    return VersionCheck.UNKNOWN
+    latest_version = _latest_version()
+    if latest_version is None:
+        return VersionCheck.UNKNOWN
+    if latest_version == f"v{__version__}":
+        return VersionCheck.LATEST
+    return VersionCheck.LAGGING
+
+
+def start_version_check() -> "Future[VersionCheck]":
+    """Check the version in a background thread.
+
+    The caller looks at the result when it matters, if it is there by then.
+    The thread never delays the exit of the process.
+    """
+    future: Future[VersionCheck] = Future()
+
+    def _check() -> None:
+        try:
+            future.set_result(check_if_latest_version())
+        except Exception as ex:  # Raised again by future.result().
+            future.set_exception(ex)
+
+    Thread(target=_check, name="version-check", daemon=True).start()
+    return future
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
+"""Pre-flight verdicts, reused while the host does not change.
+
+A suite that passed is recorded with a fingerprint of the host: the
+distribution, the kernel, the goss file and the goss version. Running it
+again on the same fingerprint, within `SETUPR_PREFLIGHT_TTL` seconds (an
+hour by default), reuses the verdict without running goss at all.
+
+Only the suites that passed are recorded: a failure is always checked
+again, since the operator is likely to be fixing it.
+"""
+import hashlib
+import json
+import os
+import platform
+import time
+from dataclasses import asdict
+from pathlib import Path
+from threading import Lock
+from typing import Any
+
+import distro
+import structlog
+
+from setupr.checks import SuiteResult
+from setupr.utils import write_json
+
+rlog = structlog.get_logger("setupr.verdicts")
+
+TTL_ENV = "SETUPR_PREFLIGHT_TTL"
+DEFAULT_TTL = 60 * 60  # Seconds.
+
+
+def ttl() -> float:
+    """Return how long a verdict is valid for, in seconds."""
+    try:
+        return float(os.environ.get(TTL_ENV, DEFAULT_TTL))
+    except ValueError:
+        rlog.warning("Invalid TTL, using the default", env=TTL_ENV)
+        return DEFAULT_TTL
+
+
+def host_fingerprint(*parts: str) -> str:
+    """Return a fingerprint of the host, and of parts.
+
+    This reads `/etc/os-release` and calls `uname`: no subprocess.
+    """
+    host = [
+        distro.os_release_info(),
+        platform.machine(),
+        platform.release(),
+        platform.version(),
+        *parts,
+    ]
+    return hashlib.sha256(
+        json.dumps(host, sort_keys=True).encode()
+    ).hexdigest()
+
+
+class Verdicts:
+    """The suites that passed, by host fingerprint."""
+
+    def __init__(self, path: Path) -> None:
+        """Initialise, the verdicts are kept in path."""
+        self._path = path
+        self._lock = Lock()  # The suites run concurrently.
+
+    def _load(self) -> dict[str, Any]:
+        """Return all the verdicts."""
+        try:
+            return dict(json.loads(self._path.read_text()))
+        except (OSError, ValueError, TypeError):
+            return {}
+
+    def get(self, what: str, key: str) -> SuiteResult | None:
+        """Return the verdict of the suite what, if it is still valid."""
+        with self._lock:
+            verdict = self._load().get(what)
+        if (
+            not isinstance(verdict, dict)
+            or verdict.get("key") != key
+            or time.time() - float(verdict.get("checked", 0)) >= ttl()
+        ):
+            return None
+        try:
+            return SuiteResult.from_dict(verdict["result"])
+        except (KeyError, TypeError):
+            return None
+
+    def put(self, what: str, key: str, result: SuiteResult) -> None:
+        """Record the verdict of the suite what, or forget it if it failed."""
+        with self._lock:
+            verdicts = self._load()
+            if result.passed:
+                verdicts[what] = {
+                    "key": key,
+                    "checked": time.time(),
+                    "result": asdict(result),
+                }
+            elif verdicts.pop(what, None) is None:
+                return
+            try:
+                write_json(self._path, verdicts, separators=(",", ":"))
+            except OSError as ex:
+                rlog.warning(
+                    "Could not save verdict", path=self._path, error=ex
+                )
@@ -16,3 +16,15 @@ def mock_console() -> Any:
         console.print = MagicMock()
         mocked.return_value = console
         yield console
+
+
+@pytest.fixture(autouse=True)
+def cache_home(tmp_path: Any, monkeypatch: Any) -> None:
+    """Tests never use the real cache."""
+    monkeypatch.setenv("XDG_CACHE_HOME", (tmp_path / "cache").as_posix())
+
+
+@pytest.fixture(autouse=True)
+def gpg_context(monkeypatch: Any) -> None:
+    """Each test gets its own GPG context, see `setupr.gpg.get_gpg`."""
+    monkeypatch.setattr("setupr.gpg._context", None)
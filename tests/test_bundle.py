@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
+# type: ignore
+import io
+import json
+import tarfile
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+import pytest
+import requests
+
+from setupr.bundle import MANIFEST, BundleError, create, open_bundle
+from setupr.gbucket import InstallationData, InstallationDataError
+from setupr.utils import file_sha256
+
+VERSION = "v1.2.3"
+
+
+def _download(urls, dest_dir, **kwargs):
+    """Pretend to download, the content of each file is its name."""
+    for url in urls:
+        if "backup-restore" in url:
+            raise requests.exceptions.RequestException("Not found")
+        name = url.split("/")[-1]
+        (Path(dest_dir) / name).write_text(name)
+        Path(dest_dir, "archives").mkdir(exist_ok=True)
+
+
+@pytest.fixture(autouse=True)
+def gpg():
+    with patch("setupr.bundle.get_gpg") as mocked:
+        mocked.return_value.validate_worldr_signatures.side_effect = (
+            lambda pairs: {name: True for name, _ in pairs}
+        )
+        yield mocked.return_value
+
+
+@pytest.fixture
+def bundle(tmp_path):
+    def _get(self):
+        Path(self.blob_name).write_text("values")
+        return True
+
+    data = Mock(spec=InstallationData)
+    data.blob_value = "xUnit-test-values.yaml"
+    data.get = lambda: _get(data)
+    with patch("setupr.bundle.download", side_effect=_download), patch(
+        "setupr.bundle.InstallationData", return_value=data
+    ):
+        return create(VERSION, destination=tmp_path / "bundle.tar")
+
+
+def test_create(bundle):
+    with tarfile.open(bundle) as tar:
+        names = tar.getnames()
+        manifest = json.load(tar.extractfile(MANIFEST))
+    assert names[0] == MANIFEST
+    assert manifest["version"] == VERSION
+    assert set(manifest["files"]) == set(names[1:])
+    assert f"worldr-aa-{VERSION}.sh" in names
+    assert f"worldr-debug-{VERSION}.sig" in names
+    assert f"backup-restore-{VERSION}.sh" not in names  # Optional.
+    assert "goss-linux-amd64" in names
+    assert "goss-security-RHEL.yaml" in names
+    assert "xUnit-test-values.yaml" in names
+    assert "archives" not in names
+
+
+def test_create_without_installation_data(tmp_path):
+    with patch("setupr.bundle.download", side_effect=_download), patch(
+        "setupr.bundle.InstallationData", side_effect=InstallationDataError
+    ):
+        bundle = create(VERSION, destination=tmp_path / "bundle.tar")
+    with tarfile.open(bundle) as tar:
+        assert "xUnit-test-values.yaml" not in tar.getnames()
+
+
+def test_create_uses_mirrors(tmp_path):
+    mirrors = Mock()
+    with patch(
+        "setupr.bundle.download", side_effect=_download
+    ) as mocked, patch(
+        "setupr.bundle.InstallationData", side_effect=InstallationDataError
+    ), patch(
+        "setupr.bundle.get_mirrors", return_value=mirrors
+    ):
+        create(VERSION, destination=tmp_path / "bundle.tar")
+    assert all(
+        call.kwargs["mirrors"] is mirrors for call in mocked.call_args_list
+    )
+
+
+def test_create_verifies_scripts(bundle, gpg):
+    pairs = list(gpg.validate_worldr_signatures.call_args.args[0])
+    assert [Path(name).name for name, _ in pairs] == [
+        f"worldr-aa-{VERSION}.sh",
+        f"worldr-debug-{VERSION}.sh",
+    ]
+    assert all(sig == name[:-3] + ".sig" for name, sig in pairs)
+
+
+@pytest.mark.parametrize(
+    ("key", "valid"), [(False, True), (True, False)], ids=["key", "signature"]
+)
+def test_create_invalid_signature(key, valid, gpg, tmp_path):
+    gpg.worldr_key_exists.return_value = key
+    gpg.import_worldr_key.return_value = False
+    gpg.validate_worldr_signatures.side_effect = lambda pairs: {
+        name: valid for name, _ in pairs
+    }
+    with patch("setupr.bundle.download", side_effect=_download), patch(
+        "setupr.bundle.InstallationData", side_effect=InstallationDataError
+    ), pytest.raises(BundleError):
+        create(VERSION, destination=tmp_path / "bundle.tar")
+    assert not (tmp_path / "bundle.tar").exists()
+
+
+def test_create_failure(tmp_path):
+    with patch(
+        "setupr.bundle.download",
+        side_effect=requests.exceptions.ConnectionError,
+    ), pytest.raises(BundleError):
+        create(VERSION, destination=tmp_path / "bundle.tar")
+    assert not (tmp_path / "bundle.tar").exists()
+
+
+def test_open_bundle(bundle):
+    root = open_bundle(bundle)
+    script = root / f"worldr-aa-{VERSION}.sh"
+    assert script.read_text() == script.name
+    assert not (root / MANIFEST).exists()
+    with patch("setupr.bundle.shutil.copyfileobj") as mocked:
+        assert open_bundle(bundle) == root
+        assert not mocked.called  # Already extracted.
+
+
+def _tamper(path, files, name, data):
+    with tarfile.open(path, "w") as tar:
+        for arcname, content in (
+            (MANIFEST, json.dumps({"files": files}).encode()),
+            (name, data),
+        ):
+            info = tarfile.TarInfo(arcname)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+
+
+@pytest.mark.parametrize(
+    ("name", "data", "digest_of"),
+    [
+        ("ook.sh", b"bad", b"good"),
+        ("../ook.sh", b"good", b"good"),
+    ],
+)
+def test_open_bundle_invalid(name, data, digest_of, tmp_path):
+    src = tmp_path / "src"
+    src.write_bytes(digest_of)
+    bundle = tmp_path / "bundle.tar"
+    _tamper(bundle, {name: file_sha256(src)}, name, data)
+    with pytest.raises(BundleError):
+        open_bundle(bundle)
+
+
+def test_open_bundle_not_a_bundle(tmp_path):
+    bundle = tmp_path / "bundle.tar"
+    bundle.write_text("ook")
+    with pytest.raises(BundleError):
+        open_bundle(bundle)
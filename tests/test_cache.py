@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
+# type: ignore
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from setupr.cache import ArtifactCache, default_cache_dir
+
+URL = "https://worldr.com/index.html"
+ETAG = '"ranni"'
+
+
+def _sha(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+@pytest.fixture()
+def artifact(tmp_path):
+    src = tmp_path / "artifact"
+    src.write_bytes(b"the witch")
+    return src
+
+
+def test_default_cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_CACHE_HOME", tmp_path.as_posix())
+    assert default_cache_dir() == tmp_path / "setupr"
+    monkeypatch.delenv("XDG_CACHE_HOME")
+    assert default_cache_dir() == Path.home() / ".cache" / "setupr"
+
+
+def test_max_size_from_environment(monkeypatch, tmp_path):
+    monkeypatch.setenv("SETUPR_CACHE_MAX_SIZE", "42")
+    assert ArtifactCache(tmp_path).max_size == 42
+    assert ArtifactCache(tmp_path, max_size=13).max_size == 13
+
+
+def test_nothing_is_created_until_stored(tmp_path):
+    sut = ArtifactCache(tmp_path / "cache")
+    assert sut.lookup(URL) is None
+    assert sut.urls() == []
+    assert sut.conditional_headers(URL) == {}
+    assert not sut.copy_to(_sha(b"the witch"), tmp_path / "dst")
+    assert not (tmp_path / "cache").exists()
+
+
+def test_store_and_copy(tmp_path, artifact):
+    sut = ArtifactCache(tmp_path / "cache")
+    sha = _sha(b"the witch")
+    sut.store(URL, artifact, sha, ETAG, "Wed, 21 Oct 2015 07:28:00 GMT")
+    assert sut.lookup(URL)["sha256"] == sha
+    assert sut.urls() == [URL]
+    assert sut.conditional_headers(URL) == {
+        "If-None-Match": ETAG,
+        "If-Modified-Since": "Wed, 21 Oct 2015 07:28:00 GMT",
+    }
+    dst = tmp_path / "dst"
+    assert sut.copy_to(sha, dst)
+    assert dst.read_bytes() == b"the witch"
+    dst.chmod(0o700)  # A copy, not a link: the blob must not change.
+    assert sut.path(sha).stat().st_mode & 0o777 != 0o700
+
+
+def test_copy_of_corrupted_blob(tmp_path, artifact):
+    sut = ArtifactCache(tmp_path / "cache")
+    sha = _sha(b"the witch")
+    sut.store(URL, artifact, sha, ETAG)
+    sut.path(sha).write_bytes(b"TAMPERED")
+    dst = tmp_path / "dst"
+    assert not sut.copy_to(sha, dst)
+    assert not dst.exists()
+    assert not sut.path(sha).exists(), "Evicted"
+    assert sut.lookup(URL) is None
+    assert sut.urls() == []
+
+
+def test_lookup_of_missing_blob(tmp_path, artifact):
+    sut = ArtifactCache(tmp_path / "cache")
+    sha = _sha(b"the witch")
+    sut.store(URL, artifact, sha, ETAG)
+    sut.path(sha).unlink()
+    assert sut.lookup(URL) is None
+
+
+def test_corrupted_index(tmp_path, artifact):
+    sut = ArtifactCache(tmp_path / "cache")
+    sut.store(URL, artifact, _sha(b"the witch"), ETAG)
+    (tmp_path / "cache" / "index.json").write_text("{not json")
+    assert sut.lookup(URL) is None
+
+
+def test_lru_eviction(tmp_path):
+    sut = ArtifactCache(tmp_path / "cache", max_size=20)
+    shas = []
+    for idx, data in enumerate((b"a" * 10, b"b" * 10, b"c" * 10)):
+        src = tmp_path / f"src{idx}"
+        src.write_bytes(data)
+        shas.append(_sha(data))
+        with patch("setupr.cache.time.time", return_value=float(idx)):
+            if idx == 2:
+                # Using the first blob makes the second one the LRU.
+                sut.copy_to(shas[0], tmp_path / "dst")
+            sut.store(f"{URL}/{idx}", src, shas[-1])
+    assert sut.path(shas[0]).is_file()
+    assert not sut.path(shas[1]).exists()
+    assert sut.path(shas[2]).is_file()
+    assert sut.lookup(f"{URL}/1") is None
+    index = json.loads((tmp_path / "cache" / "index.json").read_text())
+    assert set(index["blobs"]) == {shas[0], shas[2]}
+
+
+def test_concurrent_stores(tmp_path):
+    def _store(name: str) -> None:
+        # Each downloader has its own cache, over the same directory.
+        sut = ArtifactCache(tmp_path / "cache")
+        for idx in range(50):
+            src = tmp_path / f"{name}{idx}"
+            src.write_bytes(src.name.encode())
+            sut.store(f"{URL}/{src.name}", src, _sha(src.name.encode()))
+
+    with ThreadPoolExecutor() as executor:
+        list(executor.map(_store, ("margit", "godrick")))
+    index = json.loads((tmp_path / "cache" / "index.json").read_text())
+    assert len(index["urls"]) == 100
+    assert len(index["blobs"]) == 100
+    assert (tmp_path / "cache" / "index.lock").is_file()
+
+
+def test_store_failure_is_not_an_error(tmp_path, artifact):
+    root = tmp_path / "cache"
+    root.write_text("Not a directory")
+    sut = ArtifactCache(root)
+    sut.store(URL, artifact, _sha(b"the witch"), ETAG)
+    assert sut.lookup(URL) is None
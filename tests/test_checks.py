@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
+# type: ignore
+import json
+
+import pytest
+
+from setupr.checks import CheckResult, SuiteResult
+
+GOSS = {
+    "results": [
+        {
+            "resource-type": "File",
+            "resource-id": "/etc/hosts",
+            "property": "exists",
+            "successful": True,
+            "result": 0,
+            "duration": 1200,
+            "summary-line": "File: /etc/hosts: exists: matches expectation",
+        },
+        {
+            "resource-type": "Service",
+            "resource-id": "sshd",
+            "property": "running",
+            "successful": False,
+            "result": 1,
+            "duration": 3400,
+            "summary-line": "Service: sshd: running: doesn't match",
+        },
+        {
+            "resource-type": "Package",
+            "resource-id": "nginx",
+            "property": "version",
+            "successful": False,
+            "result": 2,
+            "duration": 0,
+            "summary-line": "Package: nginx: version: skipped",
+        },
+    ],
+    "summary": {"failed-count": 1, "test-count": 3},
+}
+
+
+def test_from_goss():
+    result = SuiteResult.from_goss("security", 1, json.dumps(GOSS).encode())
+    assert len(result.checks) == 3
+    assert not result.passed
+    assert [c.resource_id for c in result.failures] == ["sshd"]
+    assert result.checks[2].skipped
+    assert result.slowest(1) == [result.checks[1]]
+    assert result.failures[0].message.startswith("Service: sshd")
+
+
+@pytest.mark.parametrize(
+    ("retcode", "stdout", "stderr", "error"),
+    [
+        (1, b"not json", b"", "not json"),
+        (1, b"", b"Error: bad YAML\n", "Error: bad YAML"),
+        (0, b"{}", b"", ""),
+    ],
+)
+def test_from_goss_no_results(retcode, stdout, stderr, error):
+    result = SuiteResult.from_goss("security", retcode, stdout, stderr)
+    assert result.checks == ()
+    assert result.error == error
+    assert result.passed is (retcode == 0)
+
+
+@pytest.mark.parametrize(
+    ("retcodes", "expected"),
+    [
+        ((0, 0), 0),
+        ((0, 1), 1),
+        ((1, -9), -9),
+        ((), 0),
+    ],
+)
+def test_merge(retcodes, expected):
+    check = CheckResult("File", "/etc/hosts", "exists", True)
+    parts = [SuiteResult("security", code, (check,)) for code in retcodes]
+    merged = SuiteResult.merge("security", parts, 42)
+    assert merged.retcode == expected
+    assert merged.cancelled is (expected < 0)
+    assert len(merged.checks) == len(retcodes)
+    assert merged.duration == 42
+
+
+def test_dump_load(tmp_path):
+    result = SuiteResult.from_goss(
+        "security", 1, json.dumps(GOSS).encode(), duration=99
+    )
+    path = tmp_path / "goss-security.json"
+    result.dump(path)
+    assert SuiteResult.load(path) == result
+    assert '", "' not in path.read_text()  # Compact.
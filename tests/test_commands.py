@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 # Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
 # type: ignore
+from threading import Event
 from unittest.mock import Mock, patch
 
 import pytest
 
+from setupr.checks import SuiteResult
 from setupr.commands import pgp_key, pre_flight
 from setupr.gpg import GPG
 from setupr.pre_flight import PreFlight
@@ -19,7 +21,7 @@ from setupr.pre_flight import PreFlight
     ],
 )
 def test_pgp_key(key_exists, imported, expected, mock_console):
-    with patch("setupr.commands.GPG") as m_gpg:
+    with patch("setupr.commands.get_gpg") as m_gpg:
         mocked = Mock(spec=GPG)
         mocked.worldr_key_exists.return_value = key_exists
         mocked.import_worldr_key.return_value = imported
@@ -40,8 +42,51 @@ def test_pgp_key(key_exists, imported, expected, mock_console):
 def test_pre_flight(sec, infra, expected, mock_console):
     with patch("setupr.commands.PreFlight") as m_pre_flight:
         mocked = Mock(spec=PreFlight)
-        mocked.security.return_value = sec
-        mocked.infrastructure.return_value = infra
+        mocked.security.return_value = SuiteResult("security", sec)
+        mocked.infrastructure.return_value = SuiteResult("infra", infra)
         m_pre_flight.return_value = mocked
         assert pre_flight() is expected
         assert mock_console.print.called
+        m_pre_flight.assert_called_once_with(False)
+
+
+def test_pre_flight_infrastructure_failure_cancels(mock_console):
+    """The security suite is stopped as soon as it cannot matter."""
+    started = Event()
+
+    def _security(cancel):
+        started.set()
+        assert cancel.wait(timeout=5)
+        return SuiteResult("security", -9)
+
+    def _infrastructure(cancel):
+        assert started.wait(timeout=5)  # Concurrently.
+        return SuiteResult("infrastructure", 1)
+
+    with patch("setupr.commands.PreFlight") as m_pre_flight:
+        mocked = Mock(spec=PreFlight)
+        mocked.security.side_effect = _security
+        mocked.infrastructure.side_effect = _infrastructure
+        m_pre_flight.return_value = mocked
+        assert pre_flight() is False
+
+
+def test_pre_flight_cancelled(mock_console):
+    """Both suites stop when the caller cancels."""
+
+    def _suite(what):
+        def _run(cancel):
+            assert cancel.wait(timeout=5)
+            return SuiteResult(what, -9)
+
+        return _run
+
+    cancel = Event()
+    with patch("setupr.commands.PreFlight") as m_pre_flight:
+        mocked = Mock(spec=PreFlight)
+        mocked.security.side_effect = _suite("security")
+        mocked.infrastructure.side_effect = _suite("infrastructure")
+        m_pre_flight.return_value = mocked
+        cancel.set()
+        assert pre_flight(cancel=cancel) is False
+        assert mocked.security.call_args.args[0] is cancel
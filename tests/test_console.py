@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 # Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
 # type: ignore
+from concurrent.futures import Future
 from pathlib import Path
-from unittest.mock import Mock, patch
+from threading import Event
+from unittest.mock import ANY, Mock, patch
 
 import pytest
 from click import Option
@@ -11,14 +13,34 @@ from click.exceptions import UsageError
 from click.testing import CliRunner
 
 from setupr import __version__
-from setupr.console import main, validate_semver
+from setupr.bundle import BundleError
+from setupr.console import _version_check, main, validate_semver
 from setupr.downloader import Downloader
-from setupr.gbucket import InstallationData
+from setupr.gbucket import InstallationData, InstallationDataError
 from setupr.utils import VersionCheck
 
 SEMVER = "1.2.3"
 
 
+def _done(check=None, error=None):
+    future = Future()
+    if error is None:
+        future.set_result(check)
+    else:
+        future.set_exception(error)
+    return future
+
+
+@pytest.fixture(autouse=True)
+def no_version_check():
+    """Never ask GitHub."""
+    with patch(
+        "setupr.console._start_version_check",
+        return_value=_done(VersionCheck.UNKNOWN),
+    ) as mocked:
+        yield mocked
+
+
 def test_help():
     runner = CliRunner()
     result = runner.invoke(main, ["--help"])
@@ -38,6 +60,7 @@ def test_version():
         ("-i", "-d"),
         ("-d", "-b"),
         ("-b", "-i"),
+        ("--bundle-create", "-i"),
     ],
 )
 def test_mutually_exclusive(first, second):
@@ -111,10 +134,10 @@ def test_verify_semver(incoming, expected, error):
         ("-i", True, True, True, True, False, 4),
     ],
 )
-@patch("setupr.console.pgp_key")
-@patch("setupr.console.pre_flight")
-@patch("setupr.console.Downloader")
-@patch("setupr.console.InstallationData")
+@patch("setupr.commands.pgp_key")
+@patch("setupr.commands.pre_flight")
+@patch("setupr.downloader.Downloader")
+@patch("setupr.gbucket.InstallationData")
 def test_console(
     m_installation_data,
     m_downloader,
@@ -136,7 +159,8 @@ def test_console(
     m_pgp_key.return_value = key
     m_pre_flight.return_value = checks
     m_dlr = Mock(spec=Downloader)
-    m_dlr.get.return_value = get
+    m_dlr.download.return_value = get
+    m_dlr.verify.return_value = True
     m_dlr.execute_script.return_value = exec_ret_code
     m_downloader.return_value = m_dlr
 
@@ -153,6 +177,62 @@ def test_console(
     assert result.exit_code == expected, f"CLI output: {result.output}"
 
 
+@pytest.mark.parametrize(
+    ("error", "code"),
+    [
+        (None, 0),
+        (BundleError("Nope"), 1),
+    ],
+)
+@patch("setupr.bundle.create")
+def test_bundle_create(m_create, error, code):
+    m_create.side_effect = error
+    m_create.return_value = Path("setupr-bundle-v1.2.3.tar")
+    runner = CliRunner()
+    result = runner.invoke(main, ["--bundle-create", "1.2.3"])
+    assert result.exit_code == code, f"CLI output: {result.output}"
+    m_create.assert_called_once_with("v1.2.3", None)
+
+
+@pytest.mark.parametrize(
+    ("address", "error", "code"),
+    [
+        ("8765", None, 0),
+        ("ook", None, 1),
+        ("8765", OSError("Address already in use"), 1),
+    ],
+)
+@patch("setupr.serve.serve")
+def test_serve_cache(m_serve, address, error, code):
+    m_serve.side_effect = error
+    runner = CliRunner()
+    result = runner.invoke(main, ["--serve-cache", address])
+    assert result.exit_code == code, f"CLI output: {result.output}"
+    assert m_serve.called is (address != "ook")
+
+
+@patch("setupr.bundle.open_bundle")
+@patch("setupr.mirrors.configure")
+def test_from_bundle(m_configure, m_open_bundle, no_version_check, tmp_path):
+    bundle = tmp_path / "bundle.tar"
+    bundle.touch()
+    m_open_bundle.return_value = tmp_path
+    runner = CliRunner()
+    result = runner.invoke(main, ["--from-bundle", bundle.as_posix()])
+    assert result.exit_code == 1, f"CLI output: {result.output}"  # No -i.
+    m_configure.assert_called_once_with([tmp_path.as_uri()], offline=True)
+    assert not no_version_check.called  # Offline.
+
+
+@patch("setupr.bundle.open_bundle", side_effect=BundleError("Nope"))
+def test_from_bundle_invalid(_, tmp_path):
+    bundle = tmp_path / "bundle.tar"
+    bundle.touch()
+    runner = CliRunner()
+    result = runner.invoke(main, ["--from-bundle", bundle.as_posix()])
+    assert result.exit_code == 1, f"CLI output: {result.output}"
+
+
 def test_no_option():
     runner = CliRunner()
     result = runner.invoke(main, [])
@@ -174,28 +254,88 @@ def test_service_account_cannot_be_found():
 
 
 @pytest.mark.parametrize(
-    ("ask", "check", "code"),
+    ("ask", "future", "code"),
     [
-        (True, VersionCheck.LATEST, 3),
-        (True, VersionCheck.UNKNOWN, 3),
-        (True, VersionCheck.LAGGING, 0),
-        (False, VersionCheck.LAGGING, 3),
+        (True, _done(VersionCheck.LATEST), None),
+        (True, _done(VersionCheck.UNKNOWN), None),
+        (True, _done(error=RuntimeError("Nope")), None),
+        (True, _done(VersionCheck.LAGGING), 0),
+        (False, _done(VersionCheck.LAGGING), None),
+        (True, Future(), None),  # Still running.
+        (True, None, None),  # Offline.
     ],
 )
-def test_setupr_version_status(ask, check, code):
-    with patch("setupr.console.check_if_latest_version") as mock_check, patch(
-        "setupr.console.Confirm.ask"
-    ) as mock_ask:
-        mock_ask.return_value = ask
-        mock_check.return_value = check
-        runner = CliRunner()
-        result = runner.invoke(
-            main,
-            [
-                "-i",
-                "1.2.3",
-            ],
-        )
-        # We need to check an error further down the stack since
-        # a version unknown is fine for running setupr.
-        assert result.exit_code == code, f"CLI output: {result.output}"
+def test_setupr_version_status(ask, future, code):
+    with patch("rich.prompt.Confirm.ask", return_value=ask) as mock_ask:
+        if code is None:
+            _version_check(future)
+        else:
+            with pytest.raises(SystemExit) as ex:
+                _version_check(future)
+            assert ex.value.code == code
+    lagging = future is not None and future.done() and not future.exception()
+    assert mock_ask.called is (
+        lagging and future.result() == VersionCheck.LAGGING
+    )
+
+
+@pytest.mark.parametrize("opt", ["-i", "-d"])
+@patch("setupr.commands.pgp_key", return_value=True)
+@patch("setupr.commands.pre_flight", return_value=True)
+@patch("setupr.downloader.Downloader")
+@patch("setupr.gbucket.InstallationData")
+@patch("rich.prompt.Confirm.ask", return_value=True)
+def test_setupr_version_lagging(
+    _, m_installation_data, m_downloader, m_pre_flight, m_pgp_key, opt
+):
+    """The user is asked once everything is ready, before running."""
+    m_installation_data.return_value.service_account_json = Path("sa.json")
+    with patch(
+        "setupr.console._start_version_check",
+        return_value=_done(VersionCheck.LAGGING),
+    ):
+        result = CliRunner().invoke(main, [opt, "1.2.3"])
+    assert result.exit_code == 0, f"CLI output: {result.output}"
+    assert m_downloader.return_value.verify.called
+    assert not m_downloader.return_value.execute_script.called
+
+
+@pytest.mark.parametrize(("args", "full"), [([], False), (["--full"], True)])
+@patch("setupr.commands.pgp_key", return_value=True)
+@patch("setupr.commands.pre_flight", return_value=True)
+@patch("setupr.downloader.Downloader")
+@patch("setupr.gbucket.InstallationData")
+def test_full(m_installation_data, _, m_pre_flight, __, args, full):
+    m_installation_data.return_value.service_account_json = Path("sa.json")
+    result = CliRunner().invoke(main, ["-i", "1.2.3", *args])
+    assert result.exit_code == 0, f"CLI output: {result.output}"
+    m_pre_flight.assert_called_once_with(full, ANY)
+    assert isinstance(m_pre_flight.call_args.args[1], Event)
+
+
+@patch("setupr.commands.pgp_key", return_value=False)
+@patch("setupr.commands.pre_flight")
+@patch("setupr.downloader.Downloader")
+@patch("setupr.gbucket.InstallationData")
+def test_install_failure_cancels_pre_flight(
+    m_installation_data, _, m_pre_flight, __
+):
+    """The checks stop when the key cannot be imported."""
+    m_installation_data.return_value.service_account_json = Path("sa.json")
+    m_pre_flight.side_effect = lambda full, cancel: not cancel.wait(5)
+    result = CliRunner().invoke(main, ["-i", "1.2.3"])
+    assert result.exit_code == 1, f"CLI output: {result.output}"
+    assert m_pre_flight.call_args.args[1].is_set()
+
+
+@patch("setupr.commands.pgp_key", return_value=True)
+@patch("setupr.commands.pre_flight", return_value=True)
+@patch("setupr.downloader.Downloader")
+@patch("setupr.gbucket.InstallationData")
+def test_install_data_error(m_installation_data, *_):
+    m_installation_data.return_value.service_account_json = Path("sa.json")
+    m_installation_data.return_value.fetch.side_effect = InstallationDataError(
+        "Nope"
+    )
+    result = CliRunner().invoke(main, ["-i", "1.2.3"])
+    assert result.exit_code == 3, f"CLI output: {result.output}"
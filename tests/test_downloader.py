@@ -1,27 +1,57 @@
 # -*- coding: utf-8 -*-
 # Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
 # type: ignore
+import errno
+import hashlib
+import json
+import os
 import pathlib
 import re
 import stat
 import tempfile
-from concurrent.futures import ThreadPoolExecutor
 from glob import glob
+from threading import Barrier
 from unittest.mock import ANY, MagicMock, Mock, patch
 
 import gnupg
 import pytest
 import requests
 import requests_mock
+import urllib3
 from pendulum.parser import parse
 from pendulum.parsing.exceptions import ParserError
 from rich.progress import Progress, TaskID
 
-from setupr.downloader import Downloader, copy_url, download, take_backup
+from setupr.cache import ArtifactCache
+from setupr.downloader import (
+    CHUNK_SIZE,
+    FILL_TIME,
+    MAX_CHUNK_SIZE,
+    PART_SUFFIX,
+    STATE_SUFFIX,
+    DigestMismatchError,
+    Downloader,
+    RetryPolicy,
+    TransientHTTPError,
+    _adapt,
+    _preallocate,
+    _retry_after,
+    copy_url,
+    download,
+    take_backup,
+)
+from setupr.progress import get_progress
 
 URL = "https://worldr.com/index.html"
 INDEX = "/index.html"
 FAKE_VERSION = "v1.2.3"
+SHA256_CHARON = (
+    "4362bac71d971fc7d7b69a757de6fbcb5e1c513b393609043cae67b5341bd4af"
+)
+RESP_SHA256 = (
+    "d30db74ae503504cf0eff5cf28a7f23188e0bed27b2484fac73ebbe7e2b1b746"
+)
+NO_RETRY = RetryPolicy(attempts=1)
 
 
 @pytest.mark.parametrize("is_set", [True, False])
@@ -37,6 +67,7 @@ def test_copy_url(mocked_done_event: Mock, is_set: bool) -> None:
         copy_url(MagicMock(spec=TaskID), URL, dst, progress)
         assert progress.start_task.called
         assert progress.update.called
+        assert mocked.last_request.headers["Accept-Encoding"] == "identity"
 
 
 @patch("setupr.downloader.done_event")
@@ -54,19 +85,507 @@ def test_copy_url_request_exception(mocked_done_event: Mock) -> None:
         assert not progress.update.called
 
 
-def test_download() -> None:
+@pytest.mark.parametrize("expected_hash", [None, RESP_SHA256])
+def test_copy_url_hash(expected_hash: str | None) -> None:
+    with tempfile.TemporaryDirectory(
+        prefix="setupr_tests_"
+    ) as tmpdirname, requests_mock.Mocker() as mocked:
+        mocked.get(URL, text="resp", headers={"content-length": "4"})
+        dst = tmpdirname + INDEX
+        progress = MagicMock(spec=Progress)
+        assert (
+            copy_url(
+                MagicMock(spec=TaskID),
+                URL,
+                dst,
+                progress,
+                expected_hash=expected_hash,
+            )
+            == RESP_SHA256
+        )
+        assert pathlib.Path(dst).read_text() == "resp"
+
+
+def test_copy_url_hash_mismatch() -> None:
+    with tempfile.TemporaryDirectory(
+        prefix="setupr_tests_"
+    ) as tmpdirname, requests_mock.Mocker() as mocked:
+        mocked.get(URL, text="resp", headers={"content-length": "4"})
+        dst = tmpdirname + INDEX
+        progress = MagicMock(spec=Progress)
+        with pytest.raises(DigestMismatchError):
+            copy_url(
+                MagicMock(spec=TaskID),
+                URL,
+                dst,
+                progress,
+                expected_hash="deadbeef",
+            )
+        assert not pathlib.Path(dst).exists(), "Partial file must go"
+
+
+@patch("setupr.downloader.done_event")
+def test_copy_url_interrupted_has_no_digest(mocked_done_event: Mock) -> None:
+    mocked_done_event.is_set = Mock(return_value=True)
+    with tempfile.TemporaryDirectory(
+        prefix="setupr_tests_"
+    ) as tmpdirname, requests_mock.Mocker() as mocked:
+        mocked.get(URL, text="resp", headers={"content-length": "4"})
+        progress = MagicMock(spec=Progress)
+        assert (
+            copy_url(
+                MagicMock(spec=TaskID),
+                URL,
+                tmpdirname + INDEX,
+                progress,
+                expected_hash=RESP_SHA256,
+            )
+            == ""
+        )
+
+
+def _partial(dst: str, data: str, **state) -> None:
+    pathlib.Path(dst + PART_SUFFIX).write_text(data)
+    pathlib.Path(dst + STATE_SUFFIX).write_text(
+        json.dumps({"url": URL, "offset": len(data), **state})
+    )
+
+
+def test_copy_url_resume() -> None:
+    with tempfile.TemporaryDirectory(
+        prefix="setupr_tests_"
+    ) as tmpdirname, requests_mock.Mocker() as mocked:
+        dst = tmpdirname + INDEX
+        _partial(dst, "re", etag='"abc"')
+        mocked.get(
+            URL,
+            text="sp",
+            status_code=206,
+            headers={"content-length": "2", "content-range": "bytes 2-3/4"},
+        )
+        progress = MagicMock(spec=Progress)
+        digest = copy_url(MagicMock(spec=TaskID), URL, dst, progress)
+        assert digest == RESP_SHA256
+        assert mocked.last_request.headers["Range"] == "bytes=2-"
+        assert mocked.last_request.headers["If-Range"] == '"abc"'
+        assert pathlib.Path(dst).read_text() == "resp"
+        assert not pathlib.Path(dst + PART_SUFFIX).exists()
+        assert not pathlib.Path(dst + STATE_SUFFIX).exists()
+
+
+@pytest.mark.parametrize(
+    "state",
+    [
+        {"last_modified": "Wed, 21 Oct 2015 07:28:00 GMT"},  # It changed.
+        {"etag": '"abc"', "url": "https://worldr.com/other.html"},
+        {},  # No validators.
+    ],
+)
+def test_copy_url_resume_start_afresh(state: dict) -> None:
     with tempfile.TemporaryDirectory(
         prefix="setupr_tests_"
-    ) as tmpdirname, patch(
-        "setupr.downloader.ThreadPoolExecutor"
-    ) as mocked_thread_pool_executor:
-        pool = MagicMock(spec=ThreadPoolExecutor)
-        fut = Mock()
-        fut.result = Mock()
-        pool.submit = Mock(return_value=fut)
-        mocked_thread_pool_executor.return_value.__enter__ = Mock(
-            return_value=pool
+    ) as tmpdirname, requests_mock.Mocker() as mocked:
+        dst = tmpdirname + INDEX
+        _partial(dst, "xxxxxxxx", **state)
+        mocked.get(URL, text="resp", headers={"content-length": "4"})
+        progress = MagicMock(spec=Progress)
+        assert (
+            copy_url(MagicMock(spec=TaskID), URL, dst, progress) == RESP_SHA256
         )
+        assert pathlib.Path(dst).read_text() == "resp"
+
+
+@patch("setupr.downloader.done_event")
+def test_copy_url_interrupted_keeps_partial(mocked_done_event: Mock) -> None:
+    mocked_done_event.is_set = Mock(return_value=True)
+    with tempfile.TemporaryDirectory(
+        prefix="setupr_tests_"
+    ) as tmpdirname, requests_mock.Mocker() as mocked:
+        mocked.get(
+            URL, text="resp", headers={"content-length": "4", "etag": "abc"}
+        )
+        dst = tmpdirname + INDEX
+        progress = MagicMock(spec=Progress)
+        assert copy_url(MagicMock(spec=TaskID), URL, dst, progress) == ""
+        assert not pathlib.Path(dst).exists()
+        assert pathlib.Path(dst + PART_SUFFIX).read_text() == "resp"
+        state = json.loads(pathlib.Path(dst + STATE_SUFFIX).read_text())
+        assert state == {
+            "url": URL,
+            "source": URL,
+            "etag": "abc",
+            "last_modified": None,
+            "offset": 4,
+        }
+
+
+def test_copy_url_from_cache_without_request(tmp_path) -> None:
+    cache = ArtifactCache(tmp_path / "cache")
+    src = tmp_path / "src"
+    src.write_text("resp")
+    cache.store(URL, src, RESP_SHA256)
+    dst = tmp_path / "index.html"
+    with requests_mock.Mocker() as mocked:
+        progress = MagicMock(spec=Progress)
+        assert (
+            copy_url(
+                MagicMock(spec=TaskID),
+                URL,
+                dst.as_posix(),
+                progress,
+                expected_hash=RESP_SHA256,
+                cache=cache,
+            )
+            == RESP_SHA256
+        )
+        assert not mocked.called
+    assert dst.read_text() == "resp"
+
+
+@pytest.mark.parametrize("status", [200, 304])
+def test_copy_url_from_tampered_cache(status, tmp_path) -> None:
+    cache = ArtifactCache(tmp_path / "cache")
+    src = tmp_path / "src"
+    src.write_text("resp")
+    cache.store(URL, src, RESP_SHA256, etag='"abc"')
+    cache.path(RESP_SHA256).write_bytes(b"TAMPERED")
+    dst = tmp_path / "index.html"
+    with requests_mock.Mocker() as mocked:
+        responses = [{"text": "resp", "headers": {"content-length": "4"}}]
+        if status == 304:  # Revalidated, but the blob is not the content.
+            responses.insert(0, {"status_code": 304})
+        mocked.get(URL, responses)
+        progress = MagicMock(spec=Progress)
+        assert (
+            copy_url(
+                MagicMock(spec=TaskID),
+                URL,
+                dst.as_posix(),
+                progress,
+                expected_hash=RESP_SHA256 if status == 200 else None,
+                cache=cache,
+            )
+            == RESP_SHA256
+        )
+    assert dst.read_text() == "resp"
+    assert cache.path(RESP_SHA256).read_text() == "resp", "Stored again"
+
+
+def test_copy_url_cache_revalidated(tmp_path) -> None:
+    cache = ArtifactCache(tmp_path / "cache")
+    src = tmp_path / "src"
+    src.write_text("resp")
+    cache.store(URL, src, RESP_SHA256, etag='"abc"')
+    dst = tmp_path / "index.html"
+    with requests_mock.Mocker() as mocked:
+        mocked.get(URL, status_code=304)
+        progress = MagicMock(spec=Progress)
+        assert (
+            copy_url(
+                MagicMock(spec=TaskID),
+                URL,
+                dst.as_posix(),
+                progress,
+                cache=cache,
+            )
+            == RESP_SHA256
+        )
+        assert mocked.last_request.headers["If-None-Match"] == '"abc"'
+    assert dst.read_text() == "resp"
+
+
+def test_copy_url_cache_stored(tmp_path) -> None:
+    cache = ArtifactCache(tmp_path / "cache")
+    dst = tmp_path / "index.html"
+    with requests_mock.Mocker() as mocked:
+        mocked.get(
+            URL, text="resp", headers={"content-length": "4", "etag": "abc"}
+        )
+        progress = MagicMock(spec=Progress)
+        copy_url(
+            MagicMock(spec=TaskID), URL, dst.as_posix(), progress, cache=cache
+        )
+        assert "If-None-Match" not in mocked.last_request.headers
+    assert cache.lookup(URL) == {
+        "sha256": RESP_SHA256,
+        "etag": "abc",
+        "last_modified": None,
+    }
+
+
+@pytest.mark.parametrize(
+    ("size", "elapsed", "expected"),
+    [
+        (CHUNK_SIZE, 0.0, 2 * CHUNK_SIZE),
+        (MAX_CHUNK_SIZE, 0.0, MAX_CHUNK_SIZE),
+        (2 * CHUNK_SIZE, FILL_TIME, 2 * CHUNK_SIZE),
+        (2 * CHUNK_SIZE, 10.0, CHUNK_SIZE),
+        (CHUNK_SIZE, 10.0, CHUNK_SIZE),
+    ],
+)
+def test_adapt(size: int, elapsed: float, expected: int) -> None:
+    assert _adapt(size, elapsed) == expected
+
+
+def test_copy_url_coalesces_writes(tmp_path) -> None:
+    body = bytes(range(256)) * 4096  # 1 MiB.
+    with requests_mock.Mocker() as mocked:
+        mocked.get(
+            URL, content=body, headers={"content-length": str(len(body))}
+        )
+        progress = MagicMock(spec=Progress)
+        with patch("setupr.downloader._preallocate") as mocked_prealloc:
+            digest = copy_url(
+                MagicMock(spec=TaskID),
+                URL,
+                (tmp_path / "big").as_posix(),
+                progress,
+            )
+        mocked_prealloc.assert_called_once_with(ANY, 0, len(body))
+    assert digest == hashlib.sha256(body).hexdigest()
+    assert (tmp_path / "big").read_bytes() == body
+    advances = [
+        c.kwargs["advance"]
+        for c in progress.update.call_args_list
+        if "advance" in c.kwargs
+    ]
+    assert sum(advances) == len(body)
+    assert len(advances) <= len(body) // CHUNK_SIZE, "Writes are coalesced"
+
+
+def test_copy_url_not_preallocated_when_encoded(tmp_path) -> None:
+    with requests_mock.Mocker() as mocked:
+        mocked.get(
+            URL,
+            text="resp",
+            headers={"content-length": "4", "content-encoding": "identity"},
+        )
+        progress = MagicMock(spec=Progress)
+        with patch("setupr.downloader._preallocate") as mocked_prealloc:
+            copy_url(
+                MagicMock(spec=TaskID),
+                URL,
+                (tmp_path / "x").as_posix(),
+                progress,
+            )
+        assert not mocked_prealloc.called
+
+
+def test_copy_url_connection_lost_keeps_partial(tmp_path) -> None:
+    dst = (tmp_path / "index.html").as_posix()
+    reads = iter((b"re", None))
+
+    def _lost(buffer):
+        data = next(reads)
+        if data is None:
+            raise urllib3.exceptions.ProtocolError("Connection lost")
+        buffer[: len(data)] = data
+        return len(data)
+
+    with requests_mock.Mocker() as mocked, patch(
+        "urllib3.response.HTTPResponse.readinto", side_effect=_lost
+    ):
+        mocked.get(
+            URL, text="resp", headers={"content-length": "4", "etag": "abc"}
+        )
+        progress = MagicMock(spec=Progress)
+        with pytest.raises(requests.exceptions.ConnectionError):
+            copy_url(
+                MagicMock(spec=TaskID), URL, dst, progress, retry=NO_RETRY
+            )
+    assert pathlib.Path(dst + PART_SUFFIX).read_bytes() == b"re"
+    state = json.loads(pathlib.Path(dst + STATE_SUFFIX).read_text())
+    assert state["offset"] == 2
+
+
+FAST_RETRY = RetryPolicy(attempts=3, backoff=0)
+
+
+def test_copy_url_retries_transient_errors(tmp_path) -> None:
+    dst = (tmp_path / "index.html").as_posix()
+    with requests_mock.Mocker() as mocked:
+        mocked.get(
+            URL,
+            [
+                {"status_code": 503, "headers": {"Retry-After": "0"}},
+                {"status_code": 429},
+                {"text": "resp"},
+            ],
+        )
+        progress = MagicMock(spec=Progress)
+        digest = copy_url(
+            MagicMock(spec=TaskID), URL, dst, progress, retry=FAST_RETRY
+        )
+        assert mocked.call_count == 3
+    assert digest == RESP_SHA256
+
+
+def test_copy_url_retry_resumes(tmp_path) -> None:
+    dst = (tmp_path / "index.html").as_posix()
+    reads = iter((b"re", None, b"sp", b""))
+
+    def _lost(buffer):
+        data = next(reads)
+        if data is None:
+            raise urllib3.exceptions.ProtocolError("Connection lost")
+        buffer[: len(data)] = data
+        return len(data)
+
+    with requests_mock.Mocker() as mocked, patch(
+        "urllib3.response.HTTPResponse.readinto", side_effect=_lost
+    ):
+        mocked.get(
+            URL,
+            [
+                {
+                    "text": "resp",
+                    "headers": {"content-length": "4", "etag": "abc"},
+                },
+                {
+                    "status_code": 206,
+                    "text": "sp",
+                    "headers": {"content-range": "bytes 2-3/4"},
+                },
+            ],
+        )
+        progress = MagicMock(spec=Progress)
+        digest = copy_url(
+            MagicMock(spec=TaskID), URL, dst, progress, retry=FAST_RETRY
+        )
+        assert mocked.request_history[1].headers["Range"] == "bytes=2-"
+    assert digest == RESP_SHA256
+    assert pathlib.Path(dst).read_bytes() == b"resp"
+
+
+def test_copy_url_fails_over(tmp_path) -> None:
+    """The mirror drops the connection, the origin sends the rest."""
+    dst = (tmp_path / "index.html").as_posix()
+    mirror = "https://mirror.example/index.html"
+    reads = iter((b"re", None, b"sp", b""))
+
+    def _lost(buffer):
+        data = next(reads)
+        if data is None:
+            raise urllib3.exceptions.ProtocolError("Connection lost")
+        buffer[: len(data)] = data
+        return len(data)
+
+    with requests_mock.Mocker() as mocked, patch(
+        "urllib3.response.HTTPResponse.readinto", side_effect=_lost
+    ):
+        mocked.get(
+            mirror, text="resp", headers={"content-length": "4", "etag": "m"}
+        )
+        mocked.get(
+            URL,
+            status_code=206,
+            text="sp",
+            headers={"content-range": "bytes 2-3/4", "etag": "o"},
+        )
+        progress = MagicMock(spec=Progress)
+        digest = copy_url(
+            MagicMock(spec=TaskID),
+            URL,
+            dst,
+            progress,
+            expected_hash=RESP_SHA256,
+            retry=NO_RETRY,
+            sources=[mirror, URL],
+        )
+        resumed = mocked.request_history[1]
+        assert resumed.url == URL
+        assert resumed.headers["Range"] == "bytes=2-"
+        assert "If-Range" not in resumed.headers  # The digest is checked.
+    assert digest == RESP_SHA256
+
+
+@pytest.mark.parametrize(
+    ("code", "calls", "error"),
+    [
+        (503, 3, TransientHTTPError),
+        (404, 1, requests.exceptions.RequestException),
+    ],
+)
+def test_copy_url_retry_gives_up(
+    code: int, calls: int, error: type, tmp_path
+) -> None:
+    dst = (tmp_path / "index.html").as_posix()
+    with requests_mock.Mocker() as mocked:
+        mocked.get(URL, status_code=code)
+        progress = MagicMock(spec=Progress)
+        with pytest.raises(error):
+            copy_url(
+                MagicMock(spec=TaskID), URL, dst, progress, retry=FAST_RETRY
+            )
+        assert mocked.call_count == calls
+
+
+def test_copy_url_retry_budget(tmp_path) -> None:
+    """The server asks for a delay longer than our budget: give up."""
+    dst = (tmp_path / "index.html").as_posix()
+    with requests_mock.Mocker() as mocked:
+        mocked.get(URL, status_code=503, headers={"Retry-After": "60"})
+        progress = MagicMock(spec=Progress)
+        with pytest.raises(TransientHTTPError):
+            copy_url(
+                MagicMock(spec=TaskID),
+                URL,
+                dst,
+                progress,
+                retry=RetryPolicy(budget=10),
+            )
+        assert mocked.call_count == 1
+
+
+@patch("setupr.downloader.random.uniform", side_effect=lambda _, cap: cap)
+def test_retry_policy_delay(_) -> None:
+    policy = RetryPolicy(backoff=1, max_backoff=5)
+    assert [policy.delay(attempt) for attempt in range(4)] == [1, 2, 4, 5]
+    assert policy.delay(0, retry_after=7) == 7
+    assert policy.delay(0, retry_after=-1) == 0
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        (None, None),
+        ("", None),
+        ("12", 12.0),
+        ("soon", None),
+    ],
+)
+def test_retry_after(value: str | None, expected: float | None) -> None:
+    assert _retry_after(value) == expected
+
+
+def test_retry_after_date() -> None:
+    assert _retry_after("Wed, 21 Oct 2015 07:28:00 GMT") < 0
+
+
+def test_preallocate() -> None:
+    with tempfile.TemporaryFile() as fd:
+        _preallocate(fd.fileno(), 0, 1024)
+        assert os.fstat(fd.fileno()).st_size == 1024
+        _preallocate(fd.fileno(), 0, 0)  # Nothing to do.
+
+
+def test_preallocate_not_supported() -> None:
+    with patch(
+        "setupr.downloader.os.posix_fallocate",
+        side_effect=OSError(errno.EOPNOTSUPP, "Nope"),
+    ):
+        _preallocate(0, 0, 1024)
+    with patch(
+        "setupr.downloader.os.posix_fallocate",
+        side_effect=OSError(errno.ENOSPC, "Full"),
+    ), pytest.raises(OSError, match="Full"):
+        _preallocate(0, 0, 1024)
+
+
+def test_download() -> None:
+    with tempfile.TemporaryDirectory(
+        prefix="setupr_tests_"
+    ) as tmpdirname, patch("setupr.downloader.copy_url") as mocked_copy_url:
         download(
             [
                 URL,
@@ -74,25 +593,16 @@ def test_download() -> None:
             tmpdirname,
         )
 
-        pool.submit.assert_called_once_with(
-            ANY, ANY, URL, tmpdirname + INDEX, ANY
+        mocked_copy_url.assert_called_once_with(
+            ANY, URL, tmpdirname + INDEX, ANY, ANY, None, None, ANY, [URL]
         )
-        assert fut.result.called
 
 
 def test_download_failed() -> None:
     with tempfile.TemporaryDirectory(
         prefix="setupr_tests_"
-    ) as tmpdirname, patch(
-        "setupr.downloader.ThreadPoolExecutor"
-    ) as mocked_thread_pool_executor:
-        pool = MagicMock(spec=ThreadPoolExecutor)
-        fut = Mock()
-        fut.result = Mock(side_effect=requests.exceptions.RequestException)
-        pool.submit = Mock(return_value=fut)
-        mocked_thread_pool_executor.return_value.__enter__ = Mock(
-            return_value=pool
-        )
+    ) as tmpdirname, patch("setupr.downloader.copy_url") as mocked_copy_url:
+        mocked_copy_url.side_effect = requests.exceptions.RequestException
 
         with pytest.raises(requests.exceptions.RequestException):
             download(
@@ -102,10 +612,200 @@ def test_download_failed() -> None:
                 tmpdirname,
             )
 
-        pool.submit.assert_called_once_with(
-            ANY, ANY, URL, tmpdirname + INDEX, ANY
+        mocked_copy_url.assert_called_once_with(
+            ANY, URL, tmpdirname + INDEX, ANY, ANY, None, None, ANY, [URL]
+        )
+
+
+@pytest.mark.parametrize("fails", [False, True])
+def test_download_removes_its_tasks(fails: bool) -> None:
+    progress = get_progress()
+    before = progress.task_ids
+    with tempfile.TemporaryDirectory(
+        prefix="setupr_tests_"
+    ) as tmpdirname, patch("setupr.downloader.copy_url") as mocked_copy_url:
+        if fails:
+            mocked_copy_url.side_effect = requests.exceptions.RequestException
+        for _ in range(3):
+            try:
+                download([URL], tmpdirname, check_existing=False)
+            except requests.exceptions.RequestException:
+                pass
+            assert progress.task_ids == before
+
+
+@pytest.mark.parametrize(
+    ("content", "check_existing", "fetched"),
+    [
+        ("resp", True, False),
+        ("resp", False, True),
+        ("stale", True, True),
+    ],
+)
+def test_download_check_existing(
+    content: str, check_existing: bool, fetched: bool
+) -> None:
+    with tempfile.TemporaryDirectory(
+        prefix="setupr_tests_"
+    ) as tmpdirname, patch("setupr.downloader.copy_url") as mocked_copy_url:
+        mocked_copy_url.return_value = RESP_SHA256
+        pathlib.Path(tmpdirname + INDEX).write_text(content)
+        assert download(
+            [URL],
+            tmpdirname,
+            expected_hashes={URL: RESP_SHA256},
+            check_existing=check_existing,
+        ) == {URL: RESP_SHA256}
+        assert mocked_copy_url.called is fetched
+        assert pathlib.Path(tmpdirname, "archives").is_dir() is fetched
+
+
+BIG = bytes(range(256)) * 64  # 16 KiB.
+BIG_SHA256 = hashlib.sha256(BIG).hexdigest()
+
+
+def _ranges(request, context):
+    start, end = (
+        int(x) for x in request.headers["Range"].split("=")[1].split("-")
+    )
+    context.status_code = 206
+    context.headers["content-range"] = f"bytes {start}-{end}/{len(BIG)}"
+    return BIG[start : end + 1]
+
+
+@pytest.mark.parametrize("cached", [False, True])
+@patch("setupr.downloader.SEGMENT_THRESHOLD", 1024)
+def test_download_segmented(cached: bool, tmp_path) -> None:
+    cache = ArtifactCache(tmp_path / "cache")
+    if cached:
+        src = tmp_path / "src"
+        src.write_bytes(BIG)
+        cache.store("https://elsewhere.com/big", src, BIG_SHA256)
+    with requests_mock.Mocker() as mocked:
+        mocked.head(
+            URL,
+            headers={
+                "content-length": str(len(BIG)),
+                "accept-ranges": "bytes",
+            },
+        )
+        mocked.get(URL, content=_ranges)
+        assert download(
+            [URL],
+            tmp_path.as_posix(),
+            max_workers=4,
+            expected_hashes={URL: BIG_SHA256},
+            cache=cache,
+            segmented=True,
+        ) == {URL: BIG_SHA256}
+        ranges = sorted(
+            r.headers["Range"]
+            for r in mocked.request_history
+            if r.method == "GET"
+        )
+        if cached:
+            assert not mocked.called
+        else:
+            assert ranges == [
+                "bytes=0-4095",
+                "bytes=12288-16383",
+                "bytes=4096-8191",
+                "bytes=8192-12287",
+            ]
+            assert all(
+                r.headers["Accept-Encoding"] == "identity"
+                for r in mocked.request_history
+            ), "Ranges are counted in bytes of the resource"
+    assert (tmp_path / "index.html").read_bytes() == BIG
+    assert not (tmp_path / f"index.html{PART_SUFFIX}").exists()
+    assert cache.lookup(URL if not cached else "https://elsewhere.com/big")
+
+
+@patch("setupr.downloader.SEGMENT_THRESHOLD", 1024)
+def test_download_segmented_wrong_hash(tmp_path) -> None:
+    with requests_mock.Mocker() as mocked:
+        mocked.head(
+            URL,
+            headers={
+                "content-length": str(len(BIG)),
+                "accept-ranges": "bytes",
+            },
+        )
+        mocked.get(URL, content=_ranges)
+        with pytest.raises(DigestMismatchError):
+            download(
+                [URL],
+                tmp_path.as_posix(),
+                expected_hashes={URL: "deadbeef"},
+                segmented=True,
+            )
+    assert not (tmp_path / "index.html").exists()
+    assert not (tmp_path / f"index.html{PART_SUFFIX}").exists()
+
+
+@patch("setupr.downloader.SEGMENT_THRESHOLD", 1024)
+def test_download_segmented_range_failure(tmp_path) -> None:
+    with requests_mock.Mocker() as mocked:
+        mocked.head(
+            URL,
+            headers={
+                "content-length": str(len(BIG)),
+                "accept-ranges": "bytes",
+            },
         )
-        assert fut.result.called
+        mocked.get(URL, status_code=500)
+        with pytest.raises(requests.exceptions.RequestException):
+            download(
+                [URL], tmp_path.as_posix(), segmented=True, retry=NO_RETRY
+            )
+    assert not (tmp_path / f"index.html{PART_SUFFIX}").exists()
+
+
+@pytest.mark.parametrize(
+    "headers",
+    [
+        {"content-length": "16384"},  # No ranges.
+        {"content-length": "10", "accept-ranges": "bytes"},  # Too small.
+    ],
+)
+@patch("setupr.downloader.SEGMENT_THRESHOLD", 1024)
+def test_download_not_segmented(headers: dict, tmp_path) -> None:
+    with requests_mock.Mocker() as mocked, patch(
+        "setupr.downloader.copy_url"
+    ) as mocked_copy_url:
+        mocked_copy_url.return_value = BIG_SHA256
+        mocked.head(URL, headers=headers)
+        download([URL], tmp_path.as_posix(), segmented=True)
+        assert mocked_copy_url.called
+
+
+def test_download_is_concurrent() -> None:
+    """Both transfers must be in flight at the same time.
+
+    The barrier would time out, and raise, if the second transfer was only
+    started once the first one finished.
+    """
+    barrier = Barrier(2, timeout=5)
+    with tempfile.TemporaryDirectory(
+        prefix="setupr_tests_"
+    ) as tmpdirname, patch("setupr.downloader.copy_url") as mocked_copy_url:
+        mocked_copy_url.side_effect = lambda *_: barrier.wait()
+        download([URL, URL + ".sig"], tmpdirname, max_workers=2)
+        assert mocked_copy_url.call_count == 2
+
+
+def test_download_failure_cancels_the_others() -> None:
+    def _side_effect(_, url, __, ___, cancel, *____):
+        if url == URL:
+            raise requests.exceptions.RequestException
+        assert cancel.wait(timeout=5), "The failure should cancel us"
+
+    with tempfile.TemporaryDirectory(
+        prefix="setupr_tests_"
+    ) as tmpdirname, patch("setupr.downloader.copy_url") as mocked_copy_url:
+        mocked_copy_url.side_effect = _side_effect
+        with pytest.raises(requests.exceptions.RequestException):
+            download([URL, URL + ".sig"], tmpdirname, max_workers=2)
 
 
 def test_take_backup() -> None:
@@ -203,41 +903,37 @@ def test_get_files(
 
 
 @pytest.mark.parametrize(
-    ("sha", "error", "expected"),
+    ("digest", "error", "expected"),
     [
-        (
-            "4362bac71d971fc7d7b69a757de6fbcb5e1c513b393609043cae67b5341bd4af",
-            None,
-            True,
-        ),
-        (
-            "deadbeefdeadbeefdeadbeefdeadbeefdeadbeefdeadbeefdeadbeefdeadbeef",
-            None,
-            False,
-        ),
-        (
-            "4362bac71d971fc7d7b69a757de6fbcb5e1c513b393609043cae67b5341bd4af",
-            OSError,
-            False,
-        ),
-        (
-            "4362bac71d971fc7d7b69a757de6fbcb5e1c513b393609043cae67b5341bd4af",
-            requests.exceptions.RequestException,
-            False,
-        ),
+        (SHA256_CHARON, None, True),
+        ("", None, False),
+        (None, DigestMismatchError, False),
+        (None, OSError, False),
+        (None, requests.exceptions.RequestException, False),
     ],
 )
 def test_fetch(
-    sha: str,
+    digest: str | None,
     error: Exception | None,
     expected: bool,
     downloader: Downloader,
 ) -> None:
     dst = pathlib.Path(__file__).parent / "charon-lord-dunsany.txt"
     with patch("setupr.downloader.download") as mocked_download:
+        mocked_download.return_value = {"/dev/null": digest}
         mocked_download.side_effect = error
-        assert downloader.fetch("/dev/null", dst, sha) is expected
-        assert mocked_download.called
+        assert downloader.fetch("/dev/null", dst, SHA256_CHARON) is expected
+        mocked_download.assert_called_once_with(
+            ("/dev/null",),
+            ANY,
+            ANY,
+            {"/dev/null": SHA256_CHARON},
+            ANY,
+            True,
+            False,
+            ANY,
+            ANY,
+        )
 
 
 def test_execute_script_do_not_execute(downloader: Downloader) -> None:
@@ -308,3 +1004,38 @@ def test_execute_script(
             assert mocked_console.called
             assert mocked_confirm.ask.called
             assert proc.communicate.called
+
+
+@pytest.mark.parametrize(
+    ("what", "downloaded", "verified", "expected"),
+    [
+        ("Elden Ring", True, True, False),
+        ("install", False, True, False),
+        ("install", True, False, False),
+        ("install", True, True, True),
+    ],
+)
+def test_downloader_download_then_verify(
+    downloader: Downloader,
+    what: str,
+    downloaded: bool,
+    verified: bool,
+    expected: bool,
+) -> None:
+    with patch.object(
+        downloader, "_download_files", return_value=downloaded
+    ) as m_download, patch.object(
+        downloader, "_verify_files", return_value=verified
+    ) as m_verify:
+        assert (
+            downloader.download(what, "v1.2.3")
+            and downloader.verify(what, "v1.2.3")
+        ) is expected
+    if what == "install":
+        m_download.assert_called_once_with("worldr-aa", "v1.2.3")
+        assert m_verify.called is downloaded
+
+
+def test_verify_files_missing(downloader: Downloader) -> None:
+    downloader._gpg.validate_worldr_signature = MagicMock(side_effect=OSError)
+    assert downloader._verify_files("test", FAKE_VERSION) is False
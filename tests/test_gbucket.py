@@ -56,7 +56,7 @@ def test_get(
 ) -> None:
     """Test get."""
     with patch(
-        "setupr.gbucket.storage.Client.from_service_account_json"
+        "google.cloud.storage.Client.from_service_account_json"
     ) as m_from_service_account_json:
         m_blob = Mock()
         m_blob.download_to_filename = Mock(side_effect=error)
@@ -96,3 +96,15 @@ def test_sa_is_path() -> None:
     sut = InstallationData(PosixPath("tests/EldenRing.sa.json"))
     assert sut.bucket_name == "worldr-customer-EldenRing"
     assert sut.blob_name == "tests/EldenRing-values.yaml"
+
+
+def test_get_from_bundle(tmp_path: Path) -> None:
+    (tmp_path / "bundle").mkdir()
+    (tmp_path / "bundle" / "EldenRing-values.yaml").write_text("values")
+    sut = InstallationData(
+        tmp_path / "EldenRing.sa.json", bundle=tmp_path / "bundle"
+    )
+    with patch("google.cloud.storage.Client") as mocked_client:
+        assert sut.get()
+        assert not mocked_client.called
+    assert Path(sut.blob_name).read_text() == "values"
@@ -1,24 +1,35 @@
 # -*- coding: utf-8 -*-
 # Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
 # type: ignore
+import time
 from pathlib import Path, PurePath
 from unittest.mock import MagicMock, patch
 
 import gnupg  # ignore: type
 import pytest
 
-from setupr.gpg import GPG
+from setupr.gpg import GPG, get_gpg
 
 CHARON_LORD_DUNSANY_TXT = "charon-lord-dunsany.txt"
+WORLDR_FINGERPRINT = "935D282626A16D1A0430487D65A277F7800F774C"
 
 
 @pytest.fixture()
-def mocked_gpg():
+def keyring(tmp_path, monkeypatch):
+    monkeypatch.setenv("GNUPGHOME", tmp_path.as_posix())
+    path = tmp_path / "pubring.kbx"
+    path.write_bytes(b"keys")
+    return path
+
+
+@pytest.fixture()
+def mocked_gpg(keyring):
     with patch("setupr.gpg.gnupg") as mock_gpg:
         mock_gpg.return_value = MagicMock(spec=gnupg.GPG)
         sut = GPG()
-        mock_gpg.GPG.assert_called_once()
+        mock_gpg.GPG.assert_not_called()
         assert isinstance(sut._gpg, MagicMock)
+        mock_gpg.GPG.assert_called_once()
         return sut
 
 
@@ -29,6 +40,38 @@ def test_worldr_key_exists(mocked_gpg):
         ]
     )
     assert mocked_gpg.worldr_key_exists() is True, "Worldr key should be there"
+    mocked_gpg._gpg.list_keys.assert_called_once_with(
+        keys=["935D282626A16D1A0430487D65A277F7800F774C"]
+    )
+
+
+def test_worldr_key_exists_stamp(mocked_gpg, keyring):
+    mocked_gpg._gpg.list_keys = MagicMock(
+        return_value=[
+            {"fingerprint": "935D282626A16D1A0430487D65A277F7800F774C"}
+        ]
+    )
+    assert mocked_gpg.worldr_key_exists() is True
+    with patch("setupr.gpg.gnupg") as mock_gpg:
+        sut = GPG()
+        assert sut.worldr_key_exists() is True, "Stamp should be used"
+        mock_gpg.GPG.assert_not_called()
+        keyring.write_bytes(b"other keys")
+        sut._gpg.list_keys.return_value = []
+        assert sut.worldr_key_exists() is False, "Keyring has changed"
+        mock_gpg.GPG.assert_called_once()
+
+
+def test_worldr_key_exists_no_keyring(mocked_gpg, keyring):
+    keyring.unlink()
+    mocked_gpg._gpg.list_keys = MagicMock(
+        return_value=[
+            {"fingerprint": "935D282626A16D1A0430487D65A277F7800F774C"}
+        ]
+    )
+    assert mocked_gpg.worldr_key_exists() is True
+    assert mocked_gpg.worldr_key_exists() is True
+    assert mocked_gpg._gpg.list_keys.call_count == 2, "No stamp to use"
 
 
 def test_worldr_key_does_not_exist(mocked_gpg):
@@ -69,6 +112,9 @@ def test_import_key_success(mocked_gpg):
     mocked_gpg._gpg.trust_keys.assert_called_with(
         imported.fingerprints[0], "TRUST_ULTIMATE"
     )
+    mocked_gpg._gpg.list_keys = MagicMock()
+    assert mocked_gpg.worldr_key_exists() is True, "Stamp should be used"
+    mocked_gpg._gpg.list_keys.assert_not_called()
 
 
 def test_verify_failure(mocked_gpg):
@@ -93,6 +139,8 @@ def test_verify_failure(mocked_gpg):
 def test_verify_success(mocked_gpg):
     verified = MagicMock(spec=gnupg.Verify)
     verified.status = "signature valid"
+    verified.valid = True
+    verified.pubkey_fingerprint = WORLDR_FINGERPRINT
     mocked_gpg._gpg.verify_file = MagicMock(return_value=verified)
     filename = PurePath(
         Path(__file__).resolve().parent, CHARON_LORD_DUNSANY_TXT
@@ -109,6 +157,72 @@ def test_verify_success(mocked_gpg):
     mocked_gpg._gpg.verify_file.assert_called()
 
 
+@pytest.mark.parametrize(
+    ("status", "valid", "signer", "calls"),
+    [
+        ("signature valid", True, WORLDR_FINGERPRINT, 1),
+        ("signature valid", True, "1" * 40, 2),
+        ("no public key", False, None, 2),
+    ],
+    ids=["worldr", "other-key", "no-key"],
+)
+def test_verify_once(mocked_gpg, tmp_path, status, valid, signer, calls):
+    verified = MagicMock(spec=gnupg.Verify)
+    verified.status = status
+    verified.valid = valid
+    verified.pubkey_fingerprint = signer
+    mocked_gpg._gpg.verify_file = MagicMock(return_value=verified)
+    filename = tmp_path / CHARON_LORD_DUNSANY_TXT
+    filename.write_text("The boat went on.")
+    signature = tmp_path / "charon-lord-dunsany.sig"
+    signature.write_bytes(b"signature")
+    args = (filename.as_posix(), signature.as_posix())
+    mocked_gpg.validate_worldr_signature(*args)
+    mocked_gpg.validate_worldr_signature(*args)
+    assert mocked_gpg._gpg.verify_file.call_count == calls
+    if calls == 1:  # Only a valid Worldr signature is remembered.
+        filename.write_text("The boat went on and on.")
+        verified.status = "signature bad"
+        verified.valid = False
+        assert mocked_gpg.validate_worldr_signature(*args) is False
+        assert mocked_gpg.validate_worldr_signature(*args) is False
+        assert mocked_gpg._gpg.verify_file.call_count == 3, "Bad, not cached"
+
+
+def test_verify_many(mocked_gpg, tmp_path):
+    def _verify(stream, filename):
+        time.sleep(0.1)
+        verified = MagicMock(spec=gnupg.Verify)
+        verified.status = "signature bad" if "bad" in filename else "valid"
+        verified.valid = "bad" not in filename
+        verified.pubkey_fingerprint = WORLDR_FINGERPRINT
+        return verified
+
+    mocked_gpg._gpg.verify_file = MagicMock(side_effect=_verify)
+    pairs = []
+    for index in range(8):
+        name = tmp_path / f"{'bad' if index == 3 else 'good'}-{index}.sh"
+        name.write_text(str(index))
+        name.with_suffix(".sig").write_text("signature")
+        pairs.append((name.as_posix(), name.with_suffix(".sig").as_posix()))
+    pairs.append(((tmp_path / "missing.sh").as_posix(), pairs[0][1]))
+    start = time.monotonic()
+    results = mocked_gpg.validate_worldr_signatures(pairs)
+    assert time.monotonic() - start < 0.6, "Verified concurrently"
+    assert list(results) == [name for name, _ in pairs]
+    assert [name for name, valid in results.items() if not valid] == [
+        pairs[3][0],
+        pairs[8][0],
+    ]
+    assert mocked_gpg.validate_worldr_signatures([]) == {}
+
+
+def test_get_gpg():
+    with patch("setupr.gpg.gnupg") as mock_gpg:
+        assert get_gpg() is get_gpg()
+        mock_gpg.GPG.assert_not_called()
+
+
 @pytest.mark.filterwarnings("ignore:setDaemon")
 def test_verify_for_real():
     """Verify the `charon-lord-dunsany.txt` file for real.
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
+# type: ignore
+"""Cold start budget of the command line.
+
+`setupr --version` and `setupr --help` must not pay for the modules that
+only the real commands need.
+"""
+import re
+import subprocess
+import sys
+
+import pytest
+
+# Microseconds, cumulative, as reported by `python -X importtime`. It is
+# about 60ms on a developer laptop, against 360ms with eager imports.
+BUDGET = 150_000
+HEAVY = (
+    "google.cloud",
+    "gnupg",
+    "pendulum",
+    "plumbum",
+    "requests",
+    "rich",
+    "structlog",
+)
+
+
+def _run(code: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def _import_time(stderr: str, module: str) -> int:
+    """Return the cumulative import time of module, in microseconds."""
+    match = re.search(rf"\|\s*(\d+) \|\s*{re.escape(module)}$", stderr, re.M)
+    assert match is not None, f"{module} was not imported"
+    return int(match[1])
+
+
+@pytest.mark.parametrize("option", ["--version", "--help"])
+def test_no_heavy_imports(option: str) -> None:
+    result = _run(
+        "import sys\n"
+        "from click.testing import CliRunner\n"
+        "from setupr.console import main\n"
+        f"CliRunner().invoke(main, [{option!r}])\n"
+        "print(' '.join(sorted(sys.modules)))\n"
+    )
+    loaded = set(result.stdout.split())
+    assert not [
+        heavy
+        for heavy in HEAVY
+        if heavy in loaded or any(m.startswith(f"{heavy}.") for m in loaded)
+    ]
+
+
+def test_import_time_budget() -> None:
+    result = _run("import setupr.console")
+    assert _import_time(result.stderr, "setupr.console") < BUDGET
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
+# type: ignore
+import os
+
+import pytest
+
+from setupr.checks import CheckResult, SuiteResult
+from setupr.incremental import IncrementalChecks, fingerprint
+
+
+@pytest.fixture
+def hosts(tmp_path):
+    path = tmp_path / "hosts"
+    path.write_text("127.0.0.1 localhost\n")
+    return path
+
+
+def _data(hosts):
+    return {
+        "file": {hosts.as_posix(): {"exists": True}},
+        "command": {"uptime": {"exit-status": 0}},
+    }
+
+
+def _result(hosts, successful=True):
+    return SuiteResult(
+        "security",
+        0 if successful else 1,
+        (
+            CheckResult("File", hosts.as_posix(), "exists", successful),
+            CheckResult("Command", "uptime", "exit-status", True),
+        ),
+    )
+
+
+def _run(path, data, result):
+    sut = IncrementalChecks(path, "v0.3.16")
+    todo, reused = sut.plan(data)
+    sut.update(result)
+    return todo, reused
+
+
+def test_fingerprint(hosts):
+    first = fingerprint("file", hosts.as_posix(), {"exists": True})
+    assert first == fingerprint("file", hosts.as_posix(), {"exists": True})
+    assert first != fingerprint("file", hosts.as_posix(), {"mode": "0644"})
+    assert first != fingerprint(
+        "file", hosts.as_posix(), {"exists": True}, "v0.3.17"
+    )
+    assert fingerprint("package", "nginx", {}) is not None
+    assert fingerprint("command", "uptime", {}) is None
+    stat = hosts.stat()
+    os.utime(hosts, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert first != fingerprint("file", hosts.as_posix(), {"exists": True})
+
+
+def test_plan_reuses_what_passed(tmp_path, hosts):
+    state = tmp_path / "state.json"
+    todo, reused = _run(state, _data(hosts), _result(hosts))
+    assert todo == _data(hosts)
+    assert reused == []
+    todo, reused = _run(state, _data(hosts), _result(hosts))
+    assert todo == {"command": {"uptime": {"exit-status": 0}}}
+    assert reused == [_result(hosts).checks[0]]
+
+
+def test_plan_reruns_what_changed(tmp_path, hosts):
+    state = tmp_path / "state.json"
+    _run(state, _data(hosts), _result(hosts))
+    hosts.write_text("127.0.0.1 localhost ranni\n")
+    todo, _ = _run(state, _data(hosts), _result(hosts))
+    assert "file" in todo
+
+
+def test_plan_reruns_what_failed(tmp_path, hosts):
+    state = tmp_path / "state.json"
+    _run(state, _data(hosts), _result(hosts, successful=False))
+    todo, _ = _run(state, _data(hosts), _result(hosts))
+    assert "file" in todo
+
+
+def test_plan_invalid_state(tmp_path, hosts):
+    state = tmp_path / "state.json"
+    state.write_text("ook")
+    todo, reused = IncrementalChecks(state).plan(_data(hosts))
+    assert todo == _data(hosts)
+    assert reused == []
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
+# type: ignore
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+import requests_mock
+from rich.progress import Progress
+
+from setupr import mirrors
+from setupr.downloader import download
+from setupr.mirrors import MIRRORS_ENV, Mirrors, configure, get_mirrors
+
+URL = "https://worldr.com/install/index.html"
+MIRROR_A = "https://a.example/worldr"
+MIRROR_B = "https://b.example/worldr"
+SRC_A = f"{MIRROR_A}/index.html"
+SRC_B = f"{MIRROR_B}/index.html"
+
+
+@pytest.fixture(autouse=True)
+def no_progress():
+    with patch("setupr.downloader.get_progress") as mocked:
+        mocked.return_value = MagicMock(spec=Progress)
+        yield
+
+
+@pytest.fixture(autouse=True)
+def reset_mirrors():
+    yield
+    mirrors._mirrors = None
+
+
+def test_configure(monkeypatch):
+    monkeypatch.setenv(MIRRORS_ENV, f"{MIRROR_B}, {MIRROR_A}/ file:///srv")
+    sut = configure([MIRROR_A])
+    assert sut.bases == [MIRROR_A, MIRROR_B, "file:///srv"]
+    assert get_mirrors() is sut
+
+
+def test_configure_nothing(monkeypatch):
+    monkeypatch.delenv(MIRRORS_ENV, raising=False)
+    assert not configure()
+
+
+def test_candidates():
+    assert Mirrors([MIRROR_A, MIRROR_B]).candidates(URL) == [
+        SRC_A,
+        SRC_B,
+        URL,
+    ]
+
+
+def test_rank_without_mirrors():
+    with requests_mock.Mocker() as mocked:
+        assert Mirrors().rank([URL]) == {URL: [URL]}
+        assert not mocked.called
+
+
+@pytest.mark.parametrize(
+    ("latency", "expected"),
+    [
+        ({SRC_A: 0.2, SRC_B: 0.1, URL: None}, [SRC_B, SRC_A, URL]),
+        ({SRC_A: 0.1, SRC_B: 0.1, URL: 0.3}, [SRC_A, SRC_B, URL]),
+        ({SRC_A: None, SRC_B: 0.4, URL: 0.3}, [SRC_B, URL]),
+        ({SRC_A: 0.5, SRC_B: 0.4, URL: 0.1}, [SRC_B, SRC_A, URL]),
+    ],
+)
+def test_rank(latency, expected):
+    sut = Mirrors([MIRROR_A, MIRROR_B])
+    with patch.object(sut, "_probe", side_effect=latency.get) as mocked:
+        assert sut.rank([URL]) == {URL: expected}
+        assert sut.rank([URL]) == {URL: expected}
+        assert mocked.call_count == 3  # Probed once only.
+
+
+@pytest.mark.parametrize(
+    ("kwargs", "healthy"),
+    [
+        ({"status_code": 200}, True),
+        ({"status_code": 404}, False),
+        ({"exc": requests.exceptions.ConnectTimeout}, False),
+    ],
+)
+def test_probe(kwargs, healthy):
+    with requests_mock.Mocker() as mocked:
+        mocked.head(URL, **kwargs)
+        assert (Mirrors()._probe(URL) is not None) is healthy
+
+
+def test_download_from_local_mirror(tmp_path):
+    mirror = tmp_path / "mirror"
+    mirror.mkdir()
+    (mirror / "index.html").write_text("resp")
+    origin = (tmp_path / "origin" / "index.html").as_uri()  # Missing.
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    download([origin], dest.as_posix(), mirrors=Mirrors([mirror.as_uri()]))
+    assert (dest / "index.html").read_text() == "resp"
+
+
+def test_offline():
+    sut = Mirrors([MIRROR_A], offline=True)
+    assert sut.candidates(URL) == [SRC_A]
+    with patch.object(sut, "_probe", return_value=None):
+        assert sut.rank([URL]) == {URL: [SRC_A]}  # Never the origin.
@@ -1,15 +1,28 @@
 # -*- coding: utf-8 -*-
 # Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
 # type: ignore
+import json
 import pathlib
-import stat
-from unittest.mock import MagicMock, Mock, PropertyMock, mock_open, patch
+import subprocess
+from threading import Event
+from unittest.mock import MagicMock, Mock, PropertyMock, patch
 
 import pytest
-from plumbum import ProcessExecutionError, local
+from plumbum import CommandNotFound, local
+from ruamel.yaml import YAML
 
+from setupr.checks import SuiteResult
 from setupr.downloader import Downloader
-from setupr.pre_flight import SHA256SUM, PreFlight
+from setupr.pre_flight import (
+    GOSS_EXE,
+    GOSS_VERSION,
+    MAX_CONCURRENT_ENV,
+    SHA256SUM,
+    PreFlight,
+    max_concurrent,
+    shard,
+)
+from setupr.tools import ToolStore
 
 
 def test_home_bin():
@@ -31,38 +44,55 @@ def preflight():
         return PreFlight()
 
 
-def test_goss_version_good(preflight):
-    def _side_efect(cmd):  # pragma: no cover
-        if "--version" in cmd:
-            return "goss version v0.3.16\n"
-        return pytest.fail("Unexpected call to goss")  # Fail safe!
-
-    mgoss = MagicMock(side_effect=_side_efect)
+@pytest.fixture()
+def store(preflight, tmp_path):
+    preflight._tools = ToolStore(tmp_path / "tools")
+    preflight._bin = tmp_path / "bin"
+    preflight._bin.mkdir()
     preflight._downloader = MagicMock(spec=Downloader)
+    return preflight._tools
+
+
+def _fetch(source, destination, expected_hash, segmented=False):
+    destination.write_bytes(b"goss")
+    return True
+
+
+def test_goss_in_store(preflight, store):
+    path = store.path("goss", GOSS_VERSION)
+    path.parent.mkdir(parents=True)
+    path.write_bytes(b"goss")
+    store.add("goss", GOSS_VERSION, SHA256SUM[GOSS_EXE])
     with patch("setupr.pre_flight.local") as mlocal:
-        mlocal.__getitem__.return_value = mgoss
-        assert preflight.goss is mgoss
-        assert not preflight._downloader.fetch.called
+        assert preflight.goss is mlocal.__getitem__.return_value
+        mlocal.__getitem__.assert_called_once_with(path.as_posix())
+        assert not mlocal.__getitem__.return_value.called  # No --version.
+    assert not preflight._downloader.fetch.called
+    assert (preflight._bin / "goss").readlink() == path
 
 
-def test_goss_version_bad(preflight):
-    def _side_efect(cmd):  # pragma: no cover
-        if "--version" in cmd:
-            return "goß älért"  # Non chance!
-        return pytest.fail("Unexpected call to goss")  # Fail safe!
+def test_goss_fetched(preflight, store):
+    preflight._downloader.fetch.side_effect = _fetch
+    (preflight._bin / "goss").symlink_to("/old/goss")  # Replaced.
+    with patch("setupr.pre_flight.local"):
+        assert preflight.goss is not None
+    path = store.path("goss", GOSS_VERSION)
+    assert store.lookup("goss", GOSS_VERSION, SHA256SUM[GOSS_EXE]) == path
+    assert (preflight._bin / "goss").readlink() == path
 
-    mgoss = MagicMock(side_effect=_side_efect)
-    preflight._downloader = MagicMock(spec=Downloader)
-    with patch.object(
-        pathlib.Path, "symlink_to", lambda x, _: "goss" in x.as_posix()
-    ), patch.object(
-        pathlib.Path, "chmod", lambda _, x: x == stat.S_IRWXU
-    ), patch(
-        "setupr.pre_flight.local"
-    ) as mlocal:
-        mlocal.__getitem__.return_value = mgoss
-        assert preflight.goss is mgoss
-        assert preflight._downloader.fetch.called
+
+def test_goss_own_binary_kept(preflight, store):
+    preflight._downloader.fetch.side_effect = _fetch
+    (preflight._bin / "goss").write_bytes(b"mine")
+    with patch("setupr.pre_flight.local"):
+        assert preflight.goss is not None
+    assert (preflight._bin / "goss").read_bytes() == b"mine"
+
+
+def test_goss_fetch_failed(preflight, store):
+    preflight._downloader.fetch.return_value = False
+    with pytest.raises(CommandNotFound):
+        _ = preflight.goss
 
 
 def test_pre_flight_goss_is_cached(preflight):
@@ -86,13 +116,68 @@ def mock_preflight():
 def test_security(mock_preflight):
     mock_preflight._run = Mock(return_value=0)
     assert mock_preflight.security() == 0
-    mock_preflight._run.assert_called_once_with("security")
+    mock_preflight._run.assert_called_once_with("security", None)
 
 
 def test_infrastructure(mock_preflight):
     mock_preflight._run = Mock(return_value=13)
     assert mock_preflight.infrastructure() == 13
-    mock_preflight._run.assert_called_once_with("infrastructure")
+    mock_preflight._run.assert_called_once_with("infrastructure", None)
+
+
+@pytest.mark.parametrize(
+    ("env", "shards", "expected"),
+    [
+        (None, 1, 50),
+        (None, 8, 6),
+        ("16", 4, 4),
+        ("2", 8, 1),
+        ("ook", 2, 25),
+    ],
+)
+def test_max_concurrent(env, shards, expected, monkeypatch):
+    monkeypatch.delenv(MAX_CONCURRENT_ENV, raising=False)
+    if env is not None:
+        monkeypatch.setenv(MAX_CONCURRENT_ENV, env)
+    assert max_concurrent(shards) == expected
+
+
+GOSS_ARGS = (
+    "validate",
+    "--max-concurrent",
+    "50",
+    "--format",
+    "json",
+    "--no-color",
+)
+
+
+def _goss_json(*results):
+    """Return goss's JSON output, for (resource-id, successful, duration)."""
+    return json.dumps(
+        {
+            "results": [
+                {
+                    "resource-type": "Command",
+                    "resource-id": rid,
+                    "property": "exit-status",
+                    "successful": ok,
+                    "result": 0 if ok else 1,
+                    "duration": duration,
+                    "summary-line": f"Command: {rid}: ok={ok}",
+                }
+                for rid, ok, duration in results
+            ],
+            "summary": {},
+        }
+    ).encode()
+
+
+def _proc(retcode, communicate=((b"", b""),)):
+    proc = MagicMock(spec=subprocess.Popen)
+    proc.communicate.side_effect = communicate
+    proc.returncode = retcode
+    return proc
 
 
 @pytest.mark.parametrize(
@@ -102,26 +187,31 @@ def test_infrastructure(mock_preflight):
         (0),
     ],
 )
-def test_run(retcode, mock_preflight):
+def test_run(retcode, mock_preflight, tmp_path):
     with patch(
         "setupr.pre_flight.PreFlight.goss", new_callable=PropertyMock
-    ) as mock_goss:
+    ) as mock_goss, patch(
+        "setupr.pre_flight.take_backup", return_value=tmp_path / "log"
+    ):
         mgoss = MagicMock(spec=local)
-        mgoss.run = Mock(return_value=(retcode, "", ""))
+        mgoss.popen = Mock(
+            return_value=_proc(
+                retcode, [(_goss_json(("a", retcode == 0, 1)), b"")]
+            )
+        )
         mock_goss.return_value = mgoss
         mock_preflight._downloader.fetch = Mock()
-        assert mock_preflight._run("security") == retcode
-        mgoss.run.assert_called_once_with(
+        result = mock_preflight._run("security")
+        assert result.retcode == retcode
+        assert result.passed is (retcode == 0)
+        mgoss.popen.assert_called_once_with(
             (
                 "-g",
                 (
                     pathlib.Path.cwd()
                     / f"goss-security-{mock_preflight.OS_TYPE}.yaml"
                 ).as_posix(),
-                "validate",
-                "--format",
-                "documentation",
-                "--no-color",
+                *GOSS_ARGS,
             )
         )
         # If is_file is true, then we do not need to fetch it!
@@ -130,36 +220,181 @@ def test_run(retcode, mock_preflight):
 
 @patch("setupr.pre_flight.PreFlight.goss", new_callable=PropertyMock)
 @patch("setupr.pre_flight.take_backup")
-def test_run_process_execution_error(m_take_backup, mock_goss, mock_preflight):
-    mopen = mock_open()
-    mfdopen = Mock()
-    with patch("setupr.pre_flight.os.open", mfdopen), patch(
-        "setupr.pre_flight.os.fdopen", mopen
-    ):
-        m_take_backup.return_value = "xUnitTest"
-        mgoss = MagicMock(spec=local)
-        mgoss.run = Mock(side_effect=ProcessExecutionError("", 1, "", ""))
-        mock_goss.return_value = mgoss
-        mock_preflight._downloader.fetch = Mock()
-        assert mock_preflight._run("security") == 1
-        mgoss.run.assert_called_once_with(
-            (
-                "-g",
-                (
-                    pathlib.Path.cwd()
-                    / f"goss-security-{mock_preflight.OS_TYPE}.yaml"
-                ).as_posix(),
-                "validate",
-                "--format",
-                "documentation",
-                "--no-color",
-            )
+def test_run_failed(m_take_backup, mock_goss, mock_preflight, tmp_path):
+    m_take_backup.return_value = tmp_path / "goss-security.json"
+    mgoss = MagicMock(spec=local)
+    mgoss.popen = Mock(return_value=_proc(1, [(b"", b"Bad YAML")]))
+    mock_goss.return_value = mgoss
+    mock_preflight._downloader.fetch = Mock()
+    result = mock_preflight._run("security")
+    assert result.retcode == 1
+    assert result.error == "Bad YAML"
+    assert mock_preflight._downloader.fetch.called is True
+    m_take_backup.assert_called_once_with(
+        pathlib.Path.cwd() / "goss-security.json"
+    )
+    assert SuiteResult.load(tmp_path / "goss-security.json") == result
+
+
+@patch("setupr.pre_flight.PreFlight.goss", new_callable=PropertyMock)
+@patch("setupr.pre_flight.take_backup")
+def test_run_cancelled(m_take_backup, mock_goss, mock_preflight):
+    cancel = Event()
+    cancel.set()
+    proc = _proc(-9, [subprocess.TimeoutExpired("goss", 0.1), (b"", b"")])
+    mgoss = MagicMock(spec=local)
+    mgoss.popen = Mock(return_value=proc)
+    mock_goss.return_value = mgoss
+    mock_preflight._downloader.fetch = Mock()
+    assert mock_preflight._run("security", cancel).cancelled
+    assert proc.kill.called
+    assert not m_take_backup.called  # No log of a killed run.
+
+
+GOSS_YAML = """\
+file:
+  /etc/hosts:
+    exists: true
+  /etc/passwd:
+    exists: true
+package:
+  nginx:
+    installed: true
+command:
+  slow-one:
+    exit-status: 0
+  slow-two:
+    exit-status: 0
+"""
+
+
+def _resources(path):
+    data = YAML(typ="safe").load(path)
+    return {(kind, name) for kind, entries in data.items() for name in entries}
+
+
+def test_shard(tmp_path):
+    check = tmp_path / "goss-infrastructure-RHEL.yaml"
+    check.write_text(GOSS_YAML)
+    shards = shard(check, tmp_path, 2)
+    assert len(shards) == 2
+    parts = [_resources(path) for path in shards]
+    assert parts[0] | parts[1] == _resources(check)
+    assert not parts[0] & parts[1]
+    # The slow commands are spread over the shards.
+    assert all(
+        ("command", f"slow-{n}") in p for n, p in zip(("one", "two"), parts)
+    )
+
+
+@pytest.mark.parametrize(
+    ("content", "count"),
+    [
+        (GOSS_YAML, 1),
+        ("file:\n  /etc/hosts:\n    exists: true\n", 4),
+        ("gossfile:\n  other.yaml: {}\n" + GOSS_YAML, 4),
+        ("file:\n  {{.Vars.path}}:\n    exists: true\n" + GOSS_YAML, 4),
+        ("file: [\n", 4),
+    ],
+)
+def test_shard_not_split(tmp_path, content, count):
+    check = tmp_path / "goss.yaml"
+    check.write_text(content)
+    assert shard(check, tmp_path, count) == [check]
+
+
+@patch("setupr.pre_flight.PreFlight.goss", new_callable=PropertyMock)
+@patch("setupr.pre_flight.take_backup")
+def test_run_sharded(m_take_backup, mock_goss, mock_preflight, tmp_path):
+    check = tmp_path / "goss.yaml"
+    check.write_text(GOSS_YAML)
+    mgoss = MagicMock(spec=local)
+    mgoss.popen = Mock(
+        side_effect=[
+            _proc(0, [(_goss_json(("a", True, 5)), b"")]),
+            _proc(1, [(_goss_json(("b", False, 9)), b"")]),
+        ]
+    )
+    mock_goss.return_value = mgoss
+    m_take_backup.return_value = tmp_path / "goss-security.json"
+    with patch.object(
+        mock_preflight, "_fetch_file", return_value=check
+    ), patch("setupr.pre_flight.shard_count", return_value=2):
+        result = mock_preflight._run("security")
+    assert mgoss.popen.call_count == 2
+    assert result.retcode == 1
+    assert [c.resource_id for c in result.checks] == ["a", "b"]
+    assert [c.resource_id for c in result.failures] == ["b"]
+    assert [c.resource_id for c in result.slowest()] == ["b", "a"]
+    assert SuiteResult.load(tmp_path / "goss-security.json") == result
+
+
+@pytest.mark.parametrize("full", [False, True])
+@patch("setupr.pre_flight.PreFlight.goss", new_callable=PropertyMock)
+@patch("setupr.pre_flight.take_backup")
+def test_run_incremental(
+    m_take_backup, mock_goss, mock_preflight, tmp_path, full, monkeypatch
+):
+    monkeypatch.setenv("SETUPR_PREFLIGHT_TTL", "0")  # No verdicts.
+    hosts = tmp_path / "hosts"
+    hosts.touch()
+    check = tmp_path / "goss.yaml"
+    check.write_text(f"file:\n  {hosts}:\n    exists: true\n")
+    passed = json.dumps(
+        {
+            "results": [
+                {
+                    "resource-type": "File",
+                    "resource-id": hosts.as_posix(),
+                    "property": "exists",
+                    "successful": True,
+                    "result": 0,
+                }
+            ]
+        }
+    ).encode()
+    mgoss = MagicMock(spec=local)
+    mgoss.popen = Mock(side_effect=lambda _: _proc(0, [(passed, b"")]))
+    mock_goss.return_value = mgoss
+    m_take_backup.return_value = tmp_path / "goss-security.json"
+    mock_preflight._full = full
+    with patch.object(mock_preflight, "_fetch_file", return_value=check):
+        first = mock_preflight._run("security")
+        second = mock_preflight._run("security")
+    assert first.passed and second.passed
+    assert second.checks == first.checks
+    assert mgoss.popen.call_count == (2 if full else 1)
+
+
+@pytest.mark.parametrize(
+    ("retcode", "full", "runs"),
+    [
+        (0, False, 1),
+        (0, True, 2),
+        (1, False, 2),  # Failures are not remembered.
+    ],
+)
+@patch("setupr.pre_flight.PreFlight.goss", new_callable=PropertyMock)
+@patch("setupr.pre_flight.take_backup")
+def test_run_verdict(
+    m_take_backup, mock_goss, mock_preflight, tmp_path, retcode, full, runs
+):
+    mgoss = MagicMock(spec=local)
+    mgoss.popen = Mock(
+        side_effect=lambda _: _proc(
+            retcode, [(_goss_json(("a", retcode == 0, 1)), b"")]
         )
-        # If is_file is true, then we do not need to fetch it!
-        assert mock_preflight._downloader.fetch.called is True
-        assert m_take_backup.called
-        mfdopen.assert_called_once_with("xUnitTest", 66)
-        assert mopen.called
+    )
+    mock_goss.return_value = mgoss
+    m_take_backup.return_value = tmp_path / "goss-security.json"
+    mock_preflight._full = full
+    mock_preflight._downloader.fetch = Mock()
+    first = mock_preflight._run("security")
+    second = mock_preflight._run("security")
+    assert second.checks == first.checks
+    assert second.passed is first.passed
+    assert mgoss.popen.call_count == runs
+    assert mock_preflight._downloader.fetch.call_count == runs
 
 
 @pytest.mark.parametrize(
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
+# type: ignore
+import io
+from unittest.mock import patch
+
+import pytest
+from rich.console import Console
+
+from setupr.progress import TransferProgress, get_progress
+
+
+@pytest.fixture()
+def terminal():
+    return Console(file=io.StringIO(), force_terminal=True)
+
+
+def test_get_progress_is_shared():
+    assert get_progress() is get_progress()
+
+
+def test_silent_when_not_a_terminal():
+    sut = TransferProgress(Console(file=io.StringIO(), force_terminal=False))
+    assert sut.disable
+    task_id = sut.add_task("download", filename="ranni", total=10)
+    with sut, patch("rich.progress.Progress.update") as mocked_update:
+        sut.update(task_id, advance=5)
+        sut.update(task_id, total=20)
+        assert not mocked_update.called
+    assert sut.tasks[0].completed == 0
+
+
+def test_advances_are_batched(terminal):
+    sut = TransferProgress(terminal, refresh_per_second=0.001)
+    task_id = sut.add_task("download", filename="ranni", total=100)
+    sut.update(task_id, advance=1)  # First one flushes.
+    for _ in range(9):
+        sut.update(task_id, advance=1)
+    assert sut.tasks[0].completed == 1, "The other advances are pending"
+    sut.flush()
+    assert sut.tasks[0].completed == 10
+
+
+def test_other_updates_flush_first(terminal):
+    sut = TransferProgress(terminal, refresh_per_second=0.001)
+    task_id = sut.add_task("download", filename="ranni", total=100)
+    sut.update(task_id, advance=1)
+    sut.update(task_id, advance=2)
+    sut.update(task_id, total=200)
+    assert sut.tasks[0].completed == 3
+    assert sut.tasks[0].total == 200
+
+
+def test_remove_task_drops_its_advances(terminal):
+    sut = TransferProgress(terminal, refresh_per_second=0.001)
+    task_id = sut.add_task("download", filename="ranni", total=100)
+    sut.update(task_id, advance=1)
+    sut.update(task_id, advance=2)
+    sut.remove_task(task_id)
+    assert sut.task_ids == []
+    sut.flush()
+
+
+def test_nested_use(terminal):
+    sut = TransferProgress(terminal)
+    with sut:
+        assert sut.live.is_started
+        with sut:
+            assert sut.live.is_started
+        assert sut.live.is_started, "Still used by the outer block"
+    assert not sut.live.is_started
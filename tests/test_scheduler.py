@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
+# type: ignore
+import time
+from threading import Barrier
+
+import pytest
+
+from setupr.scheduler import Scheduler, SchedulerError
+
+
+def test_run_concurrently():
+    """Independent steps run at the same time, or the barrier breaks."""
+    barrier = Barrier(3, timeout=5)
+    sut = Scheduler()
+    for name in ("a", "b", "c"):
+        sut.add(name, lambda: barrier.wait() is not None)
+    assert sut.run() == {"a": True, "b": True, "c": True}
+
+
+def test_run_in_order():
+    ran = []
+
+    def _step(name):
+        def _run():
+            time.sleep(0.01)
+            ran.append(name)
+            return True
+
+        return _run
+
+    sut = Scheduler()
+    sut.add("verify", _step("verify"), after=("key", "download"))
+    sut.add("key", _step("key"))
+    sut.add("download", _step("download"))
+    sut.add("execute", _step("execute"), after=("verify",))
+    assert all(sut.run().values())
+    assert ran[2:] == ["verify", "execute"]
+
+
+@pytest.mark.parametrize("failure", [lambda: False, lambda: 1 / 0])
+def test_failure_skips_and_cancels(failure):
+    sut = Scheduler()
+    sut.add("fail", failure)
+    sut.add("after", lambda: True, after=("fail",))
+    sut.add("slow", lambda: time.sleep(0.1) is None)
+    sut.add("other", lambda: True, after=("slow",))
+    assert sut.run() == {
+        "fail": False,
+        "after": None,
+        "slow": True,  # Already running.
+        "other": None,  # Cancelled.
+    }
+    assert sut.cancel.is_set()
+
+
+def test_invalid_graph():
+    sut = Scheduler()
+    sut.add("a", lambda: True, after=("b",))
+    with pytest.raises(SchedulerError):
+        sut.add("a", lambda: True)
+    with pytest.raises(SchedulerError, match="unknown"):
+        sut.run()
+    sut.add("b", lambda: True, after=("a",))
+    with pytest.raises(SchedulerError, match="Cycle"):
+        sut.run()
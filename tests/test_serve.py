@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
+# type: ignore
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Thread
+from unittest.mock import patch
+
+import pytest
+import requests
+import requests_mock
+
+from setupr.cache import ArtifactCache
+from setupr.downloader import WORLDR_URL_INSTALL
+from setupr.pre_flight import GOSS_EXE
+from setupr.serve import CacheServer, parse_address
+
+NAME = "worldr-aa-v1.2.3.sh"
+URL = f"{WORLDR_URL_INSTALL}/{NAME}"
+DATA = b"#!/bin/sh\necho ranni\n"
+SHA = hashlib.sha256(DATA).hexdigest()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ArtifactCache(tmp_path / "cache")
+
+
+@pytest.fixture
+def server(cache):
+    sut = CacheServer(("127.0.0.1", 0), cache)
+    thread = Thread(
+        target=sut.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    )
+    thread.start()
+    yield sut
+    sut.shutdown()
+    sut.server_close()
+
+
+def _url(server, name=NAME):
+    return f"http://127.0.0.1:{server.server_address[1]}/{name}"
+
+
+def _store(cache, tmp_path, url=URL, data=DATA):
+    src = tmp_path / "src"
+    src.write_bytes(data)
+    cache.store(url, src, hashlib.sha256(data).hexdigest())
+
+
+def test_parse_address():
+    assert parse_address("8765") == ("", 8765)
+    assert parse_address("127.0.0.1:80") == ("127.0.0.1", 80)
+    with pytest.raises(ValueError):
+        parse_address("ook")
+
+
+def test_upstream(cache, tmp_path):
+    sut = CacheServer(("127.0.0.1", 0), cache)
+    try:
+        assert sut.upstream(NAME) == URL
+        assert sut.upstream(GOSS_EXE).endswith(f"/{GOSS_EXE}")
+        _store(cache, tmp_path, "https://elsewhere.com/x/" + NAME)
+        assert sut.upstream(NAME) == "https://elsewhere.com/x/" + NAME
+    finally:
+        sut.server_close()
+
+
+@pytest.mark.parametrize(
+    ("headers", "code", "body"),
+    [
+        ({}, 200, DATA),
+        ({"Range": "bytes=2-"}, 206, DATA[2:]),
+        ({"Range": "bytes=0-1"}, 206, DATA[:2]),
+        ({"Range": "bytes=2-", "If-Range": '"old"'}, 200, DATA),
+        ({"Range": f"bytes={len(DATA)}-"}, 416, b""),
+    ],
+)
+def test_get_cached(server, cache, tmp_path, headers, code, body):
+    _store(cache, tmp_path)
+    with patch("setupr.serve.download") as mocked:
+        response = requests.get(_url(server), headers=headers)
+        assert not mocked.called
+    assert response.status_code == code
+    assert response.content == body
+    if code != 416:
+        assert response.headers["etag"] == f'"{SHA}"'
+
+
+def test_head_cached(server, cache, tmp_path):
+    _store(cache, tmp_path)
+    response = requests.head(_url(server))
+    assert response.status_code == 200
+    assert response.headers["content-length"] == str(len(DATA))
+
+
+def test_head_not_cached(server):
+    """Nothing is asked upstream, this mirror must not be slower."""
+    with patch("setupr.serve.download") as mocked, patch(
+        "requests.Session.head"
+    ) as upstream:
+        response = requests.head(_url(server))
+        assert not mocked.called
+        assert not upstream.called
+    assert response.status_code == 200
+    assert "content-length" not in response.headers
+
+
+@pytest.mark.parametrize("name", ["", "..", ".hidden", "a%2Fb"])
+def test_invalid_name(server, name):
+    assert requests.get(_url(server, name)).status_code == 404
+
+
+def test_get_coalesced(server, cache, tmp_path):
+    """Many concurrent requests, a single upstream fetch."""
+
+    def _download(urls, dest_dir, **kwargs):
+        time.sleep(0.2)  # Let the other requests pile up.
+        _store(kwargs["cache"], Path(dest_dir), urls[0])
+
+    with patch("setupr.serve.download", side_effect=_download) as mocked:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(
+                pool.map(lambda _: requests.get(_url(server)), range(8))
+            )
+        assert mocked.call_count == 1
+    assert all(response.content == DATA for response in responses)
+    assert server._fetching == {}, "Nothing kept once fetched"
+
+
+def test_get_upstream_failure(server):
+    with patch(
+        "setupr.serve.download",
+        side_effect=requests.exceptions.ConnectionError,
+    ):
+        assert requests.get(_url(server)).status_code == 502
+    assert server._fetching == {}
+
+
+@pytest.mark.parametrize(("upstream", "code"), [(404, 404), (503, 502)])
+def test_get_upstream_status(server, upstream, code):
+    """Only the transient failures are worth retrying through a 502."""
+    with requests_mock.Mocker(real_http=True) as mocker, patch(
+        "setupr.downloader.RetryPolicy.delay", return_value=0.0
+    ):
+        fetched = mocker.get(URL, status_code=upstream)
+        assert requests.get(_url(server)).status_code == code
+        if upstream == 404:
+            assert fetched.call_count == 1, "Fetched once, not retried"
+    assert server._fetching == {}
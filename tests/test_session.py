@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
+# type: ignore
+import pytest
+import requests_mock
+
+from setupr import session
+from setupr.session import (
+    CONNECT_TIMEOUT,
+    MAX_WORKERS,
+    READ_TIMEOUT,
+    close_session,
+    get_session,
+)
+
+URL = "https://worldr.com/index.html"
+
+
+@pytest.fixture(autouse=True)
+def fresh_session():
+    close_session()
+    yield
+    close_session()
+
+
+def test_session_is_shared():
+    assert get_session() is get_session()
+    assert session._pool_maxsize == MAX_WORKERS
+
+
+def test_session_pool_grows():
+    sut = get_session()
+    assert get_session(MAX_WORKERS * 2) is sut
+    assert session._pool_maxsize == MAX_WORKERS * 2
+    assert sut.get_adapter(URL)._pool_maxsize == MAX_WORKERS * 2
+    get_session(1)  # Never shrinks.
+    assert session._pool_maxsize == MAX_WORKERS * 2
+
+
+def test_session_close():
+    sut = get_session()
+    close_session()
+    assert get_session() is not sut
+
+
+@pytest.mark.parametrize(
+    ("kwargs", "expected"),
+    [
+        ({}, (CONNECT_TIMEOUT, READ_TIMEOUT)),
+        ({"timeout": 1}, 1),
+    ],
+)
+def test_session_timeouts(kwargs, expected):
+    with requests_mock.Mocker() as mocked:
+        mocked.get(URL, text="resp")
+        get_session().get(URL, **kwargs)
+        assert mocked.last_request.timeout == expected
+
+
+@pytest.fixture
+def local_file(tmp_path):
+    path = tmp_path / "index.html"
+    path.write_text("resp")
+    return path
+
+
+@pytest.mark.parametrize(
+    ("headers", "code", "body", "content_range"),
+    [
+        ({}, 200, "resp", None),
+        ({"Range": "bytes=2-"}, 206, "sp", "bytes 2-3/4"),
+        ({"Range": "bytes=1-2"}, 206, "es", "bytes 1-2/4"),
+        ({"Range": "bytes=2-", "If-Range": "old"}, 200, "resp", None),
+        ({"Range": "bytes=4-"}, 416, "", "bytes */4"),
+    ],
+)
+def test_file_adapter(local_file, headers, code, body, content_range):
+    response = get_session().get(local_file.as_uri(), headers=headers)
+    assert response.status_code == code
+    assert response.text == body
+    assert response.headers.get("content-range") == content_range
+
+
+def test_file_adapter_if_range(local_file):
+    response = get_session().head(local_file.as_uri())
+    response = get_session().get(
+        local_file.as_uri(),
+        headers={
+            "Range": "bytes=2-",
+            "If-Range": response.headers["last-modified"],
+        },
+    )
+    assert response.status_code == 206
+    assert response.text == "sp"
+
+
+def test_file_adapter_head(local_file):
+    response = get_session().head(local_file.as_uri())
+    assert response.status_code == 200
+    assert response.headers["content-length"] == "4"
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.content == b""
+
+
+def test_file_adapter_not_found(tmp_path):
+    assert get_session().get((tmp_path / "nope").as_uri()).status_code == 404
+    assert get_session().get(tmp_path.as_uri()).status_code == 404
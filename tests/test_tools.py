@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
+# type: ignore
+import os
+
+import pytest
+
+from setupr.tools import ToolStore
+
+SHA = "827e354b48f93bce933f5efcd1f00dc82569c42a179cf2d384b040d8a80bfbfb"
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ToolStore(tmp_path / "tools")
+
+
+def _install(store, version, data=b"goss"):
+    path = store.path("goss", version)
+    path.parent.mkdir(parents=True)
+    path.write_bytes(data)
+    return store.add("goss", version, SHA)
+
+
+def test_default_root(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", tmp_path.as_posix())
+    assert ToolStore().path("goss", "v1") == (
+        tmp_path / "setupr" / "tools" / "goss" / "v1" / "goss"
+    )
+
+
+def test_side_by_side(store):
+    assert store.lookup("goss", "v0.3.16") is None
+    old = _install(store, "v0.3.16")
+    new = _install(store, "v0.4.0")
+    assert store.lookup("goss", "v0.3.16") == old
+    assert store.lookup("goss", "v0.4.0", SHA) == new
+    assert os.access(new, os.X_OK)
+    assert store.lookup("goss", "v0.4.0", "other") is None
+
+
+def test_changed(store):
+    path = _install(store, "v0.3.16")
+    path.write_bytes(b"tampered")
+    assert store.lookup("goss", "v0.3.16") is None
+    path.unlink()
+    assert store.lookup("goss", "v0.3.16") is None
+
+
+def test_invalid_manifest(store):
+    _install(store, "v0.3.16")
+    (store.root / "manifest.json").write_text("ook")
+    assert store.lookup("goss", "v0.3.16") is None
@@ -1,17 +1,25 @@
 # -*- coding: utf-8 -*-
 # Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
 """Utilities."""
+import json
+import time
 from pathlib import Path
+from unittest.mock import patch
 
 import pytest
+import requests
 import requests_mock
 
 from setupr import __version__
 from setupr.utils import (
     GITHUB_URL,
+    VERSION_CHECK_TTL,
     VersionCheck,
     check_if_latest_version,
+    file_sha256,
     join_with_oxford_commas,
+    start_version_check,
+    write_json,
 )
 
 
@@ -53,3 +61,57 @@ def test_check_if_latest_version(
     with requests_mock.Mocker() as mocked:
         mocked.get(GITHUB_URL, json=payload, status_code=status)
         assert check_if_latest_version() == expected
+
+
+def test_check_if_latest_version_cached() -> None:
+    with requests_mock.Mocker() as mocked:
+        mocked.get(
+            GITHUB_URL,
+            json={"tag_name": "v0.0.0"},
+            headers={"ETag": '"ook"'},
+        )
+        assert check_if_latest_version() == VersionCheck.LAGGING
+        assert check_if_latest_version() == VersionCheck.LAGGING
+        assert mocked.call_count == 1  # Within the TTL.
+    with patch(
+        "setupr.utils.time.time", return_value=time.time() + VERSION_CHECK_TTL
+    ):
+        with requests_mock.Mocker() as mocked:
+            mocked.get(GITHUB_URL, status_code=304)
+            assert check_if_latest_version() == VersionCheck.LAGGING
+            assert mocked.last_request.headers["If-None-Match"] == '"ook"'
+
+
+def test_check_if_latest_version_offline() -> None:
+    with requests_mock.Mocker() as mocked:
+        mocked.get(GITHUB_URL, exc=requests.exceptions.ConnectionError)
+        assert check_if_latest_version() == VersionCheck.UNKNOWN
+        mocked.get(GITHUB_URL, status_code=304)  # Nothing cached.
+        assert check_if_latest_version() == VersionCheck.UNKNOWN
+
+
+def test_start_version_check() -> None:
+    with patch(
+        "setupr.utils.check_if_latest_version",
+        return_value=VersionCheck.LATEST,
+    ):
+        future = start_version_check()
+        assert future.result(timeout=5) == VersionCheck.LATEST
+
+
+def test_file_sha256() -> None:
+    assert (
+        file_sha256(Path(__file__).parent / "charon-lord-dunsany.txt")
+        == "4362bac71d971fc7d7b69a757de6fbcb5e1c513b393609043cae67b5341bd4af"
+    )
+
+
+def test_write_json(tmp_path: Path) -> None:
+    path = tmp_path / "deep" / "state.json"
+    write_json(path, {"ranni": 1})
+    write_json(path, {"ranni": 2}, indent=2)
+    assert path.read_text() == '{\n  "ranni": 2\n}'
+    assert [p.name for p in path.parent.iterdir()] == ["state.json"]
+    with pytest.raises(TypeError):
+        write_json(path, {"ranni": object()})
+    assert json.loads(path.read_text()) == {"ranni": 2}
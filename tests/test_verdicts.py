@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2022-present Worldr Technologies Limited. All Rights Reserved.
+# type: ignore
+import time
+from unittest.mock import patch
+
+import pytest
+
+from setupr.checks import CheckResult, SuiteResult
+from setupr.verdicts import DEFAULT_TTL, Verdicts, host_fingerprint, ttl
+
+PASSED = SuiteResult(
+    "security", 0, (CheckResult("File", "/etc/hosts", "exists", True),), 42
+)
+
+
+def test_host_fingerprint():
+    assert host_fingerprint("a", "b") == host_fingerprint("a", "b")
+    assert host_fingerprint("a", "b") != host_fingerprint("a", "c")
+    with patch("setupr.verdicts.platform.release", return_value="6.6.6"):
+        assert host_fingerprint("a", "b") != host_fingerprint("a", "c")
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"), [(None, DEFAULT_TTL), ("60", 60), ("ook", 3600)]
+)
+def test_ttl(monkeypatch, value, expected):
+    if value is not None:
+        monkeypatch.setenv("SETUPR_PREFLIGHT_TTL", value)
+    assert ttl() == expected
+
+
+def test_get_put(tmp_path):
+    sut = Verdicts(tmp_path / "verdicts.json")
+    assert sut.get("security", "key") is None
+    sut.put("security", "key", PASSED)
+    assert sut.get("security", "key") == PASSED
+    assert sut.get("security", "other") is None
+    assert sut.get("infrastructure", "key") is None
+    with patch("setupr.verdicts.time.time", return_value=time.time() + 3600):
+        assert sut.get("security", "key") is None  # Expired.
+
+
+def test_failure_forgets(tmp_path):
+    sut = Verdicts(tmp_path / "verdicts.json")
+    sut.put("security", "key", PASSED)
+    sut.put("security", "key", SuiteResult("security", 1))
+    assert sut.get("security", "key") is None
+
+
+def test_invalid(tmp_path):
+    path = tmp_path / "verdicts.json"
+    path.write_text('{"security": {"key": "key", "checked": 1e99}}')
+    assert Verdicts(path).get("security", "key") is None
+    path.write_text("ook")
+    assert Verdicts(path).get("security", "key") is None